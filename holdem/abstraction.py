@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Card abstraction: the situations of a street grouped into buckets of hands
+that play alike.
+
+Hands are clustered by the histogram of their river equity over the
+runouts (see `holdem.hand_strength`) with k-means under the earth mover's
+distance, so a draw and a made hand of the same average strength land in
+different buckets. Build the buckets of a street once its hand strength
+table exists with `python -m holdem.abstraction --street flop --buckets
+200`, they are stored next to the table and memory-mapped on first lookup.
+Streets without buckets, like the river, are bucketed by EHS into
+DEFAULT_BUCKETS equal intervals.
+"""
+
+import numpy as np
+
+from .hand_strength import HAND_STRENGTH_TABLES, STREETS, SituationTable
+
+DEFAULT_BUCKETS = 50
+# Largest number of buckets of a street, the size of observation spaces
+MAX_BUCKETS = 1000
+# Histograms compared to every center at once
+ASSIGN_CHUNK = 4096
+
+
+def emd(histograms, centers):
+    """
+    Earth mover's distances (n_histograms, n_centers) between histograms
+    over equal bins of [0, 1], the L1 distance between their CDFs.
+    """
+    histograms = np.cumsum(histograms, axis=-1)
+    centers = np.cumsum(centers, axis=-1)
+    return (np.abs(histograms[:, None, :] - centers[None, :, :]).sum(axis=2)
+            / histograms.shape[1])
+
+
+def assign(histograms, centers):
+    """Nearest center of every histogram and the distance to it."""
+    labels = np.empty(len(histograms), dtype=np.int64)
+    distances = np.empty(len(histograms))
+    for start in range(0, len(histograms), ASSIGN_CHUNK):
+        chunk = slice(start, start + ASSIGN_CHUNK)
+        d = emd(np.asarray(histograms[chunk], dtype=np.float64), centers)
+        labels[chunk] = d.argmin(axis=1)
+        distances[chunk] = d[np.arange(len(d)), labels[chunk]]
+    return labels, distances
+
+
+def kmeans(histograms, n_buckets, rng, n_iterations=30, pool=None):
+    """
+    Cluster histograms (n, n_bins) into n_buckets with k-means++ seeding.
+    Assignments are split over the processes of `pool` when given. Returns
+    the label of every histogram and the centers.
+    """
+    histograms = np.asarray(histograms, dtype=np.float64)
+    n_buckets = min(n_buckets, len(histograms))
+    centers = histograms[[rng.integers(len(histograms))]]
+    distances = emd(histograms, centers)[:, 0]
+    for _ in range(1, n_buckets):
+        total = distances.sum()
+        if total == 0:
+            new = rng.integers(len(histograms))
+        else:
+            new = rng.choice(len(histograms), p=distances / total)
+        centers = np.vstack([centers, histograms[new]])
+        distances = np.minimum(distances,
+                               emd(histograms, histograms[[new]])[:, 0])
+
+    labels = None
+    for _ in range(n_iterations):
+        new_labels, distances = _assign(histograms, centers, pool)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=n_buckets)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, histograms)
+        empty = counts == 0
+        centers = np.where(empty[:, None], centers,
+                           sums / np.maximum(counts, 1)[:, None])
+        # restart empty buckets on the histograms farthest from theirs
+        farthest = np.argsort(-distances)[:empty.sum()]
+        centers[empty] = histograms[farthest]
+    return labels, centers
+
+
+def _assign(histograms, centers, pool):
+    if pool is None:
+        return assign(histograms, centers)
+    chunks = np.array_split(histograms, max(1, len(histograms)
+                                            // ASSIGN_CHUNK))
+    results = pool.starmap(assign, [(chunk, centers) for chunk in chunks])
+    return (np.concatenate([labels for labels, _ in results]),
+            np.concatenate([distances for _, distances in results]))
+
+
+class BucketTable(SituationTable):
+    """Bucket of every situation of one street and the bucket centers."""
+
+    PREFIX = 'buckets'
+    NAMES = ('keys', 'buckets', 'centers')
+
+    @property
+    def n_buckets(self):
+        if not self.available:
+            return DEFAULT_BUCKETS
+        return len(self.load()['centers'])
+
+    def bucket(self, hand, board, equity):
+        """
+        Bucket of the hand on the board, from the table or from the hand
+        strength features `equity.get_hand_strength` gives.
+        """
+        if self.available:
+            i = self.index(hand, board)
+            if i is not None:
+                return int(self.load()['buckets'][i])
+        features = equity.get_hand_strength(hand, board)
+        if self.available:
+            return int(assign(features[None, 2:],
+                              self.load()['centers'])[0][0])
+        return min(int(features[0] * DEFAULT_BUCKETS), DEFAULT_BUCKETS - 1)
+
+
+# Shared by every Equity in the process, keyed by number of board cards
+BUCKET_TABLES = {n_cards: BucketTable(street)
+                 for street, n_cards in dict(STREETS, river=5).items()}
+
+
+def build_buckets(street, n_buckets, processes=None, seed=0,
+                  n_iterations=30):
+    """Cluster the hand strength table of the street, see `kmeans`."""
+    from multiprocessing import Pool
+    table = HAND_STRENGTH_TABLES[STREETS[street]]
+    if not table.available:
+        raise ValueError('Build the %s hand strength table first with '
+                         'python -m holdem.hand_strength --street %s'
+                         % (street, street))
+    arrays = table.load()
+    rng = np.random.default_rng(seed)
+    with Pool(processes) as pool:
+        labels, centers = kmeans(arrays['features'][:, 2:], n_buckets, rng,
+                                 n_iterations, pool)
+    return (np.array(arrays['keys']), labels.astype(np.int16),
+            centers.astype(np.float32))
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description='Cluster hand strength tables into buckets.')
+    parser.add_argument('--street', nargs='+', default=['preflop'],
+                        choices=list(STREETS))
+    parser.add_argument('--buckets', type=int, default=20,
+                        help='buckets per street, at most %d' % MAX_BUCKETS)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes, defaults to all cores')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if not 1 <= args.buckets <= MAX_BUCKETS:
+        parser.error('--buckets must be between 1 and %d' % MAX_BUCKETS)
+
+    for street in args.street:
+        start = time.time()
+        keys, buckets, centers = build_buckets(
+            street, args.buckets, args.processes, args.seed, args.iterations)
+        BUCKET_TABLES[STREETS[street]].save(keys=keys, buckets=buckets,
+                                            centers=centers)
+        print('Clustered %d %s situations into %d buckets in %ss'
+              % (len(keys), street, len(centers), time.time() - start))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Suit isomorphism of hole cards and boards.
+
+Two situations are isomorphic when one can be turned into the other by
+renaming suits. Cards are grouped in rounds (hole cards, board, dead cards,
+...) and the order of cards inside a round does not matter.
+
+`canonical_key` is a cheap hashable key, equal for isomorphic situations.
+`HandIndexer` maps the situations of a fixed round shape to a dense index in
+[0, size) and back, following the hand isomorphism indexing scheme of Waugh
+(2013).
+"""
+
+from bisect import bisect_right
+from itertools import product
+from math import comb
+
+from treys import Card
+
+N_RANKS = 13
+N_SUITS = 4
+# treys suit bits in canonical order
+SUITS = (1, 2, 4, 8)
+# Index of each suit from its bit in a treys card, (card >> 12) & 0xF
+SUIT_INDEX = {1: 0, 2: 1, 4: 2, 8: 3}
+_RANK_MASK = (1 << N_RANKS) - 1
+
+
+def canonical_key(*rounds):
+    """
+    Key of a situation given as card lists per round, e.g.
+    `canonical_key(hand, board, dead)`.
+    """
+    signatures = [0, 0, 0, 0]
+    for cards in rounds:
+        signatures = [sig << N_RANKS for sig in signatures]
+        for card in cards:
+            signatures[SUIT_INDEX[(card >> 12) & 0xF]] |= (
+                (card >> 16) & _RANK_MASK)
+    signatures.sort(reverse=True)
+    return tuple(signatures)
+
+
+def suit_permutation(*rounds):
+    """Suit mapping (treys suit bit -> treys suit bit) to the canonical form."""
+    signatures = {suit: 0 for suit in SUITS}
+    for cards in rounds:
+        for suit in SUITS:
+            signatures[suit] <<= N_RANKS
+        for card in cards:
+            signatures[(card >> 12) & 0xF] |= (card >> 16) & _RANK_MASK
+    order = sorted(SUITS, key=lambda suit: signatures[suit], reverse=True)
+    return {suit: SUITS[i] for i, suit in enumerate(order)}
+
+
+def permute_suits(cards, permutation):
+    return [Card.new(Card.STR_RANKS[Card.get_rank_int(c)]
+                     + Card.INT_SUIT_TO_CHAR_SUIT[permutation[
+                         Card.get_suit_int(c)]])
+            for c in cards]
+
+
+def canonicalize(*rounds):
+    """
+    Canonical representative of a situation and the suit permutation that
+    produced it. Invert it with `permute_suits(cards, invert(permutation))`.
+    """
+    permutation = suit_permutation(*rounds)
+    return ([sorted(permute_suits(cards, permutation)) for cards in rounds],
+            permutation)
+
+
+def invert(permutation):
+    return {new: old for old, new in permutation.items()}
+
+
+def _rank_set_index(mask, used):
+    """Colex index of a rank bit mask among the ranks not in `used`."""
+    index, i = 0, 1
+    while mask:
+        low = mask & -mask
+        position = low.bit_length() - 1 - bin(used & (low - 1)).count('1')
+        index += comb(position, i)
+        mask ^= low
+        i += 1
+    return index
+
+
+def _rank_set(index, size, used):
+    """Inverse of `_rank_set_index`, returns the rank bit mask."""
+    free = [r for r in range(N_RANKS) if not used >> r & 1]
+    mask = 0
+    for k in range(size, 0, -1):
+        position = k - 1
+        while comb(position + 1, k) <= index:
+            position += 1
+        index -= comb(position, k)
+        mask |= 1 << free[position]
+    return mask
+
+
+def _multiset_index(values):
+    """Index of a multiset of indices given in descending order."""
+    m = len(values)
+    return sum(comb(v + m - 1 - i, m - i) for i, v in enumerate(values))
+
+
+def _multiset(index, m):
+    values = []
+    for k in range(m, 0, -1):
+        v = k - 1
+        while comb(v + 1, k) <= index:
+            v += 1
+        index -= comb(v, k)
+        values.append(v - (k - 1))
+    return values
+
+
+class HandIndexer():
+    """
+    Dense index of suit isomorphic situations with `cards_per_round` cards in
+    each round, e.g. (2,) for preflop or (2, 3) for hole cards and a flop.
+    """
+
+    def __init__(self, cards_per_round):
+        self.cards_per_round = tuple(cards_per_round)
+        configurations = set()
+        for counts in product(*[self._suit_counts(n)
+                                for n in self.cards_per_round]):
+            # counts[r][s] cards of suit s in round r
+            shapes = tuple(sorted((tuple(c[s] for c in counts)
+                                   for s in range(N_SUITS)), reverse=True))
+            if all(sum(shape) <= N_RANKS for shape in shapes):
+                configurations.add(shapes)
+        self._configurations = sorted(configurations, reverse=True)
+        self._offsets = []
+        self.size = 0
+        for shapes in self._configurations:
+            self._offsets.append(self.size)
+            self.size += self._configuration_size(shapes)
+        self._configuration_index = {shapes: i for i, shapes
+                                     in enumerate(self._configurations)}
+
+    @staticmethod
+    def _suit_counts(n_cards):
+        return [c for c in product(range(n_cards + 1), repeat=N_SUITS)
+                if sum(c) == n_cards]
+
+    @staticmethod
+    def _shape_size(shape):
+        size, used = 1, 0
+        for n in shape:
+            size *= comb(N_RANKS - used, n)
+            used += n
+        return size
+
+    def _groups(self, shapes):
+        """(shape, multiplicity) of runs of equal suit shapes."""
+        groups = []
+        for shape in shapes:
+            if groups and groups[-1][0] == shape:
+                groups[-1][1] += 1
+            else:
+                groups.append([shape, 1])
+        return groups
+
+    def _configuration_size(self, shapes):
+        size = 1
+        for shape, m in self._groups(shapes):
+            size *= comb(self._shape_size(shape) + m - 1, m)
+        return size
+
+    def index(self, rounds):
+        masks = [[0] * len(self.cards_per_round) for _ in SUITS]
+        for r, cards in enumerate(rounds[:len(self.cards_per_round)]):
+            for card in cards:
+                masks[SUIT_INDEX[(card >> 12) & 0xF]][r] |= (
+                    (card >> 16) & _RANK_MASK)
+        suits = []
+        for suit_masks in masks:
+            shape, local, mult, used = [], 0, 1, 0
+            for mask in suit_masks:
+                n = bin(mask).count('1')
+                local += mult * _rank_set_index(mask, used)
+                mult *= comb(N_RANKS - bin(used).count('1'), n)
+                used |= mask
+                shape.append(n)
+            suits.append((tuple(shape), local))
+        suits.sort(reverse=True)
+        shapes = tuple(shape for shape, _ in suits)
+        configuration = self._configuration_index[shapes]
+        index, mult, i = 0, 1, 0
+        for shape, m in self._groups(shapes):
+            values = [local for _, local in suits[i:i + m]]
+            index += mult * _multiset_index(values)
+            mult *= comb(self._shape_size(shape) + m - 1, m)
+            i += m
+        return self._offsets[configuration] + index
+
+    def unindex(self, index):
+        """Canonical representative (card lists per round) of an index."""
+        configuration = bisect_right(self._offsets, index) - 1
+        shapes = self._configurations[configuration]
+        index -= self._offsets[configuration]
+        rounds = [[] for _ in self.cards_per_round]
+        suit = 0
+        for shape, m in self._groups(shapes):
+            size = comb(self._shape_size(shape) + m - 1, m)
+            index, group_index = divmod(index, size)
+            for local in _multiset(group_index, m):
+                used = 0
+                for r, n in enumerate(shape):
+                    radix = comb(N_RANKS - bin(used).count('1'), n)
+                    local, set_index = divmod(local, radix)
+                    mask = _rank_set(set_index, n, used)
+                    used |= mask
+                    rounds[r] += [Card.new(Card.STR_RANKS[rank]
+                                           + Card.INT_SUIT_TO_CHAR_SUIT[
+                                               SUITS[suit]])
+                                  for rank in range(N_RANKS)
+                                  if mask >> rank & 1]
+                suit += 1
+        return [sorted(cards) for cards in rounds]
+
+
+_STREET_INDEXERS = {}
+
+
+def street_indexer(n_board_cards):
+    """Shared indexer of hole cards and a board of 0, 3, 4 or 5 cards."""
+    if n_board_cards not in _STREET_INDEXERS:
+        _STREET_INDEXERS[n_board_cards] = HandIndexer(
+            (2, n_board_cards) if n_board_cards else (2,))
+    return _STREET_INDEXERS[n_board_cards]
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    from treys import Deck
+
+    full_deck = Deck.GetFullDeck()
+    n_calls = 20000
+    for n_board in (0, 3, 4, 5):
+        indexer = street_indexer(n_board)
+        spots = []
+        for _ in range(n_calls):
+            cards = random.sample(full_deck, 2 + n_board)
+            spots.append((cards[:2], cards[2:]))
+
+        start = time.time()
+        for hand, board in spots:
+            canonical_key(hand, board)
+        key_rate = n_calls / (time.time() - start)
+
+        start = time.time()
+        for hand, board in spots:
+            indexer.index((hand, board))
+        index_rate = n_calls / (time.time() - start)
+
+        print('%d board cards: %d canonical situations, canonical_key %d '
+              'calls/s, index %d calls/s' % (n_board, indexer.size,
+                                             key_rate, index_rate))
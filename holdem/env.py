@@ -22,16 +22,41 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+"""
+Gym environment of a No-Limit Texas Hold'em table.
+
+The equity of a player is computed once per street and set of live players
+and reused for every later action of the street. With `equity_prefetch`
+the equities of all live players are computed on a background thread as
+soon as a street is dealt, overlapping with the agent choosing its action;
+each task gets its own child seed sequence so the results do not depend on
+thread timing. All-in equity rewards settle every side pot on the same
+runouts (`holdem.payout`), and `render` shows equities computed that way.
+"""
+
+import random
+import threading
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
+from itertools import count
 
 from gym import Env, error, spaces, utils
 from gym.utils import seeding
 
-from treys import Deck, Evaluator
+from treys import Deck
 
 from .player import Player
+from .table_state import CONVERTERS, TableState
 from .utils import hand_to_str, format_action, community_table, player_table
 from .equity_evaluation import Equity
+from .abstraction import MAX_BUCKETS
+from .hand_strength import N_FEATURES
+from .lut_evaluator import LookupEvaluator
+from .preflop import PREFLOP_TABLE
+from .payout import chip_payouts
+from .ranges import FULL_DECK
 
 
 class Street(IntEnum):
@@ -43,6 +68,22 @@ class Street(IntEnum):
     SHOWDOWN = 5
 
 
+# Snapshot of a table taken by `TexasHoldemEnv.get_state`. Seats are a
+# `FrozenTableState`, players are seat indexes or -1
+EnvState = namedtuple('EnvState', [
+    'seats', 'deck', 'community', 'dead_cards', 'street', 'button',
+    'side_pots', 'current_sidepot', 'totalpot', 'tocall', 'lastraise',
+    'current_bet', 'blind_index', 'smallblind', 'bigblind',
+    'number_of_hands', 'current_player', 'last_player', 'last_action',
+    'folded_players', 'rng_state', 'equity_rng_state', 'deal'])
+
+# Ids of the deals of every env, equity memos stay valid within a deal
+_DEALS = count()
+
+# Bucket feature of the players out of the hand, after the card buckets
+FOLDED_BUCKET = MAX_BUCKETS
+
+
 class TexasHoldemEnv(Env, utils.EzPickle):
     BLIND_INCREMENTS = [[10, 25], [25, 50], [50, 100], [75, 150], [100, 200],
                         [150, 300], [200, 400], [300, 600], [
@@ -50,7 +91,13 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                         [600, 1200], [800, 1600], [1000, 2000]]
 
     def __init__(self, n_seats, max_limit=100000, all_in_equity_reward=False,
-                 equity_steps=100, autoreset_stacks=True, debug=False):
+                 equity_steps=100, autoreset_stacks=True, debug=False,
+                 equity_backend='auto', preflop_equity_table=True,
+                 equity_cache=None, equity_precision=None,
+                 opponent_range=None, equity_sampling='random',
+                 equity_prefetch=False, equity_server=None,
+                 equity_server_authkey=None, hand_strength_features=False,
+                 bucket_features=False):
         # n_suits = 4                     # s,h,d,c
         # n_ranks = 13                    # 2,3,4,5,6,7,8,9,T,J,Q,K,A
         # n_pocket_cards = 2
@@ -61,7 +108,13 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         self._blind_index = 0
         [self._smallblind, self._bigblind] = TexasHoldemEnv.BLIND_INCREMENTS[0]
         self._deck = Deck()
-        self._evaluator = Evaluator()
+        # Shuffles the deck, seeded from the random module so seeding it
+        # still makes a run reproducible
+        self._rng = random.Random(random.getrandbits(64))
+        # State of _rng for get_state, it only changes when shuffling
+        self._rng_state = None
+        self._deal_id = next(_DEALS)
+        self._evaluator = LookupEvaluator()
 
         self.community = []
         self._dead_cards = []
@@ -76,8 +129,10 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         self._number_of_hands = 0
         self._current_bet = 0
 
-        # fill seats with dummy players
-        self._seats = [Player(i, stack=0, emptyplayer=True)
+        # fill seats with dummy players, all views of one TableState
+        self._state = TableState(n_seats)
+        self._seats = [Player(i, stack=0, emptyplayer=True,
+                              state=self._state, slot=i)
                        for i in range(n_seats)]
         self.emptyseats = n_seats
         self._player_dict = {}
@@ -85,11 +140,43 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         self._debug = debug
         self._last_player = None
         self._last_action = None
+        self._folded_players = []
+        # What push needs to undo each action played since the hand started
+        self._undo_log = []
 
         self.agent_exists = False
 
         self.equity_reward = all_in_equity_reward
-        self.equity = Equity(n_evaluations=equity_steps)
+        self.equity = Equity(
+            n_evaluations=equity_steps, backend=equity_backend,
+            preflop_table=PREFLOP_TABLE if preflop_equity_table else None,
+            cache=equity_cache, target_stderr=equity_precision,
+            sampling=equity_sampling, server_address=equity_server,
+            server_authkey=equity_server_authkey)
+        # Weights over the 1326 combos of holdem.ranges dealt to opponents
+        # in equity observations instead of random hands
+        self.opponent_range = opponent_range
+        # Equities of the current street keyed by (player_id, street, live
+        # player ids), with the MC runs each one took. Entries computed ahead
+        # of their first read by VecTexasHoldemEnv carry a third item until
+        # that read, which is their miss and not a hit
+        self._equity_memo = {}
+        self.equity_memo_hits = 0
+        self.equity_memo_misses = 0
+        self.equity_runs_avoided = 0
+        self.equity_prefetched = 0
+        # Thread computing the equities of a street as soon as it is dealt,
+        # the lock keeps it and the env from using self.equity at once
+        self._prefetch_executor = (
+            ThreadPoolExecutor(1, thread_name_prefix='holdem-equity')
+            if equity_prefetch else None)
+        self._equity_lock = threading.Lock()
+        # Add EHS, EHS2 and the strength histogram of holdem.hand_strength
+        # and the bucket of holdem.abstraction to observations, computed
+        # once per player and street
+        self.hand_strength_features = hand_strength_features
+        self.bucket_features = bucket_features
+        self._strength_memo = {}
 
         self._autoreset_stacks = autoreset_stacks
 
@@ -142,7 +229,11 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                             spaces.Box(low=0.0, high=1.0, shape=(1,)),  # equity
                             spaces.Discrete(max_limit),  # stack
                             spaces.Discrete(max_limit),  # pot amount
-                            ])
+                            ] + ([spaces.Box(low=0.0, high=1.0,
+                                             shape=(N_FEATURES,))]
+                                 if hand_strength_features else [])
+                              + ([spaces.Discrete(FOLDED_BUCKET + 1)]
+                                 if bucket_features else []))
 
         self.action_space = spaces.MultiDiscrete([3, max_limit])
 
@@ -155,7 +246,12 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         return self._tocall
 
     def seed(self, seed=None):
+        """Seed the deck shuffles and the equity samplers."""
         _, seed = seeding.np_random(seed)
+        self._rng.seed(seed)
+        self._rng_state = None
+        with self._equity_lock:
+            self.equity.seed(seed)
         return [seed]
 
     def add_player(self, seat_id, stack=2500, is_agent=False):
@@ -167,12 +263,13 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                     raise error.Error('Agent already exists')
                 self.agent_exists = True
                 self.agent_id = player_id
-            new_player = Player(player_id, stack=stack, emptyplayer=False)
-            if self._seats[player_id].emptyplayer:
-                self._seats[player_id] = new_player
-                new_player.set_seat(player_id)
-            else:
+            # the new player overwrites its slot, so check the seat first
+            if not self._seats[player_id].emptyplayer:
                 raise error.Error('Seat already taken.')
+            new_player = Player(player_id, stack=stack, emptyplayer=False,
+                                state=self._state, slot=player_id)
+            self._seats[player_id] = new_player
+            new_player.set_seat(player_id)
             self._player_dict[player_id] = new_player
             self.emptyseats -= 1
 
@@ -181,20 +278,133 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         player_id = seat_id
         try:
             idx = self._seats.index(self._player_dict[player_id])
-            self._seats[idx] = Player(-1, stack=0, emptyplayer=True)
+            self._seats[idx] = Player(-1, stack=0, emptyplayer=True,
+                                      state=self._state, slot=idx)
             del self._player_dict[player_id]
             self.emptyseats += 1
         except ValueError:
             pass
 
+    def get_state(self):
+        """
+        Snapshot of the table for `set_state`: seats, pots, deck order,
+        street, button, blinds, the shuffling RNG and the RNG of the equity
+        samplers. The evaluator and the equity caches are shared, not
+        copied.
+        """
+        def seat(player):
+            return -1 if player is None else player.get_seat()
+        if self._rng_state is None:
+            self._rng_state = self._rng.getstate()
+        with self._equity_lock:
+            equity_rng_state = self.equity.get_rng_state()
+        return EnvState(
+            self._state.freeze(), tuple(self._deck.cards),
+            tuple(self.community), tuple(self._dead_cards), self._street,
+            self._button, tuple(self._side_pots), self._current_sidepot,
+            self._totalpot, self._tocall, self._lastraise,
+            self._current_bet, self._blind_index, self._smallblind,
+            self._bigblind, self._number_of_hands,
+            seat(self._current_player), seat(self._last_player),
+            self._last_action,
+            tuple(p.get_seat() for p in self._folded_players),
+            self._rng_state, equity_rng_state, self._deal_id)
+
+    def set_state(self, state):
+        """
+        Restore a snapshot of `get_state` of this env. The players seated
+        are not part of it, seat and remove players only between hands.
+        """
+        if state.seats.n_seats != self.n_seats:
+            raise error.Error('State of a table with %d seats'
+                              % state.seats.n_seats)
+        self._state.thaw(state.seats)
+        self._deck.cards = list(state.deck)
+        self.community = list(state.community)
+        self._dead_cards = list(state.dead_cards)
+        self._street = state.street
+        self._button = state.button
+        self._side_pots = list(state.side_pots)
+        self._current_sidepot = state.current_sidepot
+        self._totalpot = state.totalpot
+        self._tocall = state.tocall
+        self._lastraise = state.lastraise
+        self._current_bet = state.current_bet
+        self._blind_index = state.blind_index
+        self._smallblind = state.smallblind
+        self._bigblind = state.bigblind
+        self._number_of_hands = state.number_of_hands
+        seats = self._seats
+        self._current_player = (seats[state.current_player]
+                                if state.current_player >= 0 else None)
+        self._last_player = (seats[state.last_player]
+                             if state.last_player >= 0 else None)
+        self._last_action = state.last_action
+        self._folded_players = [seats[i] for i in state.folded_players]
+        del self._undo_log[:]
+        if state.rng_state is not self._rng_state:
+            self._rng.setstate(state.rng_state)
+            self._rng_state = state.rng_state
+        with self._equity_lock:
+            self.equity.set_rng_state(state.equity_rng_state)
+        if state.deal != self._deal_id:
+            # memos are keyed by street and players, not by cards
+            self._deal_id = state.deal
+            self._clear_equity_memo()
+            self._strength_memo.clear()
+
+    def push(self, action):
+        """
+        Play `action` like `step` and log how to undo it with `pop`, for
+        walking a game tree without copying the table. Returns whether the
+        hand ended, observations are left to the caller.
+        """
+        journal = []
+        undo = (journal, self._street, tuple(self._side_pots),
+                self._current_sidepot, self._totalpot, self._tocall,
+                self._lastraise, self._current_bet, self._current_player,
+                self._last_player, self._last_action, len(self.community),
+                len(self._dead_cards), len(self._folded_players))
+        self._state.journal = journal
+        try:
+            terminal = self._apply_action(action)
+        except BaseException:
+            self._state.journal = None
+            self._undo(undo)
+            raise
+        self._state.journal = None
+        self._undo_log.append(undo)
+        return terminal
+
+    def pop(self):
+        """Undo the last action played by `push`."""
+        self._undo(self._undo_log.pop())
+
+    def _undo(self, undo):
+        (journal, self._street, side_pots, self._current_sidepot,
+         self._totalpot, self._tocall, self._lastraise, self._current_bet,
+         self._current_player, self._last_player, self._last_action,
+         n_community, n_dead, n_folded) = undo
+        self._state.undo(journal)
+        self._side_pots[:] = side_pots
+        # cards dealt since go back on top of the deck in the same order
+        self._deck.cards[:0] = self.community[n_community:]
+        del self.community[n_community:]
+        del self._dead_cards[n_dead:]
+        del self._folded_players[n_folded:]
+
     def reset(self):
+        self._start_hand()
+        return self._get_current_reset_returns()
+
+    def _start_hand(self):
         self._reset_game()
         self._number_of_hands += 1
         [self._smallblind, self._bigblind] = TexasHoldemEnv.BLIND_INCREMENTS[0]
         if len(self._player_dict) >= 2:
-            players = self._playing_players
+            seats = self._playing_seats
             self._reset_street_state()
-            self._current_player = self._first_to_act(players)
+            self._current_player = self._first_to_act(seats)
             self._last_player = self._current_player
             self._post_smallblind(self._current_player)
             self._pass_move_to_next_player()
@@ -203,7 +413,6 @@ class TexasHoldemEnv(Env, utils.EzPickle):
             self._tocall = self._bigblind
             self._folded_players = []
             self._deal_next_street()
-        return self._get_current_reset_returns()
 
     def step(self, action):
         """
@@ -214,6 +423,10 @@ class TexasHoldemEnv(Env, utils.EzPickle):
 
         RAISE_AMT = [0, minraise]
         """
+        return self._get_current_step_returns(self._apply_action(action))
+
+    def _apply_action(self, action):
+        """Play the action of the current player, True if the hand ended."""
         if self._current_player is None:
             raise error.Error(
                 'Round cannot be played without 2 or more players.')
@@ -221,48 +434,54 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         if self._street == Street.SHOWDOWN:
             raise error.Error('Rounds already finished, needs to be reset.')
 
-        players = self._playing_players
-        if len(players) <= 1:
+        # seats of the players in the hand, their fields are read from the
+        # arrays of the TableState rather than through the Player views
+        state = self._state
+        isallin, played = state.isallin, state.playedthisround
+        seats = self._playing_seats
+        if len(seats) <= 1:
             raise error.Error(
                 'Round cannot be played with one or less players.')
 
-        if not any([p.isallin is False for p in players]):
+        if all([isallin[i] for i in seats]):
             raise error.Error('Eveyone all in, round should be finished')
 
-        if self._current_player.isallin:
+        # the slot of a seated player in the arrays is its seat
+        player = self._current_player
+        seat = player._slot
+        if isallin[seat]:
             raise error.Error(
                 'This should never happen, position to act should pass players'
                 'that can\'t take any actions')
 
-        self._current_player.equity = self._compute_my_equity(self._current_player)
+        state.write(state.equity, seat, self._compute_my_equity(player))
         self._last_action = action
 
-        move = self._current_player.validate_action(
-            self._tocall, self._minraise, action)
+        move = player.validate_action(self._tocall, self._minraise, action)
         if self._debug:
-            print('Player', self._current_player.player_id, move)
-        self._player_action(self._current_player, move[1])
+            print('Player', player.player_id, move)
+        self._player_action(player, move[1])
         if move[0] == 'raise':
-            for p in players:
-                if p != self._current_player and not p.isallin:
-                    p.playedthisround = False
-        self._pass_move_to_next_player()
+            for i in seats:
+                if i != seat and not isallin[i]:
+                    state.write(played, i, False)
+        self._pass_move_to_next_player(seats)
         if move[0] == 'fold':
-            self._dead_cards += self._last_player.hand
-            self._last_player.playing_hand = False
-            players.remove(self._last_player)
-            self._folded_players.append(self._last_player)
-
-        not_acted_players = [
-            player for player in players if not player.playedthisround]
-        all_but_one_all_in = sum(
-            [player.isallin for player in players]) >= len(players) - 1
-        street_done = all([player.playedthisround for player in players]) \
-            or (len(not_acted_players) == 1
-                and not_acted_players[0].currentbet >= self._tocall
-                and all_but_one_all_in)
-
-        ready_for_showdown = (len(players) > 1
+            self._dead_cards += player.hand
+            state.write(state.playing_hand, seat, False)
+            self._clear_stale_equities()
+            seats.remove(seat)
+            self._folded_players.append(player)
+
+        not_acted = [i for i in seats if not played[i]]
+        all_but_one_all_in = (sum([isallin[i] for i in seats])
+                              >= len(seats) - 1)
+        street_done = not not_acted or (
+            len(not_acted) == 1
+            and state.currentbet[not_acted[0]] >= self._tocall
+            and all_but_one_all_in)
+
+        ready_for_showdown = (len(seats) > 1
                               and all_but_one_all_in
                               and street_done)
 
@@ -274,27 +493,130 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                     self._deal_next_street()
 
         if street_done:
-            self._resolve_street(players)
+            self._resolve_street(seats)
 
         terminal = False
-        if self._street == Street.SHOWDOWN or len(players) == 1:
+        if self._street == Street.SHOWDOWN or len(seats) == 1:
             terminal = True
-            self._resolve_hand(players)
-
-        return self._get_current_step_returns(terminal)
+            self._resolve_hand([self._seats[i] for i in seats])
+        return terminal
 
     def _compute_equities(self, players):
-        return self.equity.get_equities([p.hand for p in players],
-                                        self.community, self._deck.cards,
-                                        self._dead_cards)
+        with self._equity_lock:
+            return self.equity.get_pot_equities(
+                [p.hand for p in players], [list(range(len(players)))],
+                self.community, self._deck.cards, self._dead_cards)[0]
 
     def _compute_my_equity(self, player):
-        return self.equity.get_my_equity([player.hand], len(self._seats),
-                                         self.community, self._deck.cards)
+        key = self._equity_key(player)
+        memo = self._equity_memo.get(key)
+        if isinstance(memo, Future):
+            # computed in the background since the street was dealt
+            self.equity_prefetched += 1
+            memo = self._equity_memo[key] = memo.result()
+            return memo[0]
+        elif memo is not None:
+            if len(memo) > 2:
+                # batched for this read and already counted as a miss
+                self._equity_memo[key] = memo[:2]
+                return memo[0]
+            self.equity_memo_hits += 1
+            self.equity_runs_avoided += memo[1]
+            return memo[0]
+        self.equity_memo_misses += 1
+        memo = self._equity_memo[key] = self._equity_task(player)()
+        return memo[0]
+
+    def equity_memo_stats(self):
+        lookups = self.equity_memo_hits + self.equity_memo_misses
+        return {'hits': self.equity_memo_hits,
+                'misses': self.equity_memo_misses,
+                'prefetched': self.equity_prefetched,
+                'runs_avoided': self.equity_runs_avoided,
+                'hit_rate': self.equity_memo_hits / lookups if lookups else 0.}
+
+    def _equity_key(self, player):
+        return (player.player_id, self._street,
+                frozenset(player_id for player_id, playing in zip(
+                    self._state.player_id, self._state.playing_hand)
+                    if playing))
+
+    def _equity_task(self, player, seed_sequence=None):
+        """
+        Function returning (equity, MC runs used) of `player` on a snapshot
+        of the table taken now, so it can run after the table changed.
+        With a `seed_sequence` it samples from it instead of the RNG of the
+        Equity.
+        """
+        hand, community, deck, n_opponents = self._equity_query(player)
+
+        def task():
+            with self._equity_lock, (
+                    nullcontext() if seed_sequence is None
+                    else self.equity.seeded(seed_sequence)):
+                n_simulated = self.equity.n_simulated
+                if self.opponent_range is None:
+                    equity = self.equity.get_my_equity(
+                        [hand], n_opponents + 1, community, deck)
+                else:
+                    ranges = (self.opponent_range if n_opponents == 1
+                              else [self.opponent_range] * n_opponents)
+                    equity = self.equity.get_range_equity(hand, ranges,
+                                                          community, deck)
+                return equity, self.equity.n_simulated - n_simulated
+        return task
+
+    def _equity_query(self, player):
+        """Hand, community cards, deck and opponent count of its equity."""
+        hand, community = list(player.hand), list(self.community)
+        # the opponents and runouts can hold any card the player has not
+        # seen, so spots repeat and share cache entries across hands
+        deck = [c for c in FULL_DECK if c not in hand + community]
+        return hand, community, deck, len(self._seats) - 1
+
+    def _prefetch_equities(self):
+        """
+        Start computing the equities of every live player of the street.
+        Each task gets its own seed, spawned here in a fixed order, so the
+        equities do not depend on when the threads take the Equity.
+        """
+        players = sorted(self._playing_players,
+                         key=lambda p: p.player_id != getattr(
+                             self, 'agent_id', None))
+        with self._equity_lock:
+            seeds = [self.equity.spawn() for _ in players]
+        for player, seed_sequence in zip(players, seeds):
+            self._equity_memo[self._equity_key(player)] = (
+                self._prefetch_executor.submit(self._equity_task(
+                    player, seed_sequence)))
+
+    def _clear_stale_equities(self):
+        # memo keys hold the street and live players, so the entries are
+        # still right after pop goes back to an earlier node of the hand
+        if self._state.journal is None:
+            self._clear_equity_memo()
+
+    def _clear_equity_memo(self):
+        for memo in self._equity_memo.values():
+            if isinstance(memo, Future):
+                memo.cancel()
+        self._equity_memo.clear()
+
+    def close(self):
+        if self._prefetch_executor is not None:
+            self._clear_equity_memo()
+            self._prefetch_executor.shutdown()
+            self._prefetch_executor = None
+        self.equity.close()
 
     def render(self, mode='human', close=False):
-        for p in self._playing_players:
-            p.equity = self._compute_my_equity(p)
+        players = self._playing_players
+        if len(players) > 1:
+            equities = self._compute_equities(players)
+        else:
+            equities = [1.] * len(players)
+        for p, equity in zip(players, equities):
+            p.equity = equity
 
         print('\ntotal pot: {}'.format(self._totalpot))
         if self._last_action is not None:
@@ -343,10 +665,11 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                 return (sb_idx, idx)
             idx = (idx + 1) % len(self._seats)
 
-    def _resolve_street(self, players):
-        self._current_player = self._first_to_act(players)
-        self._resolve_sidepots(players + self._folded_players)
-        if self._street < Street.SHOWDOWN and len(players) > 1:
+    def _resolve_street(self, seats):
+        self._current_player = self._first_to_act(seats)
+        self._resolve_sidepots(
+            seats + [p.get_seat() for p in self._folded_players])
+        if self._street < Street.SHOWDOWN and len(seats) > 1:
             self._reset_street_state()
             self._deal_next_street()
 
@@ -360,6 +683,9 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         elif self._street == Street.TURN:
             self._river()
         self._street += 1
+        self._clear_stale_equities()
+        if self._prefetch_executor is not None:
+            self._prefetch_equities()
 
     def _increment_blinds(self):
         self._blind_index = min(self._blind_index + 1,
@@ -382,10 +708,21 @@ class TexasHoldemEnv(Env, utils.EzPickle):
             print('total pot: {}'.format(self._totalpot))
 
     def _player_action(self, player, total_bet):
+        # Player.declare_action on the arrays of the TableState
+        state = self._state
+        seat = player._slot
+        total_bet = CONVERTERS['q'](total_bet)
         self._current_bet = max(total_bet, self._current_bet)
-        extra_from_player_bet = total_bet - player.currentbet
-        relative_bet = total_bet - self._last_player.currentbet
-        player.declare_action(total_bet)
+        extra_from_player_bet = total_bet - state.currentbet[seat]
+        relative_bet = (total_bet
+                        - state.currentbet[self._last_player._slot])
+        state.write(state.playedthisround, seat, True)
+        if total_bet:
+            stack = state.stack[seat] - extra_from_player_bet
+            state.write(state.stack, seat, stack)
+            state.write(state.currentbet, seat, total_bet)
+            if stack == 0:
+                state.write(state.isallin, seat, True)
 
         self._totalpot += extra_from_player_bet
         self._tocall = max(self._tocall, total_bet)
@@ -395,10 +732,14 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         self._lastraise = max(self._lastraise, relative_bet)
 
     def _reset_street_state(self):
-        for player in self._player_dict.values():
-            player.currentbet = 0
-            if not player.isallin:
-                player.playedthisround = False
+        state = self._state
+        bets, played = state.currentbet, state.playedthisround
+        for i, empty in enumerate(state.emptyplayer):
+            if not empty:
+                if bets[i]:
+                    state.write(bets, i, 0)
+                if played[i] and not state.isallin[i]:
+                    state.write(played, i, False)
         self._tocall = 0
         self._lastraise = 0
         self._current_bet = 0
@@ -407,25 +748,33 @@ class TexasHoldemEnv(Env, utils.EzPickle):
 
     @property
     def _playing_players(self):
-        return [p for p in self._seats if p.playing_hand]
+        return [p for p, playing in zip(self._seats, self._state.playing_hand)
+                if playing]
+
+    @property
+    def _playing_seats(self):
+        return [i for i, playing in enumerate(self._state.playing_hand)
+                if playing]
 
-    def _pass_move_to_next_player(self):
+    def _pass_move_to_next_player(self, seats=None):
+        if seats is None:
+            seats = self._playing_seats
         self._last_player = self._current_player
-        self._current_player = self._next(
-            self._playing_players, self._current_player)
+        self._current_player = self._seats[self._next(
+            seats, self._current_player._slot)]
 
-    def _first_to_act(self, players):
-        players = sorted(
-            set(players + [self._seats[self._button]]), key=lambda x: x.get_seat())
-        if self._street == Street.NOT_STARTED and len(players) == 2:
+    def _first_to_act(self, seats):
+        seats = sorted(set(seats) | {self._button})
+        if self._street == Street.NOT_STARTED and len(seats) == 2:
             return self._seats[self._button]
         else:
-            return self._next(players, self._seats[self._button])
+            return self._seats[self._next(seats, self._button)]
 
-    def _next(self, players, current_player):
-        players = [p for p in players if not p.isallin or p is current_player]
-        idx = players.index(current_player)
-        return players[(idx+1) % len(players)]
+    def _next(self, seats, current):
+        """Seat after `current` among `seats` that can still act."""
+        isallin = self._state.isallin
+        seats = [i for i in seats if not isallin[i] or i == current]
+        return seats[(seats.index(current) + 1) % len(seats)]
 
     def _deal(self):
         for player in self._seats:
@@ -441,35 +790,37 @@ class TexasHoldemEnv(Env, utils.EzPickle):
     def _river(self):
         self.community.append(self._deck.draw(1))
 
-    def _resolve_sidepots(self, players_playing):
-        players = [p for p in players_playing if p.currentbet]
+    def _resolve_sidepots(self, seats):
+        state = self._state
+        bets = state.currentbet
+        seats = [i for i in seats if bets[i]]
         if self._debug:
-            print('current bets: ', [p.currentbet for p in players])
-            print('playing hand: ', [p.playing_hand for p in players])
-        if not players:
+            print('current bets: ', [bets[i] for i in seats])
+            print('playing hand: ',
+                  [bool(state.playing_hand[i]) for i in seats])
+        if not seats:
             return
         try:
             smallest_bet = min(
-                [p.currentbet for p in players if p.playing_hand])
+                [bets[i] for i in seats if state.playing_hand[i]])
         except ValueError:
-            for p in players:
-                self._side_pots[self._current_sidepot] += p.currentbet
-                p.currentbet = 0
+            for i in seats:
+                self._side_pots[self._current_sidepot] += bets[i]
+                state.write(bets, i, 0)
             return
 
-        smallest_players_allin = [p for p, bet in
-                                  zip(players, [p.currentbet for p in players])
-                                  if bet == smallest_bet and p.isallin]
+        smallest_players_allin = any([
+            bets[i] == smallest_bet and state.isallin[i] for i in seats])
 
-        for p in players:
-            self._side_pots[self._current_sidepot] += min(
-                smallest_bet, p.currentbet)
-            p.currentbet -= min(smallest_bet, p.currentbet)
-            p.lastsidepot = self._current_sidepot
+        for i in seats:
+            amount = min(smallest_bet, bets[i])
+            self._side_pots[self._current_sidepot] += amount
+            state.write(bets, i, bets[i] - amount)
+            state.write(state.lastsidepot, i, self._current_sidepot)
 
         if smallest_players_allin:
             self._current_sidepot += 1
-            self._resolve_sidepots(players)
+            self._resolve_sidepots(seats)
         assert sum(self._side_pots) == self._totalpot
         if self._debug:
             print('sidepots: ', self._side_pots)
@@ -486,33 +837,27 @@ class TexasHoldemEnv(Env, utils.EzPickle):
             temp_pots = [pot for pot in self._side_pots if pot > 0]
 
             if self.equity_reward and len(self.community) < 5:
+                # settle every side pot on the same runouts and round the
+                # expected payouts to whole chips, odd chips going to the
+                # players closest to the left of the button
+                pots = [[i for i, p in enumerate(players)
+                         if p.lastsidepot >= pot_idx]
+                        for pot_idx, _ in enumerate(temp_pots)]
+                amounts = self._side_pots[:len(temp_pots)]
+                with self._equity_lock:
+                    payouts = self.equity.get_expected_payouts(
+                        [p.hand for p in players], pots, amounts,
+                        self.community, self._deck.cards, self._dead_cards)
+                priority = [(p.get_seat() - self._button - 1) % self.n_seats
+                            for p in players]
+                for player, amount in zip(
+                        players, chip_payouts(payouts, priority).tolist()):
+                    if self._debug:
+                        print('Player', player.player_id, 'wins (', amount,
+                              ') from', len(temp_pots), 'side pots')
+                    player.refund(amount)
                 for pot_idx, _ in enumerate(temp_pots):
-                    # find players involved in given side_pot, compute the equities and pot split
-                    pot_contributors = [
-                        p for p in players if p.lastsidepot >= pot_idx]
-                    if len(pot_contributors) > 1:
-                        equities = self.equity.get_equities(
-                            [p.hand for p in pot_contributors], self.community,
-                            self._deck.cards, self._dead_cards)
-                        amount_distributed = 0
-                        for p_idx, player in enumerate(pot_contributors):
-                            split_amount = int(
-                                round(self._side_pots[pot_idx] * equities[p_idx]))
-                            if self._debug:
-                                print('Player', player.player_id,
-                                      'wins side pot (', split_amount, ')')
-                            player.refund(split_amount)
-                            amount_distributed += split_amount
-                    else:
-                        amount_distributed = int(self._side_pots[pot_idx])
-                        pot_contributors[0].refund(amount_distributed)
-                    self._side_pots[pot_idx] -= amount_distributed
-
-                    # any remaining chips after splitting go to the winner in the earliest position
-                    if self._side_pots[pot_idx]:
-                        earliest = self._first_to_act(
-                            [player for player in pot_contributors])
-                        earliest.refund(self._side_pots[pot_idx])
+                    self._side_pots[pot_idx] = 0
             else:
                 # compute hand ranks
                 for player in players:
@@ -540,7 +885,7 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                     # any remaining chips after splitting go to the winner in the earliest position
                     if self._side_pots[pot_idx]:
                         earliest = self._first_to_act(
-                            [player for player in winning_players])
+                            [player.get_seat() for player in winning_players])
                         earliest.refund(self._side_pots[pot_idx])
 
     def _reset_game(self):
@@ -554,11 +899,17 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                 playing += 1
         self.community = []
         self._dead_cards = []
+        self._clear_equity_memo()
+        self._strength_memo.clear()
         self._current_sidepot = 0
         self._totalpot = 0
         self._last_action = None
         self._side_pots = [0] * len(self._seats)
-        self._deck.shuffle()
+        del self._undo_log[:]
+        self._deck.cards = Deck.GetFullDeck()
+        self._rng.shuffle(self._deck.cards)
+        self._rng_state = None
+        self._deal_id = next(_DEALS)
 
         if playing:
             self._button = (self._button + 1) % len(self._seats)
@@ -567,8 +918,9 @@ class TexasHoldemEnv(Env, utils.EzPickle):
 
     @property
     def _minraise(self):
+        state, seat = self._state, self._current_player._slot
         minraise = min(self._current_bet + self._lastraise,
-                       self._current_player.max_bet)
+                       state.currentbet[seat] + state.stack[seat])
         return max(minraise, self._current_bet + 1)
 
     def _pad(self, l, n, v):
@@ -577,7 +929,29 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         return l + [v] * (n - len(l))
 
     def _get_current_player_state(self, player):
-        return (self._compute_my_equity(player), player.stack, self._totalpot)
+        state = (self._compute_my_equity(player), player.stack,
+                 self._totalpot)
+        if self.hand_strength_features:
+            state += (self._hand_strength(player),)
+        if self.bucket_features:
+            state += (self._bucket(player),)
+        return state
+
+    def _hand_strength(self, player):
+        return self._strength_memoized('get_hand_strength', player)
+
+    def _bucket(self, player):
+        if not player.playing_hand:
+            return FOLDED_BUCKET
+        return self._strength_memoized('get_bucket', player)
+
+    def _strength_memoized(self, method, player):
+        key = (method, player.player_id, self._street)
+        if key not in self._strength_memo:
+            with self._equity_lock:
+                self._strength_memo[key] = getattr(self.equity, method)(
+                    player.hand, self.community)
+        return self._strength_memo[key]
 
     def _get_current_state(self):
         player_states = []
@@ -595,6 +969,8 @@ class TexasHoldemEnv(Env, utils.EzPickle):
                 int(player.lastsidepot),
                 int(player.player_id),
             ]
+            if self.bucket_features:
+                player_features.append(self._bucket(player))
             player_states.append(
                 (player_features, self._pad(player.hand, 2, -1)))
         community_states = ([
@@ -622,3 +998,84 @@ class TexasHoldemEnv(Env, utils.EzPickle):
         info['money_won'] = agent.stack - \
             (agent.hand_starting_stack + agent.blind) if terminal else 0
         return observation, reward, terminal, info
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from .utils import safe_action
+
+    parser = argparse.ArgumentParser(
+        description='Nodes per second of a heads-up game tree walk and '
+                    'time per step of a 6 seat table.')
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--equity-steps', type=int, default=100)
+    parser.add_argument('--hands', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=50000)
+    args = parser.parse_args()
+
+    def actions(env):
+        """Fold, check or call, a min raise and all in."""
+        player = env._current_player
+        actions = [safe_action(None, env.tocall, 2)]
+        if env.tocall > player.currentbet:
+            actions.append([Player.FOLD, 0])
+        raise_to = max(env._minraise, env._bigblind)
+        if raise_to < player.max_bet:
+            actions.append([Player.RAISE, raise_to])
+        if env._current_bet < player.max_bet:
+            actions.append([Player.RAISE, player.max_bet])
+        return actions
+
+    def walk(env, depth, play, undo):
+        nodes = 1
+        for action in actions(env) if depth else ():
+            if play(action):
+                nodes += 1
+            else:
+                nodes += walk(env, depth - 1, play, undo)
+            undo()
+        return nodes
+
+    def push_pop(env):
+        return env.push, env.pop
+
+    def snapshots(env):
+        states = []
+
+        def play(action):
+            states.append(env.get_state())
+            return env._apply_action(action)
+        return play, lambda: env.set_state(states.pop())
+
+    # the first walk loads the rank and preflop tables
+    for name, methods in (('warm up', push_pop), ('push/pop', push_pop),
+                          ('get_state/set_state', snapshots)):
+        # a new env each time so equities are computed from scratch
+        env = TexasHoldemEnv(2, equity_steps=args.equity_steps)
+        for seat in range(2):
+            env.add_player(seat, stack=2500, is_agent=(seat == 0))
+        env.seed(0)
+        play, undo = methods(env)
+        nodes, start = 0, time.time()
+        for _ in range(args.hands):
+            env.reset()
+            nodes += walk(env, args.depth, play, undo)
+        if name != 'warm up':
+            print('%s: %d nodes, %.0f nodes/s' % (
+                name, nodes, nodes / (time.time() - start)))
+
+    # the table alone, equities are stubbed out
+    env = TexasHoldemEnv(6)
+    for seat in range(6):
+        env.add_player(seat, stack=2500, is_agent=(seat == 0))
+    env.seed(0)
+    env._compute_my_equity = lambda player: 0.5
+    env.reset()
+    start = time.time()
+    for _ in range(args.steps):
+        if env._apply_action(safe_action(None, env.tocall, 6)):
+            env._start_hand()
+    print('step: %.1f us/step' % (
+        (time.time() - start) / args.steps * 1e6))
@@ -22,13 +22,51 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+"""
+Equity of hands by MC simulation or exact enumeration.
+
+`Equity` answers every query with one backend: 'python' loops over the
+samples with `treys.Evaluator`, 'numpy' and 'lut' simulate all the samples
+of a query at once with vectorized hand ranking, 'pbots' calls the
+pbots_calc library, 'pool' shards budgets of at least POOL_MIN_SAMPLES over
+`holdem.equity_pool` and 'server' asks a `holdem.equity_server`. 'auto'
+picks the fastest backend of the machine with a short benchmark on first
+use (`fastest_backend`). Every backend deals boards from the remaining deck
+only, so folded and dead cards are never drawn.
+
+With a `target_stderr` MC runs in batches and stops as soon as the target
+is reached, `n_evaluations` then only caps the number of simulations.
+Heads-up queries against a range rank every combo of the range on each
+runout, enumerating the runouts when there are at most `exact_threshold`
+of them and sampling `n_evaluations` otherwise.
+"""
+
 import numpy as np
 
 from treys import Card, Deck, Evaluator
+from treys.lookup import LookupTable
+
+from . import equity_pool, equity_server
+from .abstraction import BUCKET_TABLES
+from .canonical import canonical_key
+from .lut_evaluator import LookupEvaluator
+from .ranges import (CARD_INDEX, COMBOS, COMBO_MASKS, FULL_DECK, N_COMBOS,
+                     card_mask, card_masks, combo_index, sample_combos,
+                     showdown_shares, showdown_sums)
+from .hand_strength import (HAND_STRENGTH_TABLES, enumerate_runouts,
+                            hand_strength)
+from .payout import expected_payouts
+from .sampling import SAMPLERS
+from .vectorized import VectorizedEvaluator, win_shares
 
 import ctypes
 import ctypes.util
 import sys
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from itertools import combinations
+from math import comb, factorial
 
 if sys.platform.startswith('win'):
     pbots_calc = "pbots_calc"
@@ -46,8 +84,6 @@ class _Results(ctypes.Structure):
                 ("MC", ctypes.c_int)]
 
 
-use_c_backend = True
-
 try:
     pcalc = ctypes.CDLL(pbots_calc)
     # Set the argtype and return types from the library.
@@ -59,9 +95,8 @@ try:
     pcalc.free_results.argtypes = [ctypes.POINTER(_Results)]
     pcalc.free_results.restype = None
 except OSError:
-    print("ERROR: Could not locate %s. Please ensure your enviroment library load path is set properly." % pbots_calc)
-    print('Using slow Python hand equity evaluation as a fallback')
-    use_c_backend = False
+    # the 'pbots' backend is unavailable, see available_backends()
+    pcalc = None
 
 
 class Results:
@@ -79,106 +114,1000 @@ class Results:
         return str(zip(self.hands, self.ev))
 
 
-def calc(hands, board, dead, iters):
-    res = pcalc.alloc_results()
-    err = pcalc.calc(hands, board, dead, iters, res)
-    if err > 0:
-        results = Results(res[0])
-    else:
+def calc(hands, board, dead, iters, res=None):
+    """
+    Run one pbots_calc query, e.g. calc(b'AhKd:xx', b'Qs2c3d', b'', 1000).
+    Pass a buffer from `pcalc.alloc_results()` as `res` to reuse it.
+    """
+    own_res = res is None
+    if own_res:
+        res = pcalc.alloc_results()
+    try:
+        err = pcalc.calc(hands, board, dead, iters, res)
+        if err > 0:
+            return Results(res[0])
         print("error: could not parse input or something...")
-        results = None
-    pcalc.free_results(res)
-    return results
+        return None
+    finally:
+        if own_res:
+            pcalc.free_results(res)
 
 
-class Equity():
-    def __init__(self, n_evaluations=500):
+_FULL_DECK = frozenset(Deck.GetFullDeck())
+_DECK_ARRAY = np.array(FULL_DECK, dtype=np.int64)
+
+
+class _RunningMean():
+    """Mean and standard error of the MC win shares seen so far."""
+
+    def __init__(self, size=1):
+        self.n = 0
+        self.total = np.zeros(size)
+        self.total_sq = np.zeros(size)
+
+    def add(self, shares):
+        shares = np.asarray(shares, dtype=np.float64).reshape(
+            -1, len(self.total))
+        self.n += len(shares)
+        self.total += shares.sum(axis=0)
+        self.total_sq += (shares ** 2).sum(axis=0)
+
+    def merge(self, n, total, total_sq):
+        """Add the sums of samples simulated elsewhere."""
+        self.n += n
+        self.total += total
+        self.total_sq += total_sq
+
+    @property
+    def mean(self):
+        return self.total / self.n
+
+    @property
+    def stderr(self):
+        if self.n < 2:
+            return np.full(len(self.total), np.inf)
+        variance = np.maximum(self.total_sq / self.n - self.mean ** 2, 0)
+        return np.sqrt(variance / (self.n - 1))
+
+
+class EquityBackend():
+    """
+    MC simulation behind `Equity`.
+
+    `simulate_equities` splits the pot between known hands and
+    `simulate_my_equity` plays my_hand[0] against n_players - 1 random hands.
+    Boards are completed with cards of `deck` only, so dead cards are never
+    dealt. Both return a _RunningMean of the pot shares.
+    """
+
+    name = None
+
+    def __init__(self, equity):
+        self.equity = equity
+
+    @staticmethod
+    def available():
+        return True
+
+    def simulate_equities(self, hands, community, deck, n_evaluations):
+        raise NotImplementedError
+
+    def simulate_my_equity(self, my_hand, n_players, community, deck,
+                           n_evaluations):
+        raise NotImplementedError
+
+
+class PythonBackend(EquityBackend):
+    """One sample at a time with treys `Evaluator`."""
+
+    name = 'python'
+
+    def __init__(self, equity):
+        super().__init__(equity)
         self.evaluator = Evaluator()
-        self.n_evaluations = n_evaluations
 
-    def get_equities(self, hands, community, deck, dead):
-        if use_c_backend:
-            return self._get_equities_c(hands, community, dead)
-        else:
-            return self._get_equities_python(hands, community, deck)
-
-    def _get_equities_c(self, hands, community, dead):
-        for i in range(len(hands)):
-            hands[i] = ''.join([Card.int_to_str(hands[i][0]),
-                                Card.int_to_str(hands[i][1])])
-        community = [Card.int_to_str(h) for h in community]
-        dead = [Card.int_to_str(h) for h in dead]
-        hands = bytes(':'.join(hands), encoding='utf-8')
-        community = bytes(''.join(community), encoding='utf-8')
-        dead = bytes(''.join(dead), encoding='utf-8')
-        results = calc(hands, b'', b'', self.n_evaluations)
-        return results.ev
-
-    def _get_equities_python(self, hands, community, deck):
-        victories = np.zeros(len(hands))
-        for _ in range(self.n_evaluations):
+    def simulate_equities(self, hands, community, deck, n_evaluations):
+        stats = _RunningMean(len(hands))
+        drawn = self.equity._draw_cards(deck, n_evaluations,
+                                        5 - len(community)).tolist()
+        for i in range(n_evaluations):
+            if self.equity._precise_enough(stats, i):
+                break
             cur_community = community.copy()
-            cur_deck = deck.copy()
-            added_cards = np.random.choice(cur_deck,
-                                           size=(5 - len(cur_community)),
-                                           replace=False).tolist()
+            added_cards = drawn[i]
             cur_community += added_cards
             ranks = [self.evaluator.evaluate(
                 hand, cur_community) for hand in hands]
             winners = ranks == np.min(ranks)
-            victories[winners] += 1 / winners.sum()
-        equities = victories / self.n_evaluations
-        assert abs(equities.sum() - 1) < 1e-6
-        return equities
+            stats.add(winners / winners.sum())
+        return stats
 
-    def get_my_equity(self, my_hand, n_players, community, deck):
-        victories = 0
-        for _ in range(self.n_evaluations):
+    def simulate_my_equity(self, my_hand, n_players, community, deck,
+                           n_evaluations):
+        stats = _RunningMean()
+        nb_add_comm = 5 - len(community)
+        # Pick cards for the community and for other players
+        drawn = self.equity._draw_cards(
+            deck, n_evaluations, nb_add_comm + 2 * (n_players - 1)).tolist()
+        for i in range(n_evaluations):
+            if self.equity._precise_enough(stats, i):
+                break
             cur_community = community.copy()
-            cur_deck = deck.copy()
             hands = my_hand.copy()
-            nb_add_comm = 5 - len(cur_community)
-            # Pick cards for the community and for other players
-            added_cards = np.random.choice(cur_deck,
-                                           size=(nb_add_comm + 2*n_players),
-                                           replace=False).tolist()
+            added_cards = drawn[i]
             # Add community cards
             cur_community += added_cards[:nb_add_comm]
             # Add cards for other players
-            for i in range(n_players-1):
+            for j in range(n_players-1):
                 hands.append(
-                    added_cards[nb_add_comm + 2*i:nb_add_comm + 2*(i+1)])
+                    added_cards[nb_add_comm + 2*j:nb_add_comm + 2*(j+1)])
             # Compute ranks of each hand
             ranks = [self.evaluator.evaluate(
                 hand, cur_community) for hand in hands]
             # Compute best hands (winners[i] == 1, ties can exist)
             winners = ranks == np.min(ranks)
-            # If I won, increment number of victories
-            if winners[0]:
-                victories += 1 / winners.sum()
-        return victories / self.n_evaluations
+            # My share of the pot, ties split it
+            stats.add(winners[0] / winners.sum())
+        return stats
+
+
+class NumpyBackend(EquityBackend):
+    """Whole batches of samples at once, ranked with `VectorizedEvaluator`."""
+
+    name = 'numpy'
+
+    def __init__(self, equity):
+        super().__init__(equity)
+        self._evaluator = None
+
+    @property
+    def evaluator(self):
+        if self._evaluator is None:
+            self._evaluator = VectorizedEvaluator()
+        return self._evaluator
+
+    def simulate_equities(self, hands, community, deck, n_evaluations):
+        equity = self.equity
+        nb_add_comm = 5 - len(community)
+        stats = _RunningMean(len(hands))
+        for n_samples in equity._batches(stats, n_evaluations):
+            board = equity._sample_boards(community, deck, n_samples,
+                                          nb_add_comm)[0]
+            ranks = equity._rank_hands(
+                np.broadcast_to(hands, (n_samples, len(hands), 2)), board,
+                self.evaluator)
+            winners = ranks == ranks.min(axis=1, keepdims=True)
+            stats.add(winners / winners.sum(axis=1, keepdims=True))
+        return stats
+
+    def simulate_my_equity(self, my_hand, n_players, community, deck,
+                           n_evaluations):
+        equity = self.equity
+        nb_add_comm = 5 - len(community)
+        n_opponents = n_players - 1
+        stats = _RunningMean()
+        for n_samples in equity._batches(stats, n_evaluations):
+            # Pick cards for the community and for other players in one go
+            board, added_cards = equity._sample_boards(
+                community, deck, n_samples, nb_add_comm + 2 * n_opponents)
+            hands = np.concatenate([
+                np.broadcast_to(my_hand[0], (n_samples, 1, 2)),
+                added_cards.reshape(n_samples, n_opponents, 2)], axis=1)
+            ranks = equity._rank_hands(hands, board, self.evaluator)
+            stats.add(win_shares(ranks[:, 0], ranks[:, 1:]))
+        return stats
+
+
+class LookupBackend(NumpyBackend):
+    """Like 'numpy' but ranked with the tables of `LookupEvaluator`."""
+
+    name = 'lut'
+
+    @property
+    def evaluator(self):
+        return self.equity.evaluator
+
+
+class PbotsBackend(EquityBackend):
+    """
+    pbots_calc through ctypes, random opponents are passed as 'xx' hands.
+
+    pbots_calc only reports the mean, the returned standard error is the
+    p * (1 - p) bound of the variance of a share in [0, 1].
+    """
+
+    name = 'pbots'
+
+    def __init__(self, equity):
+        super().__init__(equity)
+        self._res = None
+
+    @staticmethod
+    def available():
+        return pcalc is not None
+
+    def __del__(self):
+        if self._res is not None:
+            pcalc.free_results(self._res)
+
+    def simulate_equities(self, hands, community, deck, n_evaluations):
+        return self._calc([_to_str(hand) for hand in hands], community,
+                          deck, n_evaluations, hands)
+
+    def simulate_my_equity(self, my_hand, n_players, community, deck,
+                           n_evaluations):
+        stats = self._calc([_to_str(my_hand[0])] + ['xx'] * (n_players - 1),
+                           community, deck, n_evaluations, my_hand)
+        result = _RunningMean()
+        result.merge(stats.n, stats.total[:1], stats.total_sq[:1])
+        return result
+
+    def _calc(self, hand_strs, community, deck, n_evaluations, known):
+        if self._res is None:
+            self._res = pcalc.alloc_results()
+        dead = Equity._removed_cards(deck, community, *known)
+        results = calc(bytes(':'.join(hand_strs), encoding='utf-8'),
+                       bytes(_to_str(community), encoding='utf-8'),
+                       bytes(_to_str(dead), encoding='utf-8'),
+                       n_evaluations, self._res)
+        ev = np.array(results.ev)
+        stats = _RunningMean(len(ev))
+        stats.merge(n_evaluations, ev * n_evaluations, ev * n_evaluations)
+        return stats
+
+
+def _to_str(cards):
+    return ''.join(Card.int_to_str(c) for c in cards)
+
+
+SIMULATION_BACKENDS = {backend.name: backend for backend in
+                       (PythonBackend, NumpyBackend, LookupBackend,
+                        PbotsBackend)}
+
+
+def available_backends():
+    return [name for name, backend in SIMULATION_BACKENDS.items()
+            if backend.available()]
+
+
+_fastest_backend = None
+
+
+def fastest_backend():
+    """
+    Available simulation backend with the best samples/s on a 3-way flop
+    query of Equity's default budget, measured on the first call.
+    """
+    global _fastest_backend
+    if _fastest_backend is None:
+        hand = [Card.new('Ah'), Card.new('Kd')]
+        community = [Card.new('Qs'), Card.new('Jh'), Card.new('2c')]
+        deck = [c for c in Deck.GetFullDeck() if c not in hand + community]
+        timings = {}
+        for name in available_backends():
+            equity = Equity(backend=name, seed=0, exact_threshold=0)
+            # first call loads tables
+            equity.get_my_equity([hand], 3, community, deck)
+            start = time.perf_counter()
+            for _ in range(Equity.AUTO_BENCHMARK_RUNS):
+                equity.get_my_equity([hand], 3, community, deck)
+            timings[name] = time.perf_counter() - start
+        _fastest_backend = min(timings, key=timings.get)
+    return _fastest_backend
+
+
+class Equity():
+    # 'auto' is the fastest of SIMULATION_BACKENDS available here and
+    # 'pool' shards large budgets of the 'lut' backend over processes,
+    # 'server' sends queries to a holdem.equity_server process
+    BACKENDS = tuple(SIMULATION_BACKENDS) + ('pool', 'auto', 'server')
+    # Maximum number of samples simulated at once by array backends
+    BATCH_SIZE = 10000
+    # Samples between two precision checks when a target_stderr is set
+    ADAPTIVE_BATCH_SIZE = 500
+    # Smallest budget worth sharding over the process pool, smaller queries
+    # are simulated in-process as IPC would dominate
+    POOL_MIN_SAMPLES = 20000
+    # Queries timed per backend by fastest_backend()
+    AUTO_BENCHMARK_RUNS = 5
+    # Runouts ranked at once by heads-up range queries, every runout ranks
+    # all the combos of the range
+    RANGE_BATCH_SIZE = 100
+
+    def __init__(self, n_evaluations=500, backend='auto', seed=None,
+                 exact_threshold=None, preflop_table=None, cache=None,
+                 target_stderr=None, pool_workers=None, sampling='random',
+                 server_address=None, server_authkey=None):
+        if backend not in Equity.BACKENDS:
+            raise ValueError('Unknown equity backend %s, expected one of %s'
+                             % (backend, Equity.BACKENDS))
+        if sampling not in SAMPLERS:
+            raise ValueError('Unknown sampling %s, expected one of %s'
+                             % (sampling, tuple(SAMPLERS)))
+        if (backend in SIMULATION_BACKENDS
+                and not SIMULATION_BACKENDS[backend].available()):
+            raise ValueError('Equity backend %s is not available, available '
+                             'ones are %s' % (backend, available_backends()))
+        if backend == 'server' and server_address is None:
+            raise ValueError('Equity backend server needs a server_address')
+        # Ranks the hands of exact enumeration and of the 'lut' backend
+        self.evaluator = LookupEvaluator()
+        self.n_evaluations = n_evaluations
+        self.backend = backend
+        # Enumerate all completions instead of sampling when there are at most
+        # this many of them, by default when it is not more work than MC
+        self.exact_threshold = (n_evaluations if exact_threshold is None
+                                else exact_threshold)
+        # PreflopEquityTable answering preflop queries against random hands
+        self.preflop_table = preflop_table
+        # EquityCache shared with other Equity instances, if any
+        self.cache = cache
+        # Stop sampling once the standard error of the estimate is below
+        # this, n_evaluations is then only the maximum budget
+        self.target_stderr = target_stderr
+        # Total number of MC samples simulated by this instance
+        self.n_simulated = 0
+        # Worker processes of the pool backend, defaults to all cores
+        self.pool_workers = pool_workers
+        # How MC runouts and opponent hands are drawn, see holdem.sampling.
+        # Standard errors assume independent samples and are conservative
+        # for 'stratified'.
+        self.sampling = sampling
+        self.seed(seed)
+        self._simulation_backends = {}
+        # EquityClient of the 'server' backend
+        self._client = (None if server_address is None
+                        else equity_server.EquityClient(server_address,
+                                                        server_authkey))
+
+    @property
+    def simulation_backend(self):
+        """EquityBackend simulating in this process for `self.backend`."""
+        name = self.backend
+        if name == 'auto':
+            name = fastest_backend()
+        elif name == 'pool':
+            name = 'lut'
+        if name not in self._simulation_backends:
+            self._simulation_backends[name] = SIMULATION_BACKENDS[name](self)
+        return self._simulation_backends[name]
+
+    def get_equities(self, hands, community, deck, dead):
+        if dead:
+            deck = [c for c in deck if c not in set(dead)]
+        if self.cache is None:
+            return self._compute_equities(hands, community, deck)
+        key = ('all', canonical_key(*hands, community,
+                                    self._removed_cards(deck, community,
+                                                        *hands)))
+        equities = self.cache.get(key)
+        if equities is None:
+            equities = self._compute_equities(hands, community, deck)
+            self.cache.put(key, tuple(equities))
+        return np.array(equities)
+
+    def _compute_equities(self, hands, community, deck):
+        if self._client is not None:
+            return np.array(self._submit('get_equities', hands, community,
+                                         deck, ()).result())
+        if comb(len(deck), 5 - len(community)) <= self.exact_threshold:
+            return self._get_equities_exact(hands, community, deck)
+        return self._simulate(_RunningMean(len(hands)), '_simulate_equities',
+                              (hands, community, deck)).mean
+
+    def _simulate_equities(self, hands, community, deck, n_evaluations):
+        return self.simulation_backend.simulate_equities(
+            hands, community, deck, n_evaluations)
+
+    def get_expected_payouts(self, hands, pots, amounts, community, deck,
+                             dead=(), exact=None):
+        """
+        Chips each hand wins on average from pots given as lists of indices
+        in `hands` holding `amounts` chips, see `get_showdown_ranks` for
+        `exact`. All pots are settled on the same runouts and the payouts
+        add up to the chips in the pots.
+        """
+        ranks = self.get_showdown_ranks(hands, community, deck, dead, exact)
+        return expected_payouts(ranks, pots, amounts)
+
+    def get_pot_equities(self, hands, pots, community, deck, dead=()):
+        """
+        Equities of the hands contesting each pot, pots being lists of
+        indices in `hands`. Every hand is ranked once per runout and all pots
+        are split on the same runouts, so each pot's equities sum to 1.
+        """
+        ranks = self.get_showdown_ranks(hands, community, deck, dead)
+        equities = []
+        for pot in pots:
+            contenders = ranks[:, pot]
+            winners = contenders == contenders.min(axis=1, keepdims=True)
+            equities.append((winners / winners.sum(axis=1, keepdims=True))
+                            .mean(axis=0))
+        return equities
+
+    def get_showdown_ranks(self, hands, community, deck, dead=(),
+                           exact=None):
+        """
+        Ranks (n_runouts, n_hands) of all the hands on shared runouts, every
+        runout when `exact` or, by default, when there are at most
+        exact_threshold of them, else n_evaluations sampled ones.
+        """
+        if dead:
+            deck = [c for c in deck if c not in set(dead)]
+        nb_add_comm = 5 - len(community)
+        if exact is None:
+            exact = comb(len(deck), nb_add_comm) <= self.exact_threshold
+        if exact:
+            boards = enumerate_runouts(community, deck)
+        else:
+            boards = self._sample_boards(community, deck, self.n_evaluations,
+                                         nb_add_comm)[0]
+            self.n_simulated += len(boards)
+        return self._rank_hands(
+            np.broadcast_to(hands, (len(boards), len(hands), 2)), boards)
+
+    def _get_equities_exact(self, hands, community, deck):
+        boards = enumerate_runouts(community, deck)
+        ranks = self._rank_hands(
+            np.broadcast_to(hands, (len(boards), len(hands), 2)), boards)
+        winners = ranks == ranks.min(axis=1, keepdims=True)
+        return (winners / winners.sum(axis=1, keepdims=True)).mean(axis=0)
+
+    def get_my_equity(self, my_hand, n_players, community, deck):
+        return self.get_my_equity_with_error(my_hand, n_players, community,
+                                             deck)[0]
+
+    def get_my_equity_with_error(self, my_hand, n_players, community, deck):
+        """
+        Equity of my_hand[0] against n_players - 1 random hands and the
+        standard error of that estimate (0 for lookups and enumeration).
+        """
+        if (not community and self.preflop_table is not None
+                and self.preflop_table.covers(n_players - 1)):
+            return self.preflop_table.get_equity(my_hand[0], n_players - 1), 0.
+        elif self.cache is None:
+            return self._compute_my_equity(my_hand, n_players, community,
+                                           deck)
+        key = self._my_equity_key(my_hand, n_players, community, deck)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._compute_my_equity(my_hand, n_players, community,
+                                             deck)
+            self.cache.put(key, result)
+        return result
+
+    def _my_equity_key(self, my_hand, n_players, community, deck):
+        return ('my', canonical_key(my_hand[0], community,
+                                    self._removed_cards(deck, community,
+                                                        my_hand[0])),
+                n_players - 1)
+
+    @staticmethod
+    def _removed_cards(deck, *known):
+        """Cards that are neither in the deck nor known to the player."""
+        removed = set(_FULL_DECK)
+        removed.difference_update(deck, *known)
+        return removed
+
+    def submit_my_equity(self, my_hand, n_players, community, deck):
+        """
+        Future of `get_my_equity_with_error`. With the 'server' backend the
+        query is sent without waiting for its answer, other backends compute
+        it before returning.
+        """
+        future = Future()
+        if self._client is None or (
+                not community and self.preflop_table is not None
+                and self.preflop_table.covers(n_players - 1)):
+            future.set_result(self.get_my_equity_with_error(
+                my_hand, n_players, community, deck))
+            return future
+        key = self._my_equity_key(my_hand, n_players, community, deck)
+        result = None if self.cache is None else self.cache.get(key)
+        if result is not None:
+            future.set_result(result)
+            return future
+        future = self._submit('get_my_equity_with_error', my_hand, n_players,
+                              community, deck)
+        if self.cache is not None:
+            def cache_result(done):
+                if done.exception() is None:
+                    self.cache.put(key, done.result())
+            future.add_done_callback(cache_result)
+        return future
+
+    def _submit(self, method, *query):
+        settings = (self.n_evaluations, self.exact_threshold,
+                    self.target_stderr, self.sampling)
+        return self._client.submit(method, settings, *query)
+
+    def close(self):
+        """Disconnect from the equity server, if any."""
+        if self._client is not None:
+            self._client.close()
+
+    def _compute_my_equity(self, my_hand, n_players, community, deck):
+        if self._client is not None:
+            return tuple(self._submit('get_my_equity_with_error', my_hand,
+                                      n_players, community, deck).result())
+        if n_players <= 2 and self._count_completions(
+                n_players, community, deck) <= self.exact_threshold:
+            return self._get_my_equity_exact(my_hand, n_players, community,
+                                             deck), 0.
+        stats = self._simulate(_RunningMean(), '_simulate_my_equity',
+                               (my_hand, n_players, community, deck))
+        return float(stats.mean[0]), float(stats.stderr[0])
+
+    def _simulate_my_equity(self, my_hand, n_players, community, deck,
+                            n_evaluations):
+        return self.simulation_backend.simulate_my_equity(
+            my_hand, n_players, community, deck, n_evaluations)
+
+    def _simulate(self, stats, method, query):
+        """Run `method` in-process or on the pool and count the samples."""
+        if self._use_pool():
+            stats = equity_pool.simulate(stats, method, query,
+                                         self.n_evaluations,
+                                         self._seed_sequence,
+                                         self.pool_workers, self.sampling)
+        else:
+            stats = getattr(self, method)(*query, self.n_evaluations)
+        self.n_simulated += stats.n
+        return stats
+
+    def seed(self, seed=None):
+        """
+        Seed the samplers, from the global NumPy random state when `seed`
+        is None so that `np.random.seed` makes runs reproducible.
+        """
+        if seed is None:
+            seed = np.random.randint(2**32, size=4, dtype=np.uint64)
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self._rng = np.random.default_rng(self._seed_sequence)
+
+    def spawn(self):
+        """Child SeedSequence for `seeded`, independent of the samplers."""
+        return self._seed_sequence.spawn(1)[0]
+
+    @contextmanager
+    def seeded(self, seed_sequence):
+        """
+        Sample from `seed_sequence` inside the block and leave the RNG of
+        this Equity as it was. Calls must not run concurrently.
+        """
+        saved = self._seed_sequence, self._rng
+        self._seed_sequence = seed_sequence
+        self._rng = np.random.default_rng(seed_sequence)
+        try:
+            yield
+        finally:
+            self._seed_sequence, self._rng = saved
+
+    def get_rng_state(self):
+        """State of the samplers for `set_rng_state`."""
+        return (self._rng.bit_generator.state,
+                self._seed_sequence.n_children_spawned)
+
+    def set_rng_state(self, state):
+        """Restore the samplers to a `get_rng_state`."""
+        self._rng.bit_generator.state, n_spawned = state
+        seed_sequence = self._seed_sequence
+        if n_spawned != seed_sequence.n_children_spawned:
+            # the pool spawns the seeds of its shards from it
+            self._seed_sequence = np.random.SeedSequence(
+                seed_sequence.entropy, spawn_key=seed_sequence.spawn_key,
+                pool_size=seed_sequence.pool_size,
+                n_children_spawned=n_spawned)
+
+    def get_my_equity_batch(self, my_hands, n_players, communities,
+                            dead=None, with_error=False):
+        """
+        `get_my_equity` of many independent queries in one vectorized pass:
+        my_hands (n_queries, 2), n_players an int or one per query,
+        communities and dead cards a list of cards per query. Queries in the
+        cache or the preflop table are looked up, the MC queries of a fixed
+        budget run together with n_evaluations samples each drawn from one
+        RNG stream, and the others (enumeration, pool, server, target_stderr
+        and the python and pbots backends) go through
+        `get_my_equity_with_error` one by one. With `with_error` the
+        standard errors are returned as well.
+        """
+        my_hands = np.asarray(my_hands, dtype=np.int64).reshape(-1, 2)
+        n_queries = len(my_hands)
+        n_players = np.broadcast_to(n_players, (n_queries,)).astype(np.int64)
+        communities = list(communities)
+        dead = [()] * n_queries if dead is None else list(dead)
+        equities, errors = np.empty(n_queries), np.zeros(n_queries)
+        simulated, keys, futures = [], {}, {}
+        for i, (hand, community) in enumerate(zip(my_hands.tolist(),
+                                                  communities)):
+            n = int(n_players[i])
+            if n < 2:
+                # no opponent left to beat
+                equities[i] = 1.
+                continue
+            if (not community and self.preflop_table is not None
+                    and self.preflop_table.covers(n - 1)):
+                equities[i] = self.preflop_table.get_equity(hand, n - 1)
+                continue
+            removed = set(hand).union(community, dead[i])
+            deck = [c for c in _DECK_ARRAY.tolist() if c not in removed]
+            if self.cache is not None:
+                keys[i] = self._my_equity_key([hand], n, community, deck)
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    equities[i], errors[i] = cached
+                    continue
+            if self._simulates_in_batch(n, community, deck):
+                simulated.append(i)
+            elif self._client is not None:
+                # sent now, answered while the batch is simulated
+                futures[i] = self._submit('get_my_equity_with_error',
+                                          [hand], n, community, deck)
+            else:
+                equities[i], errors[i] = self._compute_my_equity(
+                    [hand], n, community, deck)
+        n_opponents = int(n_players[simulated].max(initial=1)) - 1
+        n = self.n_evaluations
+        for queries in self._query_batches(simulated):
+            shares = self._simulate_batch(
+                my_hands[queries, None, :], n_players[queries],
+                [communities[i] for i in queries], [dead[i] for i in queries],
+                n_opponents)[:, :, 0]
+            equities[queries] = shares.mean(axis=1)
+            errors[queries] = (shares.std(axis=1, ddof=1) / np.sqrt(n)
+                               if n > 1 else np.inf)
+        for i, future in futures.items():
+            equities[i], errors[i] = future.result()
+        if self.cache is not None:
+            for i in simulated + list(futures):
+                self.cache.put(keys[i], (float(equities[i]),
+                                         float(errors[i])))
+        return (equities, errors) if with_error else equities
+
+    def _simulates_in_batch(self, n_players, community, deck):
+        """Whether `_simulate_batch` answers like `_compute_my_equity`."""
+        return (self._client is None and self.target_stderr is None
+                and not self._use_pool()
+                and self.simulation_backend.name in ('numpy', 'lut')
+                and not (n_players <= 2 and self._count_completions(
+                    n_players, community, deck) <= self.exact_threshold))
+
+    def get_equities_batch(self, hands, communities, dead=None):
+        """
+        `get_equities` of many independent queries in one vectorized pass:
+        hands (n_queries, n_hands, 2), communities and dead cards a list of
+        cards per query. Returns the equities (n_queries, n_hands).
+        """
+        hands = np.asarray(hands, dtype=np.int64)
+        n_queries = len(hands)
+        communities = list(communities)
+        dead = [()] * n_queries if dead is None else list(dead)
+        equities = np.empty(hands.shape[:2])
+        for queries in self._query_batches(range(n_queries)):
+            shares = self._simulate_batch(
+                hands[queries], None, [communities[i] for i in queries],
+                [dead[i] for i in queries], 0)
+            equities[queries] = shares.mean(axis=1)
+        return equities
+
+    def _query_batches(self, queries):
+        """Chunks of queries simulating about BATCH_SIZE samples at once."""
+        queries = list(queries)
+        size = max(1, Equity.BATCH_SIZE // max(1, self.n_evaluations))
+        for start in range(0, len(queries), size):
+            yield queries[start:start + size]
+
+    def _simulate_batch(self, hands, n_players, communities, dead,
+                        n_opponents):
+        """
+        Pot shares (n_queries, n_evaluations, n_hands) of known `hands` on
+        runouts of each query, joined by up to `n_opponents` random hands
+        when n_players gives the number of players of every query.
+        """
+        n_queries, n_hands = hands.shape[:2]
+        n = self.n_evaluations
+        n_known = np.array([len(c) for c in communities])
+        n_cards = 5 - n_known.min() + 2 * n_opponents
+
+        # Partial Fisher-Yates shuffles of every query's deck, the cards
+        # left in it are moved to the front
+        available = np.ones((n_queries, len(_DECK_ARRAY)), dtype=bool)
+        for i, known in enumerate(zip(hands.tolist(), communities, dead)):
+            for cards in (*known[0], known[1], known[2]):
+                available[i, [CARD_INDEX[c] for c in cards]] = False
+        deck_sizes = np.repeat(available.sum(axis=1), n)
+        decks = np.repeat(_DECK_ARRAY[np.argsort(~available, axis=1,
+                                                 kind='stable')], n, axis=0)
+        rows = np.arange(len(decks))
+        for position in range(n_cards):
+            uniforms = self._rng.random((n_queries, n))
+            if self.sampling == 'stratified':
+                uniforms = (self._rng.permuted(np.broadcast_to(
+                    np.arange(n), (n_queries, n)), axis=1) + uniforms) / n
+            picks = position + (uniforms.ravel()
+                                * (deck_sizes - position)).astype(np.int64)
+            picked = decks[rows, picks]
+            decks[rows, picks] = decks[:, position]
+            decks[:, position] = picked
+        drawn = decks[:, :n_cards].reshape(n_queries, n, n_cards)
+
+        # Community cards of each query followed by its drawn cards
+        community = np.zeros((n_queries, 5), dtype=np.int64)
+        for i, cards in enumerate(communities):
+            community[i, :len(cards)] = cards
+        cards = np.concatenate([np.broadcast_to(community[:, None, :],
+                                                (n_queries, n, 5)), drawn],
+                               axis=2)
+        positions = np.arange(5)
+        board_idx = np.where(positions < n_known[:, None], positions,
+                             positions + 5 - n_known[:, None])
+        board = np.take_along_axis(
+            cards, np.broadcast_to(board_idx[:, None, :], (n_queries, n, 5)),
+            axis=2)
+        ranks = self._rank_hands(
+            np.broadcast_to(hands[:, None], (n_queries, n, n_hands, 2))
+            .reshape(-1, n_hands, 2), board.reshape(-1, 5))
+        self.n_simulated += n_queries * n
+        if n_players is None:
+            winners = ranks == ranks.min(axis=1, keepdims=True)
+            return (winners / winners.sum(axis=1, keepdims=True)).reshape(
+                n_queries, n, n_hands)
+
+        # Opponents take the cards after the ones completing the board,
+        # queries with fewer opponents never beat or tie with the others
+        first = 10 - n_known[:, None] + 2 * np.arange(n_opponents)
+        opponents = np.stack([
+            np.take_along_axis(cards, np.broadcast_to(
+                np.minimum(first + c, cards.shape[2] - 1)[:, None, :],
+                (n_queries, n, n_opponents)), axis=2)
+            for c in range(2)], axis=3)
+        opponent_ranks = self._rank_hands(
+            opponents.reshape(-1, n_opponents, 2), board.reshape(-1, 5))
+        seated = np.arange(n_opponents) < n_players[:, None] - 1
+        opponent_ranks = np.where(
+            np.repeat(seated, n, axis=0), opponent_ranks,
+            LookupTable.MAX_HIGH_CARD + 1)
+        return win_shares(ranks[:, 0], opponent_ranks).reshape(
+            n_queries, n, 1)
+
+    def get_hand_strength(self, my_hand, community):
+        """
+        EHS, EHS2 and river strength histogram of my_hand, see
+        `holdem.hand_strength`. Looked up in the table of the street when
+        it was built, else computed on up to n_evaluations runouts.
+        """
+        table = HAND_STRENGTH_TABLES.get(len(community))
+        if table is not None and table.available:
+            features = table.lookup(my_hand, community)
+            if features is not None:
+                return features
+        return hand_strength(self.evaluator, self._rng, my_hand, community,
+                             self.n_evaluations)
+
+    def get_bucket(self, my_hand, community):
+        """Bucket of my_hand in the card abstraction of the street."""
+        return BUCKET_TABLES[len(community)].bucket(my_hand, community, self)
+
+    def get_range_equity(self, my_hand, ranges, community, deck):
+        """
+        Equity of my_hand against an opponent range, or against a list of
+        ranges with one range per opponent. Ranges are weight vectors over
+        the combos of `holdem.ranges`, my_hand is two cards or, heads-up
+        only, a range too. Combos holding my or community cards get no
+        weight.
+        """
+        if np.ndim(ranges) == 1:
+            if len(my_hand) != N_COMBOS:
+                return float(self.get_range_equities([my_hand], ranges,
+                                                     community, deck)[0])
+            my_weights = np.asarray(my_hand, dtype=np.float64)
+            heroes = np.flatnonzero(my_weights)
+            shares, totals = self._range_showdowns(
+                community, deck, heroes, ranges, my_weights[heroes])
+            return float(my_weights[heroes] @ shares
+                         / (my_weights[heroes] @ totals))
+        elif len(my_hand) == N_COMBOS:
+            raise ValueError('Ranges of hands are only supported heads-up')
+        deck = [c for c in deck if c not in my_hand]
+        stats = self._simulate_range_equity(my_hand, ranges, community, deck,
+                                            self.n_evaluations)
+        self.n_simulated += stats.n
+        return float(stats.mean[0])
+
+    def get_range_equities(self, my_hands, weights, community, deck):
+        """
+        Heads-up equity of each hand of my_hands against the range `weights`,
+        all on the same runouts. NaN for hands the range has no combo
+        against.
+        """
+        shares, totals = self._range_showdowns(
+            community, deck, [combo_index(hand) for hand in my_hands],
+            weights)
+        return np.divide(shares, totals, out=np.full(len(shares), np.nan),
+                         where=totals > 0)
+
+    def _range_showdowns(self, community, deck, heroes, weights,
+                         hero_weights=None):
+        """
+        `showdown_sums` of the combos `heroes` against `weights` on every
+        runout when there are at most exact_threshold of them, else on
+        n_evaluations sampled runouts, fewer once the equity of each hero,
+        or of the heroes weighted by `hero_weights`, is within
+        target_stderr.
+        """
+        nb_add_comm = 5 - len(community)
+        shares = totals = 0.
+        if comb(len(deck), nb_add_comm) <= self.exact_threshold:
+            boards = enumerate_runouts(community, deck)
+            for start in range(0, len(boards), Equity.RANGE_BATCH_SIZE):
+                batch_shares, batch_totals = showdown_sums(
+                    self.evaluator,
+                    boards[start:start + Equity.RANGE_BATCH_SIZE], heroes,
+                    weights)
+                shares, totals = shares + batch_shares, totals + batch_totals
+            return shares, totals
+        stats = _RunningMean(1 if hero_weights is not None else len(heroes))
+        while stats.n < self.n_evaluations and not (
+                self.target_stderr is not None and stats.n
+                and stats.stderr.max() <= self.target_stderr):
+            boards = self._sample_boards(
+                community, deck, min(self.n_evaluations - stats.n,
+                                     Equity.RANGE_BATCH_SIZE),
+                nb_add_comm)[0]
+            board_shares, board_totals = showdown_shares(
+                self.evaluator, boards, heroes, weights)
+            shares = shares + board_shares.sum(axis=0)
+            totals = totals + board_totals.sum(axis=0)
+            if hero_weights is not None:
+                board_shares = board_shares @ hero_weights
+                board_totals = board_totals @ hero_weights
+            # equity on each runout, for the standard error
+            stats.add(np.divide(board_shares, board_totals,
+                                out=np.zeros(board_shares.shape),
+                                where=board_totals > 0))
+        self.n_simulated += stats.n
+        return shares, totals
+
+    def _simulate_range_equity(self, my_hand, ranges, community, deck,
+                               n_evaluations):
+        nb_add_comm = 5 - len(community)
+        stats = _RunningMean()
+        for n_samples in self._batches(stats, n_evaluations):
+            board = self._sample_boards(community, deck, n_samples,
+                                        nb_add_comm)[0]
+            used = card_masks(board) | card_mask(my_hand)
+            hands = [np.broadcast_to(my_hand, (n_samples, 2))]
+            dealt = np.ones(n_samples, dtype=bool)
+            # Deal opponents in turn from what the previous ones left
+            for weights in ranges:
+                combos = sample_combos(self._rng, weights, used)
+                dealt &= combos >= 0
+                used = used | COMBO_MASKS[combos]
+                hands.append(COMBOS[combos])
+            if not dealt.any():
+                break
+            ranks = self._rank_hands(np.stack(hands, axis=1)[dealt],
+                                     board[dealt])
+            stats.add(win_shares(ranks[:, 0], ranks[:, 1:]))
+        return stats
+
+    def _count_completions(self, n_players, community, deck):
+        """Number of distinct (runout, opponent hands) completions."""
+        n_left = len(deck) - (5 - len(community))
+        count = comb(len(deck), 5 - len(community))
+        for i in range(n_players - 1):
+            count *= comb(n_left - 2 * i, 2)
+        # opponents are interchangeable
+        return count // factorial(max(n_players - 1, 0))
+
+    def _get_my_equity_exact(self, my_hand, n_players, community, deck):
+        """Enumerate every runout and (at most one) opponent hand."""
+        if n_players < 2:
+            return 1.
+        deck = np.asarray(deck, dtype=np.int64)
+        masks = np.left_shift(1, np.arange(len(deck)), dtype=np.int64)
+        board_idx = self._enumerate_indices(len(deck), 5 - len(community))
+        opponent_idx = self._enumerate_indices(len(deck), 2)
+        # only keep opponent hands that do not share cards with the runout
+        board_masks = masks[board_idx].sum(axis=1)
+        opponent_masks = masks[opponent_idx].sum(axis=1)
+        board_i, opponent_i = np.nonzero(
+            board_masks[:, None] & opponent_masks[None, :] == 0)
+        boards = np.concatenate([
+            np.broadcast_to(np.asarray(community, dtype=np.int64),
+                            (len(board_i), len(community))),
+            deck[board_idx[board_i]]], axis=1)
+        hands = np.concatenate([
+            np.broadcast_to(my_hand[0], (len(board_i), 1, 2)),
+            deck[opponent_idx[opponent_i]][:, None, :]], axis=1)
+        ranks = self._rank_hands(hands, boards)
+        return win_shares(ranks[:, 0], ranks[:, 1:]).mean()
+
+    @staticmethod
+    def _enumerate_indices(n, k):
+        return np.array(list(combinations(range(n), k)),
+                        dtype=np.int64).reshape(comb(n, k), k)
+
+    def _use_pool(self):
+        # shards run their whole budget, adaptive queries stay in-process
+        return (self.backend == 'pool' and self.target_stderr is None
+                and self.n_evaluations >= Equity.POOL_MIN_SAMPLES)
+
+    def _batches(self, stats, n_evaluations):
+        """Batch sizes to simulate until the budget or the target is hit."""
+        batch_size = (Equity.BATCH_SIZE if self.target_stderr is None
+                      else Equity.ADAPTIVE_BATCH_SIZE)
+        while (stats.n < n_evaluations
+               and not self._precise_enough(stats, stats.n)):
+            yield min(n_evaluations - stats.n, batch_size)
+
+    def _precise_enough(self, stats, n_done):
+        return (self.target_stderr is not None and n_done > 0
+                and n_done % Equity.ADAPTIVE_BATCH_SIZE == 0
+                and stats.stderr.max() <= self.target_stderr)
+
+    def _draw_cards(self, deck, n_samples, n_cards):
+        return SAMPLERS[self.sampling](self._rng, deck, n_samples, n_cards)
+
+    def _sample_boards(self, community, deck, n_samples, n_cards):
+        """
+        Sample `n_cards` cards from the deck for every sample, the first ones
+        complete the community cards, the rest are returned separately.
+        """
+        nb_add_comm = 5 - len(community)
+        drawn = self._draw_cards(deck, n_samples, n_cards)
+        board = np.concatenate([
+            np.broadcast_to(np.asarray(community, dtype=np.int64),
+                            (n_samples, len(community))),
+            drawn[:, :nb_add_comm]], axis=1)
+        return board, drawn[:, nb_add_comm:]
+
+    def _rank_hands(self, hands, board, evaluator=None):
+        """Rank (n_samples, n_hands, 2) hole cards on (n_samples, 5) boards."""
+        hands = np.asarray(hands, dtype=np.int64)
+        cards = np.concatenate([
+            hands, np.broadcast_to(board[:, None, :],
+                                   hands.shape[:2] + (board.shape[1],))],
+            axis=2)
+        return (evaluator or self.evaluator).evaluate_array(cards)
 
 
 if __name__ == '__main__':
     deck = Deck()
-    equity = Equity(1000)
     card1, card2, card3, card4 = deck.draw(4)
-    dead = [card1, card2, card3, card4]
     cards = [[card1, card2], [card3, card4]]
     board = []
-
-    import time
-
-    start = time.time()
-    equities = equity._get_equities_python(cards, board, deck.cards)
     print(Card.print_pretty_card(card1), Card.print_pretty_card(card2),
           'VS', Card.print_pretty_card(card3), Card.print_pretty_card(card4))
-    print(equities)
-    print('Python takes %ss' % (time.time() - start,))
 
+    print('Available backends: %s, fastest: %s'
+          % (available_backends(), fastest_backend()))
+    for backend in available_backends():
+        equity = Equity(1000, backend=backend)
+        start = time.time()
+        equities = equity.get_equities(cards, board, deck.cards, [])
+        print('%s get_equities with 1000 steps: %s in %ss'
+              % (backend, equities, time.time() - start))
+
+    for backend in available_backends():
+        equity = Equity(10000, backend=backend)
+        start = time.time()
+        my_equity = equity.get_my_equity([[card1, card2]], 2, board,
+                                         deck.cards)
+        print('%s get_my_equity with 10000 steps: %s in %ss'
+              % (backend, my_equity, time.time() - start))
+
+    rng = np.random.default_rng(0)
+    queries = [rng.permutation(_DECK_ARRAY)[:5].tolist() for _ in range(200)]
+    equity = Equity(200, backend='lut')
     start = time.time()
-    equities = equity._get_equities_c(cards, board, dead)
-    print(Card.print_pretty_card(card1), Card.print_pretty_card(card2),
-          'VS', Card.print_pretty_card(card3), Card.print_pretty_card(card4))
-    print(equities)
-    print('C takes %ss' % (time.time() - start,))
+    for query in queries:
+        equity.get_my_equity([query[:2]], 3, query[2:],
+                             [c for c in _FULL_DECK if c not in query])
+    print('200 get_my_equity flop queries with 200 steps: %ss'
+          % (time.time() - start))
+    start = time.time()
+    equity.get_my_equity_batch([q[:2] for q in queries], 3,
+                               [q[2:] for q in queries])
+    print('The same with get_my_equity_batch: %ss' % (time.time() - start))
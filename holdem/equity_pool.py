@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Persistent process pool sharding large MC budgets of `Equity`.
+
+Every worker keeps its own `Equity` with warm evaluator tables. A query is
+split in one shard per worker, each shard gets an independent child of the
+caller's seed sequence, and the sums of the shards are merged by the caller.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+_executor = None
+_executor_workers = None
+# Equity of the worker process, created by _init_worker
+_worker_equity = None
+
+
+def _init_worker():
+    global _worker_equity
+    from .equity_evaluation import Equity
+    _worker_equity = Equity(backend='lut', exact_threshold=0)
+    # Load the evaluator tables before the first shard arrives
+    _worker_equity.evaluator.load()
+
+
+def _ping(_):
+    return os.getpid()
+
+
+def get_executor(max_workers=None):
+    """Process pool shared by every Equity of the process."""
+    global _executor, _executor_workers
+    max_workers = max_workers or os.cpu_count()
+    if _executor is None or _executor_workers != max_workers:
+        shutdown()
+        _executor = ProcessPoolExecutor(max_workers, initializer=_init_worker)
+        _executor_workers = max_workers
+    return _executor
+
+
+def warm_up(max_workers=None):
+    """Start every worker now rather than on the first large query."""
+    executor = get_executor(max_workers)
+    return set(executor.map(_ping, range(_executor_workers)))
+
+
+def shutdown():
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown()
+    _executor = None
+    _executor_workers = None
+
+
+def _simulate_shard(args):
+    method, query, n_evaluations, seed, sampling = args
+    _worker_equity._rng = np.random.default_rng(seed)
+    _worker_equity.sampling = sampling
+    stats = getattr(_worker_equity, method)(*query, n_evaluations)
+    return stats.n, stats.total, stats.total_sq
+
+
+def simulate(stats, method, query, n_evaluations, seed_sequence,
+             max_workers=None, sampling='random'):
+    """
+    Run `Equity.<method>(*query, n)` on every worker with a share of the
+    budget and merge the results into `stats`.
+    """
+    get_executor(max_workers)
+    n_shards = _executor_workers
+    shards = [n_evaluations // n_shards + (i < n_evaluations % n_shards)
+              for i in range(n_shards)]
+    tasks = [(method, query, n, seed, sampling) for n, seed
+             in zip(shards, seed_sequence.spawn(n_shards)) if n > 0]
+    for result in _executor.map(_simulate_shard, tasks):
+        stats.merge(*result)
+    return stats
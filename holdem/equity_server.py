@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Local equity service shared by many env processes.
+
+The server listens on a Unix domain socket (a named pipe on Windows) and
+answers `Equity` queries from any number of clients with warm evaluator
+tables and one `EquityCache`. Requests arriving while a batch is being
+evaluated are collected into the next batch. Identical (suit isomorphic)
+queries of a batch are evaluated once, and the `get_my_equity_with_error`
+queries of a batch sharing their settings are answered by one vectorized
+`Equity.get_my_equity_batch` call.
+
+Start it with `python -m holdem.equity_server --address /tmp/holdem.sock`,
+which prints the authentication key of the server, or with
+`process, authkey = start_server(address)`, then use
+`Equity(backend='server', server_address=address, server_authkey=authkey)`
+in the clients. Clients must know the key because connections unpickle
+what the other end sends, and the socket is only accessible to its owner.
+"""
+
+import itertools
+import os
+import queue
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from .canonical import canonical_key
+from .equity_cache import EquityCache
+
+FAMILY = 'AF_PIPE' if sys.platform.startswith('win') else 'AF_UNIX'
+METHODS = ('get_my_equity_with_error', 'get_equities')
+
+
+class EquityServer():
+    """
+    Serve equity queries on `address` to clients knowing `authkey`, a
+    random key by default. Every distinct (n_evaluations, exact_threshold,
+    target_stderr, sampling) setting of the clients gets its own `Equity`,
+    all of them share one cache.
+    """
+
+    def __init__(self, address, backend='auto', cache_bytes=256 * 2**20,
+                 max_batch=256, batch_window=0.002, seed=None,
+                 authkey=None):
+        self.address = address
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        self.backend = backend
+        self.cache = EquityCache(cache_bytes)
+        self.max_batch = max_batch
+        # Time to wait for more requests once the first one of a batch came
+        self.batch_window = batch_window
+        self.seed = seed
+        self.n_requests = 0
+        self.n_evaluated = 0
+        self.n_batches = 0
+        # Queries answered by get_my_equity_batch calls
+        self.n_batched = 0
+        self._equities = {}
+        self._requests = queue.Queue()
+        if FAMILY == 'AF_UNIX' and os.path.lexists(address):
+            if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                raise FileExistsError('%s exists and is not a socket'
+                                      % address)
+            # left over by a server that was killed
+            os.unlink(address)
+        self._listener = Listener(address, FAMILY, authkey=self.authkey)
+        if FAMILY == 'AF_UNIX':
+            os.chmod(address, 0o600)
+        self._closed = threading.Event()
+
+    def serve_forever(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        while not self._closed.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._evaluate(batch)
+
+    def close(self):
+        self._closed.set()
+        self._listener.close()
+
+    def stats(self):
+        return {'requests': self.n_requests, 'evaluated': self.n_evaluated,
+                'batches': self.n_batches, 'batched': self.n_batched,
+                'cache': self.cache.stats()}
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                connection = self._listener.accept()
+            except (AuthenticationError, EOFError):
+                # a client without the key, or one that hung up
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self._receive, args=(connection,),
+                             daemon=True).start()
+
+    def _receive(self, connection):
+        lock = threading.Lock()
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                connection.close()
+                return
+            if request == 'stats':
+                with lock:
+                    connection.send(('stats', True, self.stats()))
+                continue
+            error = _request_error(request)
+            if error is None:
+                self._requests.put((connection, lock, request))
+                continue
+            request_id = (request[0] if isinstance(request, tuple)
+                          and request else None)
+            with lock:
+                try:
+                    connection.send((request_id, False, error))
+                except OSError:
+                    pass
+
+    def _next_batch(self):
+        try:
+            batch = [self._requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._requests.get(
+                    timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _evaluate(self, batch):
+        self.n_batches += 1
+        self.n_requests += len(batch)
+        keys, queries, results = [], {}, {}
+        for _, _, (request_id, method, settings, args) in batch:
+            try:
+                key = _request_key(method, settings, args)
+            except Exception as e:
+                key = ('invalid', request_id)
+                results[key] = _error(e)
+            keys.append(key)
+            queries[key] = (method, settings, args)
+        batches = {}
+        for key, (method, settings, args) in queries.items():
+            if (key not in results
+                    and method == 'get_my_equity_with_error'):
+                batches.setdefault(settings, []).append(key)
+        for settings, batch_keys in batches.items():
+            if len(batch_keys) > 1:
+                self._evaluate_my_equities(settings, batch_keys, queries,
+                                           results)
+        for key, (method, settings, args) in queries.items():
+            if key not in results:
+                try:
+                    results[key] = (True, getattr(self._equity(settings),
+                                                  method)(*args))
+                except Exception as e:
+                    results[key] = _error(e)
+                self.n_evaluated += 1
+
+        for (connection, lock, request), key in zip(batch, keys):
+            ok, result = results[key]
+            with lock:
+                try:
+                    connection.send((request[0], ok, result))
+                except OSError:
+                    pass
+
+    def _evaluate_my_equities(self, settings, keys, queries, results):
+        """
+        Answer the `get_my_equity_with_error` queries `keys` in one
+        `get_my_equity_batch` call, which looks up and fills the cache.
+        Queries are left to be evaluated one by one if it fails.
+        """
+        args = [queries[key][2] for key in keys]
+        try:
+            equity = self._equity(settings)
+            equities, errors = equity.get_my_equity_batch(
+                [my_hand[0] for my_hand, _, _, _ in args],
+                [n_players for _, n_players, _, _ in args],
+                [community for _, _, community, _ in args],
+                [equity._removed_cards(deck, community, my_hand[0])
+                 for my_hand, _, community, deck in args],
+                with_error=True)
+        except Exception:
+            return
+        for key, mean, error in zip(keys, equities.tolist(),
+                                    errors.tolist()):
+            results[key] = (True, (mean, error))
+        self.n_evaluated += len(keys)
+        self.n_batched += len(keys)
+
+    def _equity(self, settings):
+        if settings not in self._equities:
+            from .equity_evaluation import Equity
+            n_evaluations, exact_threshold, target_stderr, sampling = settings
+            self._equities[settings] = Equity(
+                n_evaluations, backend=self.backend, seed=self.seed,
+                exact_threshold=exact_threshold, cache=self.cache,
+                target_stderr=target_stderr, sampling=sampling)
+        return self._equities[settings]
+
+
+def _request_error(request):
+    """Why a request can not be evaluated, None if it can."""
+    if not isinstance(request, tuple) or len(request) != 4:
+        return ('ValueError: expected a (request_id, method, settings, '
+                'args) tuple')
+    _, method, settings, args = request
+    if method not in METHODS:
+        return 'ValueError: unknown equity server method %r' % (method,)
+    if not isinstance(settings, tuple) or len(settings) != 4:
+        return ('ValueError: expected (n_evaluations, exact_threshold, '
+                'target_stderr, sampling) settings')
+    if not isinstance(args, tuple) or len(args) != 4:
+        return 'ValueError: %s takes 4 arguments' % method
+    return None
+
+
+def _error(e):
+    return False, '%s: %s' % (type(e).__name__, e)
+
+
+def _request_key(method, settings, args):
+    """Requests with the same key get the same answer."""
+    if method == 'get_my_equity_with_error':
+        my_hand, n_players, community, deck = args
+        spot = canonical_key(my_hand[0], community, sorted(deck))
+        return method, settings, spot, n_players
+    hands, community, deck, dead = args
+    # the order of hands matters for the answer, keep them apart
+    return (method, settings, tuple(tuple(sorted(h)) for h in hands),
+            tuple(sorted(community)), tuple(sorted(set(deck) - set(dead))))
+
+
+class EquityClient():
+    """
+    Connection to an `EquityServer` with its `authkey`. `submit` returns a
+    Future so queries can be sent without waiting for the previous answers.
+    """
+
+    def __init__(self, address, authkey=None):
+        self._connection = Client(address, FAMILY, authkey=authkey)
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+
+    def submit(self, method, settings, *args):
+        if method not in METHODS and method != 'stats':
+            raise ValueError('Unknown equity server method %s' % method)
+        future = Future()
+        with self._send_lock:
+            if method == 'stats':
+                request_id = 'stats'
+                self._pending[request_id] = future
+                self._connection.send('stats')
+            else:
+                request_id = next(self._ids)
+                self._pending[request_id] = future
+                self._connection.send((request_id, method, settings, args))
+        return future
+
+    def stats(self):
+        return self.submit('stats', None).result()
+
+    def close(self):
+        self._connection.close()
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, ok, result = self._connection.recv()
+            except (EOFError, OSError) as e:
+                for future in self._pending.values():
+                    future.set_exception(ConnectionError(
+                        'Equity server connection closed: %s' % e))
+                self._pending.clear()
+                return
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                # error about a request this client did not send
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+
+def serve(address, **kwargs):
+    server = EquityServer(address, **kwargs)
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+
+
+def start_server(address, timeout=30., authkey=None, **kwargs):
+    """
+    Run `serve` in a new process and wait until it accepts clients.
+    Returns the process and the authentication key of the server.
+    """
+    from multiprocessing import get_context
+    authkey = os.urandom(32) if authkey is None else authkey
+    process = get_context('spawn').Process(
+        target=serve, args=(address,), kwargs=dict(kwargs, authkey=authkey),
+        daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            Client(address, FAMILY, authkey=authkey).close()
+            return process, authkey
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError('Equity server did not start on %s'
+                                   % address)
+            time.sleep(0.05)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the equity server.')
+    parser.add_argument('--address', default='/tmp/holdem-equity.sock')
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--cache-mb', type=int, default=256)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--authkey', help='hex key, random by default')
+    args = parser.parse_args()
+
+    authkey = (os.urandom(32) if args.authkey is None
+               else bytes.fromhex(args.authkey))
+    print('Serving equities on %s, authkey %s' % (args.address,
+                                                  authkey.hex()))
+    serve(args.address, backend=args.backend, authkey=authkey,
+          cache_bytes=args.cache_mb * 2**20, max_batch=args.max_batch)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Expected hand strength features of a hand on a board.
+
+The strength of a hand on a river board is its equity against one random
+hand. Earlier in the hand the features describe how that river strength is
+distributed over the runouts: its mean (EHS), the mean of its square (EHS2,
+which grows with the potential of drawing hands) and a histogram over
+HISTOGRAM_BINS equal bins of [0, 1].
+
+Features of every suit isomorphic situation of a street can be precomputed
+with `python -m holdem.hand_strength --street flop` into a pair of arrays in
+`data/`: sorted 64 bit fingerprints of `canonical_key(hand, board)` and the
+float32 features of each, memory-mapped on first lookup. The preflop table
+ships with the package. Without a table the features are computed on
+up to n_runouts runouts by `hand_strength`.
+"""
+
+import os
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+from .canonical import canonical_key
+from .lut_evaluator import LookupEvaluator
+from .ranges import (COMBOS, COMBO_MASKS, FULL_DECK, card_mask, combo_index,
+                     showdown_shares, uniform_range)
+from .shm_cache import fingerprint
+from .vectorized import sample_cards
+
+HISTOGRAM_BINS = 10
+# EHS, EHS2 and the histogram
+N_FEATURES = 2 + HISTOGRAM_BINS
+STREETS = {'preflop': 0, 'flop': 3, 'turn': 4}
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+# Boards ranked at once, each one holds every combo times its conflicts
+BOARD_CHUNK = 16
+
+
+def strength_features(strengths):
+    """
+    Features (n_hands, N_FEATURES) of river strengths (n_runouts, n_hands),
+    runouts with a NaN strength are left out.
+    """
+    valid = ~np.isnan(strengths)
+    n_valid = valid.sum(axis=0)
+    strengths = np.where(valid, strengths, 0.)
+    bins = np.minimum((strengths * HISTOGRAM_BINS).astype(np.int64),
+                      HISTOGRAM_BINS - 1)
+    histogram = ((bins[..., None] == np.arange(HISTOGRAM_BINS)) &
+                 valid[..., None]).sum(axis=0)
+    return np.column_stack([strengths.sum(axis=0),
+                            (strengths ** 2).sum(axis=0),
+                            histogram]) / n_valid[:, None]
+
+
+def river_strengths(evaluator, boards, hero_idx):
+    """
+    Equities (n_boards, n_heroes) of the combos `hero_idx` against one
+    random hand on complete boards, NaN on boards holding a hero card.
+    """
+    strengths = []
+    for start in range(0, len(boards), BOARD_CHUNK):
+        shares, totals = showdown_shares(
+            evaluator, boards[start:start + BOARD_CHUNK], hero_idx,
+            uniform_range())
+        with np.errstate(invalid='ignore'):
+            strengths.append(shares / totals)
+    return np.concatenate(strengths)
+
+
+def runouts(rng, board, deck, n_runouts):
+    """
+    Complete boards from `board` and cards of `deck`: all of them when there
+    are at most n_runouts, otherwise n_runouts sampled ones.
+    """
+    n_cards = 5 - len(board)
+    if comb(len(deck), n_cards) <= n_runouts:
+        return enumerate_runouts(board, deck)
+    added = sample_cards(rng, deck, n_runouts, n_cards)
+    return np.concatenate([
+        np.broadcast_to(np.asarray(board, dtype=np.int64),
+                        (len(added), len(board))), added], axis=1)
+
+
+def enumerate_runouts(board, deck):
+    """Every board completing `board` with cards of `deck`."""
+    n_cards = 5 - len(board)
+    added = np.array(list(combinations(deck, n_cards)),
+                     dtype=np.int64).reshape(comb(len(deck), n_cards),
+                                             n_cards)
+    return np.concatenate([
+        np.broadcast_to(np.asarray(board, dtype=np.int64),
+                        (len(added), len(board))), added], axis=1)
+
+
+def hand_strength(evaluator, rng, hand, board, n_runouts):
+    """Features of one hand, computed on at most n_runouts runouts."""
+    deck = [c for c in FULL_DECK if c not in hand and c not in board]
+    boards = runouts(rng, board, deck, n_runouts)
+    return strength_features(river_strengths(evaluator, boards,
+                                             [combo_index(hand)]))[0]
+
+
+class SituationTable():
+    """
+    Arrays of one street stored in `data_dir` as NAMES, every array but
+    the unaligned ones has a row per situation in the order of 'keys', the
+    sorted fingerprints of `canonical_key(hand, board)`.
+    """
+
+    PREFIX = None
+    NAMES = ('keys',)
+
+    def __init__(self, street, data_dir=DATA_DIR):
+        self.street = street
+        self.paths = {name: os.path.join(data_dir, '%s_%s_%s.npy'
+                                         % (self.PREFIX, street, name))
+                      for name in self.NAMES}
+        self._arrays = None
+        self._available = None
+
+    @property
+    def available(self):
+        if self._available is None:
+            self._available = all(os.path.exists(p)
+                                  for p in self.paths.values())
+        return self._available
+
+    def load(self):
+        """Memory-map the arrays now rather than on the first lookup."""
+        if self._arrays is None:
+            self._arrays = {name: np.load(path, mmap_mode='r')
+                            for name, path in self.paths.items()}
+        return self._arrays
+
+    def index(self, hand, board):
+        """Row of the hand on the board, None if not in the table."""
+        keys = self.load()['keys']
+        key = np.uint64(fingerprint(canonical_key(hand, board)))
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return int(i)
+        return None
+
+    def save(self, **arrays):
+        os.makedirs(os.path.dirname(self.paths['keys']), exist_ok=True)
+        for name, path in self.paths.items():
+            np.save(path, arrays[name])
+        self._arrays = self._available = None
+
+
+class HandStrengthTable(SituationTable):
+    """Precomputed features of every situation of one street."""
+
+    PREFIX = 'hs'
+    NAMES = ('keys', 'features')
+
+    def lookup(self, hand, board):
+        """Features of the hand on the board, None if not in the table."""
+        i = self.index(hand, board)
+        if i is None:
+            return None
+        return np.array(self.load()['features'][i], dtype=np.float64)
+
+
+# Shared by every Equity in the process, keyed by number of board cards
+HAND_STRENGTH_TABLES = {n_cards: HandStrengthTable(street)
+                        for street, n_cards in STREETS.items()}
+
+
+def canonical_boards(n_cards):
+    """One board of every suit isomorphic class of n_cards cards."""
+    boards = {}
+    for board in combinations(FULL_DECK, n_cards):
+        boards.setdefault(canonical_key(board), board)
+    return list(boards.values())
+
+
+def _board_features(args):
+    board, n_runouts, seed = args
+    deck = [c for c in FULL_DECK if c not in board]
+    boards = runouts(np.random.default_rng(seed), board, deck, n_runouts)
+    heroes = np.flatnonzero((COMBO_MASKS & card_mask(board)) == 0)
+    features = strength_features(river_strengths(LookupEvaluator(), boards,
+                                                 heroes))
+    keys = [fingerprint(canonical_key(hand, board))
+            for hand in COMBOS[heroes].tolist()]
+    return np.array(keys, dtype=np.uint64), features
+
+
+def build_table(street, n_runouts=1000, processes=None, seed=0):
+    """
+    Features of every situation of the street on a process pool, averaged
+    over the isomorphic hands of each board. Returns sorted keys and
+    features.
+    """
+    from multiprocessing import Pool
+    boards = canonical_boards(STREETS[street])
+    seeds = np.random.SeedSequence(seed).spawn(len(boards))
+    tasks = [(b, n_runouts, s) for b, s in zip(boards, seeds)]
+    with Pool(processes) as pool:
+        results = pool.map(_board_features, tasks, chunksize=4)
+    keys = np.concatenate([k for k, _ in results])
+    features = np.concatenate([f for _, f in results])
+    keys, inverse, counts = np.unique(keys, return_inverse=True,
+                                      return_counts=True)
+    averaged = np.zeros((len(keys), N_FEATURES))
+    np.add.at(averaged, inverse, features)
+    return keys, (averaged / counts[:, None]).astype(np.float32)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description='Build hand strength tables.')
+    parser.add_argument('--street', nargs='+', default=['preflop'],
+                        choices=list(STREETS))
+    parser.add_argument('--runouts', type=int, default=1000,
+                        help='runouts per board, all of them if fewer')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes, defaults to all cores')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for street in args.street:
+        start = time.time()
+        keys, features = build_table(street, args.runouts, args.processes,
+                                     args.seed)
+        HAND_STRENGTH_TABLES[STREETS[street]].save(keys=keys,
+                                                   features=features)
+        print('Built %s table of %d situations in %ss'
+              % (street, len(keys), time.time() - start))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+5 to 7 card hand evaluator backed by precomputed rank tables.
+
+A hand without a flush is ranked by its multiset of card ranks alone, which is
+encoded as the sum of 5**rank over the cards and looked up among the 73775
+multisets of 5, 6 and 7 cards. With 7 or fewer cards a flush always beats
+every hand the other cards could make, so a flush is ranked by the 13 bit rank
+mask of its suit. Ranks are the ones of treys `Evaluator.evaluate`.
+
+The tables are written to `data/` by `python -m holdem.lut_evaluator` and are
+memory-mapped the first time an evaluator needs them.
+"""
+
+import os
+from itertools import combinations, combinations_with_replacement
+
+import numpy as np
+
+from treys import Card, Evaluator
+from treys.lookup import LookupTable
+
+from .canonical import SUIT_INDEX
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+TABLE_FILES = ('lut_unsuited_keys.npy', 'lut_unsuited_ranks.npy',
+               'lut_flush_ranks.npy')
+
+_POW5 = 5 ** np.arange(13, dtype=np.int64)
+# canonical.SUIT_INDEX as an array indexed by the suit bits
+_SUIT_LOOKUP = np.zeros(16, dtype=np.int64)
+_SUIT_LOOKUP[list(SUIT_INDEX)] = list(SUIT_INDEX.values())
+
+_tables = None
+
+
+def build_tables():
+    """Rank every rank multiset and every flush rank mask."""
+    table = LookupTable()
+    keys, ranks = [], []
+    for n_cards in (5, 6, 7):
+        for hand_ranks in combinations_with_replacement(range(13), n_cards):
+            if any(hand_ranks.count(r) > 4 for r in set(hand_ranks)):
+                continue
+            keys.append(sum(5 ** r for r in hand_ranks))
+            ranks.append(min(
+                table.unsuited_lookup[_prime_product(five)]
+                for five in set(combinations(hand_ranks, 5))))
+    order = np.argsort(keys)
+    unsuited_keys = np.array(keys, dtype=np.int64)[order]
+    unsuited_ranks = np.array(ranks, dtype=np.int16)[order]
+
+    flush_ranks = np.full(1 << 13, LookupTable.MAX_HIGH_CARD + 1,
+                          dtype=np.int16)
+    for n_cards in (5, 6, 7):
+        for suited in combinations(range(13), n_cards):
+            mask = sum(1 << r for r in suited)
+            flush_ranks[mask] = min(
+                table.flush_lookup[_prime_product(five)]
+                for five in combinations(suited, 5))
+    return unsuited_keys, unsuited_ranks, flush_ranks
+
+
+def _prime_product(ranks):
+    product = 1
+    for r in ranks:
+        product *= Card.PRIMES[r]
+    return product
+
+
+def save_tables(tables, data_dir=DATA_DIR):
+    os.makedirs(data_dir, exist_ok=True)
+    for name, array in zip(TABLE_FILES, tables):
+        np.save(os.path.join(data_dir, name), array)
+
+
+def load_tables(data_dir=DATA_DIR):
+    """Memory-mapped tables, built and saved first if they are missing."""
+    global _tables
+    if _tables is None:
+        paths = [os.path.join(data_dir, name) for name in TABLE_FILES]
+        if all(os.path.exists(path) for path in paths):
+            _tables = tuple(np.load(path, mmap_mode='r') for path in paths)
+        else:
+            _tables = build_tables()
+            try:
+                save_tables(_tables, data_dir)
+            except OSError:
+                pass
+    return _tables
+
+
+class LookupEvaluator(Evaluator):
+    """
+    Drop-in replacement of treys `Evaluator` that also ranks NumPy arrays of
+    hands with `evaluate_array`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._unsuited_keys = None
+        self._unsuited_ranks = None
+        self._flush_ranks = None
+
+    def load(self):
+        """Map the tables now rather than on the first evaluation."""
+        (self._unsuited_keys, self._unsuited_ranks,
+         self._flush_ranks) = load_tables()
+
+    def evaluate(self, cards, board):
+        if self._flush_ranks is None:
+            self.load()
+        cards = cards + board
+        key = 0
+        suit_counts = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+        for c in cards:
+            key += 5 ** ((c >> 8) & 0xF)
+            suit_counts[(c >> 12) & 0xF] += 1
+        for suit in (1, 2, 4, 8):
+            if suit_counts[suit] >= 5:
+                mask = 0
+                for c in cards:
+                    if (c >> 12) & suit:
+                        mask |= c >> 16
+                return int(self._flush_ranks[mask])
+        return int(self._unsuited_ranks[
+            np.searchsorted(self._unsuited_keys, key)])
+
+    def evaluate_array(self, cards):
+        """Rank an array of shape (..., n) of 5 to 7 card hands."""
+        if self._flush_ranks is None:
+            self.load()
+        cards = np.asarray(cards, dtype=np.int64)
+        keys = _POW5[(cards >> 8) & 0xF].sum(axis=-1)
+        # hands repeating a card can hold 5 of a rank, they get some rank
+        # instead of an error so callers can mask them afterwards
+        ranks = self._unsuited_ranks[np.minimum(
+            np.searchsorted(self._unsuited_keys, keys),
+            len(self._unsuited_keys) - 1)]
+        suits = _SUIT_LOOKUP[(cards >> 12) & 0xF]
+        # 3 bits per suit are enough to count up to 7 cards
+        suit_counts = np.left_shift(1, 3 * suits).sum(axis=-1)
+        counts = (suit_counts[..., None] >> (3 * np.arange(4))) & 7
+        is_flush = (counts >= 5).any(axis=-1)
+        if is_flush.any():
+            flush_suit = counts[is_flush].argmax(axis=-1)
+            flush_cards = cards[is_flush]
+            in_suit = suits[is_flush] == flush_suit[:, None]
+            masks = np.bitwise_or.reduce(
+                np.where(in_suit, (flush_cards >> 16) & 0x1FFF, 0), axis=-1)
+            ranks[is_flush] = self._flush_ranks[masks]
+        return ranks
+
+
+if __name__ == '__main__':
+    import time
+
+    from treys import Deck
+
+    from .vectorized import VectorizedEvaluator
+
+    start = time.time()
+    tables = build_tables()
+    save_tables(tables)
+    print('Built rank tables in %ss' % (time.time() - start,))
+
+    rng = np.random.default_rng(0)
+    full_deck = np.array(Deck.GetFullDeck())
+    hands = full_deck[np.argsort(rng.random((100000, 52)), axis=1)[:, :7]]
+    for evaluator in (LookupEvaluator(), VectorizedEvaluator()):
+        evaluator.evaluate_array(hands[:10])
+        start = time.time()
+        evaluator.evaluate_array(hands)
+        print('%s: %d hands/s' % (type(evaluator).__name__,
+                                  len(hands) / (time.time() - start)))
+    treys, lookup = Evaluator(), LookupEvaluator()
+    for evaluator in (lookup, treys):
+        start = time.time()
+        for hand in hands[:20000].tolist():
+            evaluator.evaluate(hand[:2], hand[2:])
+        print('%s.evaluate: %d hands/s' % (type(evaluator).__name__,
+                                           20000 / (time.time() - start)))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Settling all the pots of a hand at once.
+
+`expected_payouts` splits every pot between its best hands on each runout
+and averages the chips won over the runouts, so side pots are settled on the
+same runouts instead of one simulation each. `chip_payouts` rounds the
+result to whole chips without creating or losing any.
+"""
+
+import numpy as np
+
+
+def expected_payouts(ranks, pots, amounts):
+    """
+    Average chips won by every hand given its ranks (n_runouts, n_hands) on
+    each runout, pots being lists of indices of the hands contesting them
+    and amounts the chips in each pot.
+    """
+    ranks = np.asarray(ranks)
+    payouts = np.zeros(ranks.shape[1])
+    for pot, amount in zip(pots, amounts):
+        contenders = ranks[:, pot]
+        winners = contenders == contenders.min(axis=1, keepdims=True)
+        payouts[pot] += amount * (winners / winners.sum(axis=1, keepdims=True)
+                                  ).mean(axis=0)
+    return payouts
+
+
+def chip_payouts(payouts, priority=None):
+    """
+    Round expected payouts to whole chips that add up to their total. Every
+    hand gets its payout rounded down and the chips left go to the largest
+    remainders, ties going first to the lowest `priority` (by default the
+    order of the hands).
+    """
+    payouts = np.asarray(payouts, dtype=np.float64)
+    total = int(round(payouts.sum()))
+    # tolerance for payouts summed from float shares, e.g. 3 * (100 / 3)
+    chips = np.floor(payouts + 1e-9).astype(np.int64)
+    remainders = np.round(payouts - chips, 9)
+    if priority is None:
+        priority = np.arange(len(payouts))
+    order = np.lexsort((priority, -remainders))
+    chips[order[:total - chips.sum()]] += 1
+    return chips
@@ -24,15 +24,27 @@
 
 from gym import error
 
+from .table_state import CONVERTERS, FIELDS, TableState
+
 
 class Player(object):
+    """
+    A seat of a table, a view of slot `slot` of a `TableState`. Players
+    created without a state get a state of their own. Chip amounts are
+    whole numbers, fractional ones raise ValueError.
+    """
 
     CHECK = 0
     CALL = 1
     RAISE = 2
     FOLD = 3
 
-    def __init__(self, player_id, stack=2500, emptyplayer=False):
+    def __init__(self, player_id, stack=2500, emptyplayer=False, state=None,
+                 slot=0):
+        # checked before writing anything to the slot
+        stack = CONVERTERS[FIELDS['stack']](stack)
+        self._state = TableState(1) if state is None else state
+        self._slot = slot
         self.player_id = player_id
 
         self.hand = []
@@ -55,6 +67,54 @@ class Player(object):
         # not used at the moment, but might become useful in the future
         self.sitting_out = False
 
+    def _field(name):
+        convert = CONVERTERS[FIELDS[name]]
+
+        def get(self):
+            return getattr(self._state, name)[self._slot]
+
+        def set(self, value):
+            self._state.write(getattr(self._state, name), self._slot,
+                              convert(value))
+        return property(get, set)
+
+    def _flag_field(name):
+        def get(self):
+            return bool(getattr(self._state, name)[self._slot])
+
+        def set(self, value):
+            self._state.write(getattr(self._state, name), self._slot,
+                              bool(value))
+        return property(get, set)
+
+    player_id = _field('player_id')
+    stack = _field('stack')
+    starting_stack = _field('starting_stack')
+    hand_starting_stack = _field('hand_starting_stack')
+    currentbet = _field('currentbet')
+    lastsidepot = _field('lastsidepot')
+    _seat = _field('seat')
+    handrank = _field('handrank')
+    blind = _field('blind')
+    equity = _field('equity')
+    emptyplayer = _flag_field('emptyplayer')
+    isallin = _flag_field('isallin')
+    playing_hand = _flag_field('playing_hand')
+    playedthisround = _flag_field('playedthisround')
+    sitting_out = _flag_field('sitting_out')
+    _card0 = _field('card0')
+    _card1 = _field('card1')
+    del _field, _flag_field
+
+    @property
+    def hand(self):
+        state, slot = self._state, self._slot
+        return [c for c in (state.card0[slot], state.card1[slot]) if c]
+
+    @hand.setter
+    def hand(self, cards):
+        self._card0, self._card1 = list(cards) + [0] * (2 - len(cards))
+
     @property
     def max_bet(self):
         return self.currentbet + self.stack
@@ -102,7 +162,8 @@ class Player(object):
             self.stack = amount
 
     def validate_action(self, tocall, minraise, action):
-        tocall = min(tocall, self.max_bet)
+        max_bet = self.max_bet
+        tocall = min(tocall, max_bet)
 
         [action_idx, raise_amount] = action
         raise_amount = int(raise_amount)
@@ -114,9 +175,9 @@ class Player(object):
                 if raise_amount < minraise:
                     raise error.Error(
                         'raise must be at least minraise {}'.format(minraise))
-                if raise_amount > self.max_bet:
+                if raise_amount > max_bet:
                     raise error.Error(
-                        'raise must be at most maxraise {}'.format(self.max_bet))
+                        'raise must be at most maxraise {}'.format(max_bet))
                 move_tuple = ('raise', raise_amount)
             elif action_idx == Player.CHECK:
                 move_tuple = ('check', self.currentbet)
@@ -131,12 +192,12 @@ class Player(object):
                 if raise_amount < minraise:
                     raise error.Error(
                         'raise must be at least minraise {}'.format(minraise))
-                if raise_amount > self.max_bet:
+                if raise_amount > max_bet:
                     raise error.Error(
-                        'raise must be at most maxraise {}'.format(self.max_bet))
+                        'raise must be at most maxraise {}'.format(max_bet))
                 move_tuple = ('raise', raise_amount)
             elif action_idx == Player.CALL:
-                move_tuple = ('call', min(tocall, self.max_bet))
+                move_tuple = ('call', tocall)
             elif action_idx == Player.FOLD:
                 move_tuple = ('fold', self.currentbet)
         return move_tuple
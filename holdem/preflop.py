@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Preflop equity of the 169 starting hand classes against 1 to 9 random
+opponents.
+
+The table is precomputed with `python -m holdem.preflop` and shipped as
+`data/preflop_equity.npy`, a (MAX_OPPONENTS, N_CLASSES) float32 array that is
+memory-mapped the first time it is needed.
+"""
+
+import os
+
+import numpy as np
+
+from treys import Card, Deck
+
+N_CLASSES = 169
+MAX_OPPONENTS = 9
+TABLE_PATH = os.path.join(os.path.dirname(__file__), 'data',
+                          'preflop_equity.npy')
+
+
+def hand_class(hand):
+    """
+    Index of the starting hand class of two hole cards on a 13x13 grid.
+
+    Rows and columns go from aces down to deuces, pairs are on the diagonal,
+    suited hands above it and offsuit hands below it.
+    """
+    high, low = sorted((Card.get_rank_int(c) for c in hand), reverse=True)
+    row, col = 12 - high, 12 - low
+    if Card.get_suit_int(hand[0]) != Card.get_suit_int(hand[1]):
+        row, col = col, row
+    return row * 13 + col
+
+
+def class_hand(index):
+    """Representative hole cards of a starting hand class."""
+    row, col = divmod(index, 13)
+    high, low = 12 - min(row, col), 12 - max(row, col)
+    suits = 'ss' if row < col else 'sh'
+    return [Card.new(Card.STR_RANKS[high] + suits[0]),
+            Card.new(Card.STR_RANKS[low] + suits[1])]
+
+
+class PreflopEquityTable():
+    def __init__(self, path=TABLE_PATH):
+        self.path = path
+        self._table = None
+        self._available = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = np.load(self.path, mmap_mode='r')
+        return self._table
+
+    @property
+    def available(self):
+        if self._available is None:
+            self._available = os.path.exists(self.path)
+        return self._available
+
+    def covers(self, n_opponents):
+        return self.available and 1 <= n_opponents <= MAX_OPPONENTS
+
+    def get_equity(self, hand, n_opponents):
+        return float(self.table[n_opponents - 1, hand_class(hand)])
+
+
+# Shared by every Equity in the process, loaded on first lookup
+PREFLOP_TABLE = PreflopEquityTable()
+
+
+def _class_equity(args):
+    from .equity_evaluation import Equity
+    index, n_opponents, n_samples, seed = args
+    hand = class_hand(index)
+    deck = [c for c in Deck.GetFullDeck() if c not in hand]
+    equity = Equity(n_samples, seed=seed, exact_threshold=0)
+    return equity.get_my_equity([hand], n_opponents + 1, [], deck)
+
+
+def build_table(n_samples=50000, processes=None, seed=0):
+    """Simulate every (opponent count, hand class) cell on a process pool."""
+    from multiprocessing import Pool
+    cells = [(i, n) for n in range(1, MAX_OPPONENTS + 1)
+             for i in range(N_CLASSES)]
+    seeds = np.random.SeedSequence(seed).spawn(len(cells))
+    tasks = [(i, n, n_samples, s) for (i, n), s in zip(cells, seeds)]
+    with Pool(processes) as pool:
+        equities = pool.map(_class_equity, tasks, chunksize=4)
+    return np.array(equities, dtype=np.float32).reshape(MAX_OPPONENTS,
+                                                        N_CLASSES)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description='Build the preflop equity table.')
+    parser.add_argument('--samples', type=int, default=50000,
+                        help='MC samples per hand class and opponent count')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes, defaults to all cores')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=TABLE_PATH)
+    args = parser.parse_args()
+
+    start = time.time()
+    table = build_table(args.samples, args.processes, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    np.save(args.output, table)
+    print('Built %s in %ss' % (args.output, time.time() - start))
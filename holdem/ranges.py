@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Weighted ranges of hole cards as vectors over the 1326 two-card combos.
+
+`COMBOS[i]` are the two treys cards of combo i and `COMBO_MASKS[i]` their
+bits in a 52 bit mask of the full deck, so card removal is a bitwise AND over
+the whole range at once.
+"""
+
+from itertools import combinations
+
+import numpy as np
+
+from treys import Deck
+
+from .preflop import PREFLOP_TABLE, N_CLASSES, hand_class
+
+N_COMBOS = 1326
+
+FULL_DECK = Deck.GetFullDeck()
+# Position of each card in FULL_DECK
+CARD_INDEX = {card: i for i, card in enumerate(FULL_DECK)}
+_SORTED_CARDS = np.sort(FULL_DECK)
+_SORTED_CARD_INDEX = np.array([CARD_INDEX[c] for c in _SORTED_CARDS],
+                              dtype=np.int64)
+
+COMBOS = np.array(list(combinations(FULL_DECK, 2)), dtype=np.int64)
+COMBO_MASKS = np.array([(1 << CARD_INDEX[a]) | (1 << CARD_INDEX[b])
+                        for a, b in COMBOS.tolist()], dtype=np.int64)
+COMBO_CLASSES = np.array([hand_class(combo) for combo in COMBOS.tolist()])
+_COMBO_INDEX = {frozenset(combo): i for i, combo in enumerate(COMBOS.tolist())}
+# The 101 combos sharing at least one card with each combo, itself included
+_CONFLICTS = np.array([np.flatnonzero(COMBO_MASKS & mask)
+                       for mask in COMBO_MASKS.tolist()])
+# Ranks of the evaluator are below this, used to search many boards at once
+_RANK_STRIDE = 1 << 13
+
+
+def combo_index(hand):
+    return _COMBO_INDEX[frozenset(hand)]
+
+
+def card_mask(cards):
+    mask = 0
+    for card in cards:
+        mask |= 1 << CARD_INDEX[card]
+    return mask
+
+
+def uniform_range():
+    return np.ones(N_COMBOS)
+
+
+def hand_range(hands):
+    """Range holding exactly the given hands."""
+    weights = np.zeros(N_COMBOS)
+    weights[[combo_index(hand) for hand in hands]] = 1.
+    return weights
+
+
+def class_range(class_weights):
+    """Range giving every combo the weight of its starting hand class."""
+    class_weights = np.asarray(class_weights, dtype=np.float64)
+    assert class_weights.shape == (N_CLASSES,)
+    return class_weights[COMBO_CLASSES]
+
+
+def top_range(fraction, n_opponents=1, table=PREFLOP_TABLE):
+    """
+    The `fraction` of combos with the best preflop equity against
+    `n_opponents` random hands.
+    """
+    equities = np.asarray(table.table[n_opponents - 1])[COMBO_CLASSES]
+    order = np.argsort(-equities, kind='stable')
+    weights = np.zeros(N_COMBOS)
+    weights[order[:int(round(fraction * N_COMBOS))]] = 1.
+    return weights
+
+
+def remove_cards(weights, cards):
+    """Zero the weight of combos holding any of `cards`."""
+    return np.where(COMBO_MASKS & card_mask(cards), 0., weights)
+
+
+def card_masks(cards):
+    """`card_mask` of every row of an array of cards (..., n)."""
+    bits = np.left_shift(1, _SORTED_CARD_INDEX[np.searchsorted(_SORTED_CARDS,
+                                                               cards)])
+    return np.bitwise_or.reduce(bits, axis=-1)
+
+
+def showdown_sums(evaluator, boards, hero_idx, weights):
+    """`showdown_shares` summed over the boards."""
+    shares, totals = showdown_shares(evaluator, boards, hero_idx, weights)
+    return shares.sum(axis=0), totals.sum(axis=0)
+
+
+def showdown_shares(evaluator, boards, hero_idx, weights):
+    """
+    Heads-up showdowns of the combos `hero_idx` against the range `weights`
+    on every board of `boards` (n_boards, 5).
+
+    Returns the weighted pot shares of each hero and the total weight of the
+    villain combos it met, both of shape (n_boards, n_heroes). Villain
+    combos sharing a card with the hero or the board are left out, boards
+    sharing a card with the hero get 0 for both.
+    """
+    hero_idx = np.asarray(hero_idx, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    boards = np.asarray(boards, dtype=np.int64)
+    n_boards = len(boards)
+    active = np.union1d(np.flatnonzero(weights), hero_idx)
+    masks = card_masks(boards)
+    cards = np.concatenate([
+        np.broadcast_to(COMBOS[active], (n_boards, len(active), 2)),
+        np.broadcast_to(boards[:, None, :], (n_boards, len(active), 5))],
+        axis=2)
+    ranks = evaluator.evaluate_array(cards).astype(np.int64)
+    villain_weights = np.where(COMBO_MASKS[active] & masks[:, None], 0.,
+                               weights[active])
+
+    # Weight of villain combos ranked better than or equal to each hero,
+    # found for all boards at once by offsetting the ranks of each board
+    offset = _RANK_STRIDE * np.arange(n_boards)[:, None]
+    order = np.argsort(ranks, axis=1)
+    sorted_ranks = (np.take_along_axis(ranks, order, axis=1)
+                    + offset).ravel()
+    cumulative = np.concatenate([[0.], np.cumsum(np.take_along_axis(
+        villain_weights, order, axis=1).ravel())])
+    position = np.searchsorted(active, hero_idx)
+    hero_ranks = ranks[:, position] + offset
+    first = np.searchsorted(sorted_ranks, offset)
+    below = cumulative[np.searchsorted(sorted_ranks, hero_ranks)]
+    better = below - cumulative[first]
+    tied = cumulative[np.searchsorted(sorted_ranks, hero_ranks,
+                                      side='right')] - below
+    total = np.broadcast_to(villain_weights.sum(axis=1, keepdims=True),
+                            hero_ranks.shape).copy()
+
+    # Take out the villain combos sharing a card with the hero
+    active_position = np.full(N_COMBOS, -1)
+    active_position[active] = np.arange(len(active))
+    conflicts = active_position[_CONFLICTS[hero_idx]]
+    conflict_weights = np.where(conflicts >= 0,
+                                villain_weights[:, conflicts], 0.)
+    conflict_ranks = ranks[:, conflicts] + offset[:, :, None]
+    hero_ranks = hero_ranks[:, :, None]
+    better -= (conflict_weights * (conflict_ranks < hero_ranks)).sum(axis=2)
+    tied -= (conflict_weights * (conflict_ranks == hero_ranks)).sum(axis=2)
+    total -= conflict_weights.sum(axis=2)
+
+    hero_on_board = (COMBO_MASKS[hero_idx] & masks[:, None]) != 0
+    shares = np.where(hero_on_board, 0., total - better - tied / 2)
+    total[hero_on_board] = 0.
+    return shares, total
+
+
+def sample_combos(rng, weights, used_masks):
+    """
+    Draw one combo of the range for every sample, avoiding the cards of
+    `used_masks`. Samples where no combo is left get index -1.
+    """
+    valid = (COMBO_MASKS[None, :] & used_masks[:, None]) == 0
+    cumulative = np.cumsum(np.where(valid, weights, 0.), axis=1)
+    targets = rng.random(len(used_masks)) * cumulative[:, -1]
+    chosen = (cumulative <= targets[:, None]).sum(axis=1)
+    return np.where(cumulative[:, -1] > 0, chosen, -1)
+
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Card samplers for the MC backends of `Equity`.
+
+`sample_cards` draws every sample independently. `stratified_cards` runs a
+partial Fisher-Yates shuffle per sample where the uniforms picking the card
+at each position form a Latin hypercube across the samples: at every
+position each deck card is dealt in as close to an equal share of the
+samples as the budget allows, which removes most of the variance coming from
+which turn and river cards get dealt. It typically needs 1.5 to 10 times
+fewer samples for the same accuracy, `python -m holdem.sampling` prints the
+error of both samplers against exact equities on a fixed set of spots.
+"""
+
+import numpy as np
+
+from .vectorized import sample_cards
+
+
+def stratified_cards(rng, deck, n_samples, n_cards):
+    """Like `sample_cards`, with Latin hypercube uniforms at every position."""
+    deck = np.asarray(deck, dtype=np.int64)
+    cards = np.tile(deck, (n_samples, 1))
+    rows = np.arange(n_samples)
+    for position in range(n_cards):
+        # one uniform in each of n_samples equal strata, in random order
+        strata = ((rng.permutation(n_samples) + rng.random(n_samples))
+                  / n_samples)
+        picks = position + (strata * (len(deck) - position)).astype(np.int64)
+        picked = cards[rows, picks]
+        cards[rows, picks] = cards[:, position]
+        cards[:, position] = picked
+    return cards[:, :n_cards]
+
+
+SAMPLERS = {'random': sample_cards, 'stratified': stratified_cards}
+
+
+if __name__ == '__main__':
+    import time
+
+    from treys import Card, Deck
+
+    from .equity_evaluation import Equity
+
+    def cards(strs):
+        return [Card.new(s) for s in strs.split()]
+
+    # (hands, community, n_players), n_players None for known hands
+    spots = [(['Ah Kd', 'Qs Qc'], '2c 7d 9h', None),
+             (['7h 8h', 'As Ad'], '9h Tc 2h', None),
+             (['Ah Kd'], 'Qs Jh 2c', 2),
+             (['7h 8h'], '9h Tc 2h Kd', 2),
+             (['Ah Kd'], 'Qs Jh 2c', 3)]
+    budgets = (100, 300, 1000, 3000)
+    n_repeats = 200
+    print('RMSE over %d runs per budget and sampler' % n_repeats)
+    for hands, community, n_players in spots:
+        hands = [cards(h) for h in hands]
+        community = cards(community)
+        deck = [c for c in Deck.GetFullDeck()
+                if c not in community and all(c not in h for h in hands)]
+        reference = Equity(10**6, seed=0, exact_threshold=10**7)
+        if n_players is None:
+            exact = reference.get_equities(hands, community, deck, [])[0]
+        else:
+            exact = reference.get_my_equity(hands, n_players, community, deck)
+        print('%s on %s, %s: equity %.4f' % (
+            ' vs '.join(Card.print_pretty_cards(h) for h in hands),
+            Card.print_pretty_cards(community),
+            'known hands' if n_players is None
+            else '%d random opponents' % (n_players - 1), exact))
+        for n_evaluations in budgets:
+            errors = {}
+            for sampling in SAMPLERS:
+                start = time.time()
+                estimates = []
+                for seed in range(n_repeats):
+                    equity = Equity(n_evaluations, backend='lut', seed=seed,
+                                    exact_threshold=0, sampling=sampling)
+                    if n_players is None:
+                        estimates.append(equity.get_equities(
+                            hands, community, deck, [])[0])
+                    else:
+                        estimates.append(equity.get_my_equity(
+                            hands, n_players, community, deck))
+                errors[sampling] = (
+                    np.sqrt(np.mean((np.array(estimates) - exact) ** 2)),
+                    (time.time() - start) / n_repeats)
+            print('  %5d samples: %s, random/stratified samples for the same '
+                  'error %.2fx' % (
+                      n_evaluations,
+                      ', '.join('%s %.4f (%.1fms)' % (name, rmse, 1000 * t)
+                                for name, (rmse, t) in errors.items()),
+                      (errors['random'][0] / errors['stratified'][0]) ** 2))
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Equity cache in shared memory, usable by every process of a machine.
+
+The table is a fixed array of slots in a `multiprocessing.shared_memory`
+block, addressed by a 64 bit fingerprint of the cache key with linear
+probing. Writers do not lock: every slot carries the XOR of its fingerprint,
+size and value bits, and a reader treats a slot whose check does not match
+(a write torn by a concurrent writer) as a miss.
+
+Other processes open the cache with `SharedEquityCache.attach(name)` or by
+receiving it pickled, and count their hits separately. The process that
+created it calls `unlink()` once every worker is done.
+"""
+
+import hashlib
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = 0x686f6c64656d3031  # 'holdem01'
+# Values of one entry, enough for the equities of 10 players
+MAX_VALUES = 10
+SLOT_DTYPE = np.dtype([('key', '<u8'), ('check', '<u8'), ('size', '<u8'),
+                       ('values', '<f8', (MAX_VALUES,))])
+# magic, number of slots, slot size
+_HEADER = np.dtype([('magic', '<u8'), ('n_slots', '<u8'),
+                    ('slot_size', '<u8')])
+_HEADER_BYTES = 64
+
+
+def fingerprint(key):
+    """Hash of a cache key that is the same in every process."""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    # 0 marks empty slots
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SharedEquityCache():
+    """
+    `EquityCache` replacement shared between processes.
+
+    Create it once with a name, then open it from other processes with
+    `SharedEquityCache.attach(name)` or by passing the object to them, which
+    pickles it by name. The creator should `unlink()` it when done.
+    Counters are per process, a full probe window replaces its first slot.
+    """
+
+    # Slots looked at for a key before giving up or replacing
+    PROBES = 8
+
+    def __init__(self, name=None, max_bytes=64 * 2**20):
+        n_slots = max(self.PROBES, (max_bytes - _HEADER_BYTES)
+                      // SLOT_DTYPE.itemsize)
+        self._shm = shared_memory.SharedMemory(
+            name, create=True,
+            size=_HEADER_BYTES + n_slots * SLOT_DTYPE.itemsize)
+        header = np.ndarray(1, _HEADER, self._shm.buf)
+        header['n_slots'] = n_slots
+        header['slot_size'] = SLOT_DTYPE.itemsize
+        header['magic'] = MAGIC
+        self._setup()
+
+    @classmethod
+    def attach(cls, name):
+        cache = cls.__new__(cls)
+        cache._shm = open_untracked(name)
+        header = np.ndarray(1, _HEADER, cache._shm.buf)[0]
+        if (header['magic'] != MAGIC
+                or header['slot_size'] != SLOT_DTYPE.itemsize):
+            cache._shm.close()
+            raise ValueError('%s is not a SharedEquityCache' % name)
+        cache._setup()
+        return cache
+
+    def _setup(self):
+        header = np.ndarray(1, _HEADER, self._shm.buf)[0]
+        self.n_slots = int(header['n_slots'])
+        self._slots = np.ndarray(self.n_slots, SLOT_DTYPE, self._shm.buf,
+                                 offset=_HEADER_BYTES)
+        self._keys = self._slots['key']
+        self._checks = self._slots['check']
+        self._sizes = self._slots['size']
+        self._values = self._slots['values']
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def __reduce__(self):
+        return SharedEquityCache.attach, (self.name,)
+
+    def __len__(self):
+        return int(np.count_nonzero(self._keys))
+
+    def get(self, key):
+        """Cached value of `key` or None."""
+        h = fingerprint(key)
+        for i in range(self.PROBES):
+            j = (h + i) % self.n_slots
+            slot_key = int(self._keys[j])
+            if slot_key == 0:
+                break
+            elif slot_key == h:
+                size = int(self._sizes[j])
+                values = self._values[j].copy()
+                if (size <= MAX_VALUES
+                        and _check(h, size, values) == int(self._checks[j])):
+                    self.hits += 1
+                    return tuple(values[:size].tolist())
+                break
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if len(value) > MAX_VALUES:
+            return
+        h = fingerprint(key)
+        index = None
+        for i in range(self.PROBES):
+            j = (h + i) % self.n_slots
+            if int(self._keys[j]) in (0, h):
+                index = j
+                break
+        if index is None:
+            index = h % self.n_slots
+            self.evictions += 1
+        values = np.zeros(MAX_VALUES)
+        values[:len(value)] = value
+        self._values[index] = values
+        self._sizes[index] = len(value)
+        self._keys[index] = h
+        self._checks[index] = _check(h, len(value), values)
+
+    def clear(self):
+        self._keys[:] = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self),
+                'hit_rate': self.hits / lookups if lookups else 0.}
+
+    def close(self):
+        self._slots = self._keys = self._checks = None
+        self._sizes = self._values = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+def open_untracked(name):
+    """
+    Open an existing shared memory block without registering it with the
+    resource tracker, which would unlink it when this process exits.
+    """
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+def _check(h, size, values):
+    return h ^ size ^ int(np.bitwise_xor.reduce(values.view(np.uint64)))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Per-seat state of a table kept in flat arrays indexed by seat.
+
+`TableState` holds one `array.array` per field, so the whole table is a
+handful of contiguous buffers that are copied with a slice and can be seen
+as NumPy arrays without copying. `Player` objects are views of one slot of
+a `TableState`. While `journal` is a list, every `write` (and so every
+write through a `Player`) appends (array, slot, old value) to it so the
+writes can be undone. `freeze` takes an immutable snapshot of the arrays,
+a `FrozenTableState` of bytes per field, and `thaw` writes one back.
+
+Chips are whole numbers: `Player` raises ValueError when a fractional chip
+amount is written, rather than losing the fraction.
+"""
+
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+# Fields and their array typecodes, hole cards are 0 when not dealt
+INT_FIELDS = ('player_id', 'seat', 'stack', 'starting_stack',
+              'hand_starting_stack', 'currentbet', 'lastsidepot',
+              'handrank', 'blind', 'card0', 'card1')
+FLAG_FIELDS = ('emptyplayer', 'isallin', 'playing_hand', 'playedthisround',
+               'sitting_out')
+FLOAT_FIELDS = ('equity',)
+FIELDS = ({name: 'q' for name in INT_FIELDS}
+          | {name: 'b' for name in FLAG_FIELDS}
+          | {name: 'd' for name in FLOAT_FIELDS})
+
+
+def _whole(value):
+    """`value` as an int, ValueError if it has a fractional part."""
+    whole = int(value)
+    if whole != value:
+        raise ValueError('Expected a whole number, got %r' % (value,))
+    return whole
+
+
+# What values written to fields of each typecode are converted with
+CONVERTERS = {'q': _whole, 'b': bool, 'd': float}
+
+
+class FrozenTableState(namedtuple('FrozenTableState', FIELDS)):
+    """Read-only snapshot of a `TableState`, the bytes of each array."""
+
+    __slots__ = ()
+
+    @property
+    def n_seats(self):
+        return len(self.emptyplayer)
+
+    def as_numpy(self):
+        """Read-only NumPy arrays of the bytes, keyed by field."""
+        return {name: np.frombuffer(data, dtype=FIELDS[name])
+                for name, data in zip(FIELDS, self)}
+
+
+class TableState():
+    """One array of n_seats values per field of `FIELDS`."""
+
+    __slots__ = ('n_seats', 'journal', '_bytes') + tuple(FIELDS)
+
+    def __init__(self, n_seats):
+        self.n_seats = n_seats
+        self.journal = None
+        for name, typecode in FIELDS.items():
+            setattr(self, name, array(typecode, bytes(
+                n_seats * array(typecode).itemsize)))
+        self._view_bytes()
+
+    def _view_bytes(self):
+        # byte views of the arrays for freeze and thaw, the arrays are never
+        # resized so the views stay valid
+        self._bytes = tuple(memoryview(getattr(self, name)).cast('B')
+                            for name in FIELDS)
+
+    def __reduce__(self):
+        return _thawed, (self.freeze(),)
+
+    def copy(self):
+        state = TableState.__new__(TableState)
+        state.n_seats = self.n_seats
+        state.journal = None
+        for name in FIELDS:
+            setattr(state, name, getattr(self, name)[:])
+        state._view_bytes()
+        return state
+
+    def freeze(self):
+        """Immutable `FrozenTableState` of the current values."""
+        return FrozenTableState._make([view.tobytes()
+                                       for view in self._bytes])
+
+    def thaw(self, frozen):
+        """Overwrite every field in place with a `freeze` of this table."""
+        if frozen.n_seats != self.n_seats:
+            raise ValueError('State of a table with %d seats'
+                             % frozen.n_seats)
+        for view, data in zip(self._bytes, frozen):
+            view[:] = data
+
+    def copy_from(self, other):
+        """Overwrite every field with the values of `other` in place."""
+        for name in FIELDS:
+            getattr(self, name)[:] = getattr(other, name)
+
+    def write(self, values, slot, value):
+        """`values[slot] = value` for the array `values` of a field."""
+        if self.journal is not None:
+            self.journal.append((values, slot, values[slot]))
+        values[slot] = value
+
+    def undo(self, journal):
+        """Revert the writes recorded in `journal`, latest first."""
+        for values, slot, old in reversed(journal):
+            values[slot] = old
+
+    def as_numpy(self):
+        """NumPy views sharing memory with the arrays, keyed by field."""
+        return {name: np.frombuffer(getattr(self, name),
+                                    dtype=getattr(self, name).typecode)
+                for name in FIELDS}
+
+
+def _thawed(frozen):
+    state = TableState(frozen.n_seats)
+    state.thaw(frozen)
+    return state
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Many tables stepped together.
+
+`VecTexasHoldemEnv` owns N `TexasHoldemEnv` sharing one `Equity`. Every
+`step` plays one action on each table and resets the tables whose hand
+ended, and the equities every table needs for the step are simulated in a
+single `Equity.get_my_equity_batch` call instead of one query per table.
+
+`SubprocVecTexasHoldemEnv` splits the tables over worker processes, each
+running a `VecTexasHoldemEnv`. Actions, observations, rewards and dones are
+exchanged through arrays in one shared memory block and the workers are
+woken by events, so a step pickles nothing. A worker that fails sends its
+traceback back through a pipe and the parent raises it.
+"""
+
+import os
+import threading
+import traceback
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from gym import spaces
+
+from .env import TexasHoldemEnv
+from .equity_cache import EquityCache
+from .ranges import FULL_DECK
+from .shm_cache import open_untracked
+
+_FULL_DECK = frozenset(FULL_DECK)
+
+
+class VecTexasHoldemEnv():
+    """
+    `n_envs` tables of `n_seats` players each, the player of seat
+    `agent_id` being the agent whose observations and rewards are
+    returned. Other arguments are the ones of `TexasHoldemEnv`.
+    """
+
+    def __init__(self, n_envs, n_seats, stack=2500, agent_id=0, **kwargs):
+        if kwargs.get('equity_prefetch'):
+            raise ValueError('VecTexasHoldemEnv batches equities itself, '
+                             'equity_prefetch is not supported')
+        self.envs = [TexasHoldemEnv(n_seats, **kwargs) for _ in range(n_envs)]
+        # one Equity and one RNG stream for all the tables
+        self.equity = self.envs[0].equity
+        lock = threading.Lock()
+        for env in self.envs:
+            if env.equity is not self.equity:
+                # disconnect the unused equity of the table from any server
+                env.equity.close()
+            env.equity = self.equity
+            env._equity_lock = lock
+            for seat in range(n_seats):
+                env.add_player(seat, stack=stack, is_agent=(seat == agent_id))
+        self.n_envs = n_envs
+        self.agent_id = agent_id
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.n_hands = 0
+
+    @property
+    def current_player_ids(self):
+        return np.array([env.current_player_id for env in self.envs])
+
+    @property
+    def tocalls(self):
+        return np.array([env.tocall for env in self.envs])
+
+    def reset(self):
+        """Start a hand on every table, returns the stacked observations."""
+        for env in self.envs:
+            env._start_hand()
+        self._batch_equities(self._agents())
+        return np.stack([self._observation(env) for env in self.envs])
+
+    def step(self, actions):
+        """
+        Play actions (n_envs, 2) for the current player of every table.
+        Returns observations, rewards, dones and infos stacked over the
+        tables, the observation of a finished table is the first one of its
+        next hand and the last one of the ended hand is in its info as
+        'terminal_observation'.
+        """
+        self._batch_equities([env._current_player for env in self.envs])
+        dones = np.array([env._apply_action(list(action)) for env, action
+                          in zip(self.envs, np.asarray(actions).tolist())])
+        self._batch_equities(self._agents())
+        observations, rewards, infos = [], [], []
+        for env, done in zip(self.envs, dones):
+            observation, reward, _, info = env._get_current_step_returns(done)
+            if done:
+                info['terminal_observation'] = np.hstack(observation)
+                env._start_hand()
+                self.n_hands += 1
+            observations.append(observation)
+            rewards.append(reward)
+            infos.append(info)
+        if dones.any():
+            self._batch_equities([agent for agent, done
+                                  in zip(self._agents(), dones) if done],
+                                 [env for env, done
+                                  in zip(self.envs, dones) if done])
+            observations = [self._observation(env) if done else observation
+                            for env, observation, done
+                            in zip(self.envs, observations, dones)]
+        return (np.stack([np.hstack(o) for o in observations]),
+                np.array(rewards, dtype=np.float64), dones, infos)
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+    def _agents(self):
+        return [env._seats[self.agent_id] for env in self.envs]
+
+    def _observation(self, env):
+        return np.hstack(env._get_current_player_state(
+            env._seats[self.agent_id]))
+
+    def _batch_equities(self, players, envs=None):
+        """
+        Compute the equities missing from the memos in one
+        `get_my_equity_batch` call, which honours the equity options of the
+        tables (backend, cache, precision, exact enumeration).
+        """
+        queries, keys = [], []
+        for env, player in zip(envs or self.envs, players):
+            key = env._equity_key(player)
+            if (env.opponent_range is not None or not player.hand
+                    or key in env._equity_memo or (env, key) in keys):
+                continue
+            queries.append(env._equity_query(player))
+            keys.append((env, key))
+        if not queries:
+            return
+        hands, communities, decks, n_opponents = zip(*queries)
+        dead = [_unseen(hand, community, deck)
+                for hand, community, deck in zip(hands, communities, decks)]
+        n_simulated = self.equity.n_simulated
+        equities = self.equity.get_my_equity_batch(
+            hands, np.array(n_opponents) + 1, communities, dead)
+        runs = (self.equity.n_simulated - n_simulated) / len(queries)
+        for (env, key), equity in zip(keys, equities.tolist()):
+            env.equity_memo_misses += 1
+            # the first read of the entry is the one it was batched for
+            env._equity_memo[key] = (equity, runs, True)
+
+
+class SubprocVecTexasHoldemEnv():
+    """
+    `VecTexasHoldemEnv` with the tables split over `n_workers` processes,
+    by default one per core. Call `close()` to stop the workers.
+    """
+
+    # Seconds between checks that the workers are alive while waiting
+    POLL_INTERVAL = 1.
+
+    def __init__(self, n_envs, n_seats, stack=2500, agent_id=0,
+                 n_workers=None, **kwargs):
+        if kwargs.get('equity_prefetch'):
+            raise ValueError('SubprocVecTexasHoldemEnv batches equities '
+                             'itself, equity_prefetch is not supported')
+        if isinstance(kwargs.get('equity_cache'), EquityCache):
+            raise ValueError('An EquityCache can not be sent to worker '
+                             'processes, use a holdem.shm_cache.'
+                             'SharedEquityCache')
+        env = TexasHoldemEnv(n_seats, **kwargs)
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        env.close()
+        obs_size = sum(int(np.prod(space.shape))
+                       if isinstance(space, spaces.Box) else 1
+                       for space in self.observation_space)
+        n_workers = min(n_envs, n_workers or os.cpu_count() or 1)
+        self.n_envs = n_envs
+        self._shared = _SharedArrays({
+            'commands': ((n_workers,), np.int64),
+            'n_hands': ((n_workers,), np.int64),
+            'actions': ((n_envs, 2), np.int64),
+            'observations': ((n_envs, obs_size), np.float64),
+            'terminal_observations': ((n_envs, obs_size), np.float64),
+            'rewards': ((n_envs,), np.float64),
+            'money_won': ((n_envs,), np.float64),
+            'dones': ((n_envs,), np.bool_),
+            'current_player_ids': ((n_envs,), np.int64),
+            'tocalls': ((n_envs,), np.int64)})
+        self._arrays = self._shared.arrays
+        context = get_context('spawn')
+        bounds = np.linspace(0, n_envs, n_workers + 1).astype(int).tolist()
+        self._wake = [context.Event() for _ in range(n_workers)]
+        self._ready = [context.Event() for _ in range(n_workers)]
+        # the tracebacks of failed workers
+        pipes = [context.Pipe(duplex=False) for _ in range(n_workers)]
+        self._errors = [receiver for receiver, _ in pipes]
+        self._failed = False
+        self._processes = [
+            context.Process(target=_worker, daemon=True, args=(
+                i, bounds[i], bounds[i + 1], n_seats, stack, agent_id,
+                kwargs, self._shared.name, self._shared.specs,
+                self._wake[i], self._ready[i], pipes[i][1]))
+            for i in range(n_workers)]
+        for process in self._processes:
+            process.start()
+        for _, sender in pipes:
+            sender.close()
+
+    @property
+    def n_hands(self):
+        return int(self._arrays['n_hands'].sum())
+
+    @property
+    def current_player_ids(self):
+        return self._arrays['current_player_ids'].copy()
+
+    @property
+    def tocalls(self):
+        return self._arrays['tocalls'].copy()
+
+    def reset(self):
+        self._run(_RESET)
+        return self._arrays['observations'].copy()
+
+    def step(self, actions):
+        """Same returns as `VecTexasHoldemEnv.step`."""
+        arrays = self._arrays
+        arrays['actions'][:] = actions
+        self._run(_STEP)
+        dones = arrays['dones'].copy()
+        infos = [{'money_won': money_won} for money_won
+                 in arrays['money_won'].tolist()]
+        for i in np.flatnonzero(dones).tolist():
+            infos[i]['terminal_observation'] = (
+                arrays['terminal_observations'][i].copy())
+        return (arrays['observations'].copy(), arrays['rewards'].copy(),
+                dones, infos)
+
+    def close(self):
+        if self._shared is None:
+            return
+        if not self._failed and all(p.is_alive() for p in self._processes):
+            self._run(_CLOSE)
+        for process in self._processes:
+            process.join(timeout=self.POLL_INTERVAL)
+            if process.is_alive():
+                process.terminate()
+        for errors in self._errors:
+            errors.close()
+        self._arrays = None
+        self._shared.close()
+        self._shared.unlink()
+        self._shared = None
+
+    def _run(self, command):
+        """Have every worker run the command and wait until all are done."""
+        self._arrays['commands'][:] = command
+        for ready, wake in zip(self._ready, self._wake):
+            ready.clear()
+            wake.set()
+        for ready, process, errors in zip(self._ready, self._processes,
+                                          self._errors):
+            while not ready.wait(self.POLL_INTERVAL):
+                if not process.is_alive():
+                    break
+            if errors.poll():
+                self._failed = True
+                raise RuntimeError('Env worker %s failed:\n%s'
+                                   % (process.name, errors.recv()))
+            if not ready.is_set():
+                self._failed = True
+                raise RuntimeError('Env worker %s exited with code %s'
+                                   % (process.name, process.exitcode))
+
+
+_STEP, _RESET, _CLOSE = range(3)
+
+
+class _SharedArrays():
+    """NumPy arrays laid out in one shared memory block."""
+
+    def __init__(self, specs, name=None):
+        self.specs = specs
+        offsets, size = {}, 0
+        for key, (shape, dtype) in specs.items():
+            offsets[key] = size
+            # keep every array 8 byte aligned
+            size += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 8) * 8
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True,
+                                                   size=max(size, 1))
+        else:
+            self._shm = open_untracked(name)
+        self.arrays = {key: np.ndarray(shape, dtype, buffer=self._shm.buf,
+                                       offset=offsets[key])
+                       for key, (shape, dtype) in specs.items()}
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def close(self):
+        self.arrays = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+def _worker(index, start, stop, n_seats, stack, agent_id, kwargs, name,
+            specs, wake, ready, errors):
+    try:
+        _serve(index, start, stop, n_seats, stack, agent_id, kwargs, name,
+               specs, wake, ready)
+    except BaseException:
+        # the parent raises it, no need to print it here too
+        errors.send(traceback.format_exc())
+        ready.set()
+        raise SystemExit(1)
+
+
+def _serve(index, start, stop, n_seats, stack, agent_id, kwargs, name,
+           specs, wake, ready):
+    shared = _SharedArrays(specs, name)
+    arrays = shared.arrays
+    rows = slice(start, stop)
+    vec_env = VecTexasHoldemEnv(stop - start, n_seats, stack, agent_id,
+                                **kwargs)
+    while True:
+        wake.wait()
+        wake.clear()
+        command = arrays['commands'][index]
+        if command == _CLOSE:
+            break
+        elif command == _RESET:
+            arrays['observations'][rows] = vec_env.reset()
+            arrays['dones'][rows] = False
+        else:
+            observations, rewards, dones, infos = vec_env.step(
+                arrays['actions'][rows])
+            arrays['observations'][rows] = observations
+            arrays['rewards'][rows] = rewards
+            arrays['dones'][rows] = dones
+            for i, info in enumerate(infos):
+                arrays['money_won'][start + i] = info['money_won']
+                if dones[i]:
+                    arrays['terminal_observations'][start + i] = (
+                        info['terminal_observation'])
+        arrays['current_player_ids'][rows] = vec_env.current_player_ids
+        arrays['tocalls'][rows] = vec_env.tocalls
+        arrays['n_hands'][index] = vec_env.n_hands
+        ready.set()
+    vec_env.close()
+    del arrays
+    shared.close()
+    ready.set()
+
+
+def _unseen(hand, community, deck):
+    """Cards missing from the deck that are not the hand or the board."""
+    return list(_FULL_DECK.difference(deck, hand, community))
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from .utils import safe_action
+
+    parser = argparse.ArgumentParser(
+        description='Hands per second of single and vectorized envs.')
+    parser.add_argument('--envs', type=int, default=64)
+    parser.add_argument('--seats', type=int, default=4)
+    parser.add_argument('--equity-steps', type=int, default=100)
+    parser.add_argument('--hands', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='most workers to try, defaults to all cores')
+    args = parser.parse_args()
+
+    env = TexasHoldemEnv(args.seats, equity_steps=args.equity_steps)
+    for seat in range(args.seats):
+        env.add_player(seat, stack=2500, is_agent=(seat == 0))
+    start = time.time()
+    for _ in range(args.hands):
+        env.reset()
+        done = False
+        while not done:
+            _, _, done, _ = env.step(safe_action(env.current_player_id,
+                                                 env.tocall, args.seats))
+    print('TexasHoldemEnv: %.1f hands/s' % (args.hands
+                                             / (time.time() - start)))
+
+    def hands_per_second(vec_env):
+        vec_env.reset()
+        start = time.time()
+        while vec_env.n_hands < args.hands:
+            vec_env.step([safe_action(None, tocall, args.seats)
+                          for tocall in vec_env.tocalls.tolist()])
+        return vec_env.n_hands / (time.time() - start)
+
+    vec_env = VecTexasHoldemEnv(args.envs, args.seats,
+                                equity_steps=args.equity_steps)
+    print('VecTexasHoldemEnv with %d tables: %.1f hands/s'
+          % (args.envs, hands_per_second(vec_env)))
+    n_workers = 1
+    while n_workers <= (args.workers or os.cpu_count() or 1):
+        vec_env = SubprocVecTexasHoldemEnv(
+            args.envs, args.seats, n_workers=n_workers,
+            equity_steps=args.equity_steps)
+        try:
+            print('SubprocVecTexasHoldemEnv with %d tables on %d workers: '
+                  '%.1f hands/s' % (args.envs, n_workers,
+                                    hands_per_second(vec_env)))
+        finally:
+            vec_env.close()
+        n_workers *= 2
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from itertools import combinations
+
+import numpy as np
+
+from treys.lookup import LookupTable
+
+
+class VectorizedEvaluator():
+    """
+    Ranks whole arrays of hands at once using the treys lookup tables.
+
+    Cards are treys card ints stacked along the last axis, so an array of
+    shape (..., 7) is ranked into an array of shape (...). Ranks are the same
+    as the ones returned by treys `Evaluator.evaluate` (1 is a royal flush).
+    """
+
+    def __init__(self):
+        table = LookupTable()
+        self._flush_keys, self._flush_ranks = self._sorted_table(
+            table.flush_lookup)
+        self._unsuited_keys, self._unsuited_ranks = self._sorted_table(
+            table.unsuited_lookup)
+        self._combos = {n: np.array(list(combinations(range(n), 5)))
+                        for n in (5, 6, 7)}
+
+    @staticmethod
+    def _sorted_table(lookup):
+        keys = np.array(sorted(lookup), dtype=np.int32)
+        ranks = np.array([lookup[k] for k in keys], dtype=np.int16)
+        return keys, ranks
+
+    def evaluate_array(self, cards):
+        cards = np.asarray(cards, dtype=np.int32)
+        # Every 5 card subset of the hand, one array per card of the subset
+        five = [cards[..., idx] for idx in self._combos[cards.shape[-1]].T]
+        suits = five[0] & five[1] & five[2] & five[3] & five[4] & 0xF000
+        primes = ((five[0] & 0xFF) * (five[1] & 0xFF) * (five[2] & 0xFF)
+                  * (five[3] & 0xFF) * (five[4] & 0xFF))
+        is_flush = suits != 0
+        if is_flush.any():
+            ranks = np.empty(primes.shape, dtype=np.int16)
+            ranks[is_flush] = self._lookup(self._flush_keys, self._flush_ranks,
+                                           primes[is_flush])
+            not_flush = ~is_flush
+            ranks[not_flush] = self._lookup(
+                self._unsuited_keys, self._unsuited_ranks, primes[not_flush])
+        else:
+            ranks = self._lookup(self._unsuited_keys, self._unsuited_ranks,
+                                 primes)
+        return ranks.min(axis=-1)
+
+    @staticmethod
+    def _lookup(keys, ranks, primes):
+        return ranks[np.searchsorted(keys, primes)]
+
+
+def sample_cards(rng, deck, n_samples, n_cards):
+    """Draw `n_cards` cards without replacement from `deck` for every sample."""
+    deck = np.asarray(deck, dtype=np.int64)
+    order = np.argsort(rng.random((n_samples, len(deck))), axis=1)
+    return deck[order[:, :n_cards]]
+
+
+def win_shares(my_ranks, other_ranks):
+    """
+    Share of the pot won by the first hand given ranks of the other hands.
+
+    `other_ranks` has shape (n_samples, n_others); ties split the pot evenly.
+    """
+    if other_ranks.shape[1] == 0:
+        return np.ones(len(my_ranks))
+    best_other = other_ranks.min(axis=1)
+    ties = (other_ranks == my_ranks[:, None]).sum(axis=1)
+    return np.where(my_ranks < best_other, 1.,
+                    np.where(my_ranks == best_other, 1. / (1 + ties), 0.))
@@ -35,6 +35,7 @@ setup(
   license='MIT',
   description=('OpenAI Gym No-Limit Texas Holdem Environment.'),
   packages=find_packages(exclude=['tests', 'examples']),
+  package_data={'holdem': ['data/*.npy']},
   install_requires=['treys', 'gym'],
   platforms='any',
 )
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import numpy as np
+
+from treys import Card
+
+from holdem.abstraction import (BUCKET_TABLES, DEFAULT_BUCKETS, BucketTable,
+                                emd, kmeans)
+from holdem.equity_evaluation import Equity
+
+
+def test_emd():
+    histograms = np.eye(4)
+    distances = emd(histograms, histograms)
+    assert np.allclose(distances, np.abs(np.subtract.outer(
+        np.arange(4), np.arange(4))) / 4)
+    # same mean, different spread
+    assert emd(np.array([[0, 1, 1, 0]]) / 2, np.array([[1, 0, 0, 1]]) / 2
+               )[0, 0] > 0
+
+
+def test_kmeans():
+    rng = np.random.default_rng(0)
+    # draws (low or high) and made hands (middle) of the same mean
+    draws = np.tile([0.5, 0, 0, 0, 0, 0, 0, 0, 0, 0.5], (50, 1))
+    made = np.tile([0, 0, 0, 0, 0.5, 0.5, 0, 0, 0, 0], (50, 1))
+    histograms = np.vstack([draws, made]) + rng.random((100, 10)) * 0.01
+    histograms /= histograms.sum(axis=1, keepdims=True)
+    labels, centers = kmeans(histograms, 2, rng)
+    assert centers.shape == (2, 10)
+    assert len(set(labels[:50])) == len(set(labels[50:])) == 1
+    assert labels[0] != labels[50]
+
+
+def test_buckets(tmp_path):
+    equity = Equity(200)
+    aces, same_aces = _cards(['As', 'Ad']), _cards(['Ah', 'Ac'])
+    trash = _cards(['7h', '2c'])
+    table = BUCKET_TABLES[0]
+    assert table.available and 1 < table.n_buckets <= 169
+    assert table.bucket(aces, [], equity) == equity.get_bucket(same_aces, [])
+    assert equity.get_bucket(aces, []) != equity.get_bucket(trash, [])
+
+    # rows missing from the table go to the nearest center
+    arrays = table.load()
+    keep = np.arange(len(arrays['keys'])) != table.index(aces, [])
+    partial = BucketTable('preflop', str(tmp_path))
+    partial.save(keys=arrays['keys'][keep], buckets=arrays['buckets'][keep],
+                 centers=arrays['centers'])
+    assert partial.index(aces, []) is None
+    assert partial.bucket(aces, [], equity) == table.bucket(aces, [], equity)
+
+    # streets without buckets use EHS
+    river = _cards(['Ks', 'Kh', '3d', '4h', '5s'])
+    assert not BucketTable('river', str(tmp_path)).available
+    bucket = equity.get_bucket(aces, river)
+    assert bucket == int(equity.get_hand_strength(aces, river)[0]
+                         * DEFAULT_BUCKETS)
+
+
+# Private methods
+
+def _cards(strs):
+    return [Card.new(s) for s in strs]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import random
+
+from treys import Card, Deck
+
+from holdem.canonical import (HandIndexer, canonical_key, canonicalize,
+                              invert, permute_suits, street_indexer)
+
+
+def test_indexer_sizes():
+    assert [street_indexer(n).size for n in (0, 3, 4, 5)] == [
+        169, 1286792, 13960050, 123156254]
+    # flop, turn and river dealt as separate rounds
+    assert HandIndexer((2, 3, 1)).size == 55190538
+    assert HandIndexer((2, 3, 1, 1)).size == 2428287420
+
+
+def test_index_roundtrip_and_suit_invariance():
+    rng = random.Random(0)
+    full_deck = Deck.GetFullDeck()
+    for n_board in (0, 3, 4, 5):
+        indexer = street_indexer(n_board)
+        for _ in range(300):
+            cards = rng.sample(full_deck, 2 + n_board)
+            hand, board = cards[:2], cards[2:]
+            index = indexer.index((hand, board))
+            assert 0 <= index < indexer.size
+            assert indexer.index(indexer.unindex(index)) == index
+            permutation = _random_permutation(rng)
+            assert indexer.index((permute_suits(hand, permutation),
+                                  permute_suits(board, permutation))) == index
+        for _ in range(300):
+            index = rng.randrange(indexer.size)
+            assert indexer.index(indexer.unindex(index)) == index
+
+
+def test_canonical_key():
+    rng = random.Random(1)
+    full_deck = Deck.GetFullDeck()
+    for _ in range(300):
+        cards = rng.sample(full_deck, 9)
+        hand, board, dead = cards[:2], cards[2:6], cards[6:]
+        key = canonical_key(hand, board, dead)
+        permutation = _random_permutation(rng)
+        assert canonical_key(permute_suits(hand, permutation),
+                             permute_suits(board, permutation),
+                             permute_suits(dead, permutation)) == key
+        (canonical_hand, canonical_board, _), permutation = canonicalize(
+            hand, board, dead)
+        assert canonical_key(canonical_hand, canonical_board,
+                             permute_suits(dead, permutation)) == key
+        assert sorted(permute_suits(canonical_hand,
+                                    invert(permutation))) == sorted(hand)
+    # the board is not interchangeable with the hole cards
+    assert canonical_key(_cards(['Ah', 'Kh']), _cards(['Qs'])) != \
+        canonical_key(_cards(['Ah', 'Qs']), _cards(['Kh']))
+    assert canonical_key(_cards(['Ah', 'Kh'])) == \
+        canonical_key(_cards(['Ks', 'As']))
+
+
+# Private methods
+
+def _cards(strs):
+    return [Card.new(s) for s in strs]
+
+
+def _random_permutation(rng):
+    return dict(zip((1, 2, 4, 8), rng.sample((1, 2, 4, 8), 4)))
@@ -26,11 +26,17 @@
 
 # To run the tests install pytest with "pip install pytest" and run a command "py.test" in the tests folder
 
+import random
+
+import numpy as np
 import pytest
+from gym import error
 
-from holdem.env import TexasHoldemEnv
+from holdem.env import FOLDED_BUCKET, TexasHoldemEnv
+from holdem.equity_cache import EquityCache
 
-from holdem.utils import player_table, community_table, action_table
+from holdem.utils import (player_table, community_table, action_table,
+                          safe_action)
 
 def test_fold():
     for n_players in range(2, 11):
@@ -1271,6 +1277,224 @@ def test_under_bb_bets():
 
 ### check minraise sizes in every scenario
 
+def test_equity_memo():
+    env = TexasHoldemEnv(3, equity_steps=1000)
+    for i in range(3):
+        env.add_player(i, stack=2500, is_agent=(i == 0))
+    env.reset()
+    env.step([action_table.CALL, 0])
+    player = env._current_player
+    misses = env.equity_memo_misses
+    equity = env._compute_my_equity(player)
+    assert env._compute_my_equity(player) == equity
+    assert env.equity_memo_misses == misses + 1
+    assert env.equity_memo_hits >= 1
+    env._deal_next_street()
+    runs = env.equity.n_simulated
+    env._compute_my_equity(player)
+    env._compute_my_equity(player)
+    assert env.equity.n_simulated == runs + 1000
+    assert env.equity_memo_stats()['runs_avoided'] >= 1000
+    folded = env._current_player
+    env.step([action_table.FOLD, 0])
+    # entries computed before the fold are gone
+    assert all(folded.player_id not in live for _, _, live in env._equity_memo)
+
+def test_equity_cache_postflop():
+    cache = EquityCache()
+    env = TexasHoldemEnv(2, equity_steps=100, equity_cache=cache)
+    for i in range(2):
+        env.add_player(i, stack=2500, is_agent=(i == 0))
+    env.reset()
+    env._deal_next_street()
+    player, opponent = env._seats
+    equity = env._compute_my_equity(player)
+    hits = cache.hits
+    # the same spot against other hole cards of the opponent
+    dealt = opponent.hand
+    opponent.hand = env._deck.cards[:2]
+    env._deck.cards[:2] = dealt
+    env._clear_equity_memo()
+    assert env._compute_my_equity(player) == equity
+    assert cache.hits == hits + 1
+
+def test_equity_prefetch():
+    env = TexasHoldemEnv(3, equity_steps=1000, equity_prefetch=True)
+    for i in range(3):
+        env.add_player(i, stack=2500, is_agent=(i == 0))
+    try:
+        env.reset()
+        env._deal_next_street()
+        prefetched = env.equity_prefetched
+        players = env._playing_players
+        futures = [env._equity_memo[env._equity_key(p)] for p in players]
+        equities = [env._compute_my_equity(p) for p in players]
+        assert equities == [f.result()[0] for f in futures]
+        assert env.equity_prefetched == prefetched + len(players)
+        env._compute_my_equity(players[0])
+        assert env.equity_memo_hits >= 1
+    finally:
+        env.close()
+
+def test_all_in_equity_payouts():
+    env = TexasHoldemEnv(3, equity_steps=1000, all_in_equity_reward=True)
+    for i in range(3):
+        env.add_player(i, stack=2500, is_agent=(i == 0))
+    env.reset()
+    players = env._playing_players
+    for player in players:
+        player.stack = 0
+    # main pot of all three players and a side pot of the two last ones
+    for player, lastsidepot in zip(players, (0, 1, 1)):
+        player.lastsidepot = lastsidepot
+    env._side_pots[:2] = [1501, 1000]
+    env.community = env._deck.draw(3)
+    env._resolve_hand(players)
+    stacks = [p.stack for p in players]
+    assert all(isinstance(stack, int) for stack in stacks)
+    assert sum(stacks) == 2501
+    assert stacks[0] <= 1501
+    # every runout of the turn and river is enumerated below the threshold
+    deck, community = env._deck.cards, env.community
+    expected = env.equity.get_expected_payouts(
+        [p.hand for p in players], [[0, 1, 2], [1, 2]], [1501, 1000],
+        community, deck, exact=True)
+    assert all(abs(stack - payout) < 1
+               for stack, payout in zip(stacks, expected))
+
+def test_hand_strength_features():
+    env = TexasHoldemEnv(2, equity_steps=200, hand_strength_features=True)
+    for i in range(2):
+        env.add_player(i, stack=2500, is_agent=(i == 0))
+    observation, _ = env.reset()
+    assert len(observation) == len(env.observation_space) == 4
+    assert env.observation_space[3].contains(
+        observation[3].astype(np.float32))
+    env._deal_next_street()
+    features = env._get_current_player_state(env._seats[0])[3]
+    assert features is env._hand_strength(env._seats[0])
+    assert np.isclose(features[2:].sum(), 1.)
+
+def test_bucket_features():
+    env = TexasHoldemEnv(3, equity_steps=200, bucket_features=True)
+    for i in range(3):
+        env.add_player(i, stack=2500, is_agent=(i == 0))
+    observation, (player_states, _) = env.reset()
+    assert env.observation_space[3].contains(observation[3])
+    assert observation[3] == env.equity.get_bucket(env._seats[0].hand, [])
+    assert all(len(features) == 9 and features[8] >= 0
+               for features, _ in player_states)
+    # folded players get a bucket of their own within the space
+    env.step([action_table.CALL, 0])
+    folded = env._current_player
+    env.step([action_table.FOLD, 0])
+    assert env._bucket(folded) == FOLDED_BUCKET
+    assert env.observation_space[3].contains(env._bucket(folded))
+
+def test_seed_reproducible():
+    def play(seed, prefetch=False):
+        random.seed(1)
+        np.random.seed(1)
+        env = TexasHoldemEnv(3, equity_steps=100, equity_prefetch=prefetch)
+        for i in range(3):
+            env.add_player(i, stack=2500, is_agent=(i == 0))
+        if seed is not None:
+            env.seed(seed)
+        observations = []
+        for _ in range(3):
+            observations.append(env.reset()[0])
+            done = False
+            while not done:
+                observation, _, done, _ = env.step(
+                    safe_action(None, env.tocall, 3))
+                observations.append(observation)
+        env.close()
+        return observations
+    # shuffles and equities come from the global random states or from
+    # env.seed
+    assert play(None) == play(None)
+    assert play(0) == play(0)
+    assert play(0) != play(1)
+    # prefetch threads sample from seeds of their own
+    assert play(0, prefetch=True) == play(0, prefetch=True)
+
+def test_get_set_state():
+    env = TexasHoldemEnv(3, equity_steps=100)
+    for i in range(3):
+        env.add_player(i, stack=2500, is_agent=(i == 0))
+    env.seed(1)
+    env.reset()
+    env.step(safe_action(env.current_player_id, env.tocall, 3))
+    state = env.get_state()
+
+    def play_out():
+        done = False
+        while not done:
+            _, _, done, _ = env.step(
+                safe_action(env.current_player_id, env.tocall, 3))
+        # equities are sampled again from the restored equity RNG
+        return ([p.stack for p in env._seats], list(env.community),
+                [p.equity for p in env._seats])
+    result = play_out()
+    env.reset()
+    next_hand = [p.hand for p in env._seats]
+
+    # snapshots are immutable
+    with pytest.raises(TypeError):
+        state.seats.stack[0] = 0
+    with pytest.raises(ValueError):
+        state.seats.as_numpy()['stack'][0] = 0
+
+    env.set_state(state)
+    assert env.get_state().deck == state.deck
+    assert env.get_state().seats.stack == state.seats.stack
+    assert env.equity.get_rng_state() == state.equity_rng_state
+    assert play_out() == result
+    # the deck of the next hand comes from the restored RNG
+    env.reset()
+    assert [p.hand for p in env._seats] == next_hand
+
+    with pytest.raises(error.Error):
+        TexasHoldemEnv(2).set_state(state)
+
+def test_push_pop():
+    env = TexasHoldemEnv(3, equity_steps=100)
+    for i in range(3):
+        env.add_player(i, stack=500, is_agent=(i == 0))
+
+    def snapshot():
+        state = env.get_state()
+        # pop does not rewind the equity samplers
+        return (state._replace(seats=None, last_action=None,
+                               equity_rng_state=None),
+                {name: values.tolist()
+                 for name, values in state.seats.as_numpy().items()
+                 if name != 'equity'})
+
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        env.reset()
+        start, states = snapshot(), []
+        while True:
+            states.append(snapshot())
+            player = env._current_player
+            actions = [safe_action(None, env.tocall, 3), [3, 0]]
+            raise_to = max(env._minraise, env._bigblind)
+            if raise_to <= player.max_bet:
+                actions.append([2, raise_to])
+            action = actions[rng.integers(len(actions))]
+            if action[0] == 3 and not env.tocall:
+                action = actions[0]
+            if env.push(action):
+                break
+        assert len(env._undo_log) == len(states)
+        while states:
+            env.pop()
+            assert snapshot() == states.pop()
+        assert snapshot() == start
+    with pytest.raises(IndexError):
+        env.pop()
+
 # Private methods
 
 def _unpack_state(state):
@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import multiprocessing
+import os
+import random
+import stat
+import tempfile
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import numpy as np
+import pytest
+
+from treys import Card, Deck, Evaluator
+
+from holdem import equity_pool
+from holdem.canonical import permute_suits
+from holdem.equity_cache import EquityCache
+from holdem.equity_evaluation import (Equity, available_backends,
+                                      fastest_backend)
+from holdem.equity_server import FAMILY, EquityServer, start_server
+from holdem.lut_evaluator import LookupEvaluator, build_tables, load_tables
+from holdem.payout import chip_payouts, expected_payouts
+from holdem.preflop import (PREFLOP_TABLE, N_CLASSES, PreflopEquityTable,
+                            class_hand, hand_class)
+from holdem.sampling import stratified_cards
+from holdem.shm_cache import SharedEquityCache, fingerprint
+from holdem.vectorized import VectorizedEvaluator
+
+
+def test_vectorized_evaluator_matches_treys():
+    evaluator = Evaluator()
+    vectorized = VectorizedEvaluator()
+    rng = random.Random(0)
+    full_deck = Deck.GetFullDeck()
+    for n_cards in (5, 6, 7):
+        hands = [rng.sample(full_deck, n_cards) for _ in range(2000)]
+        expected = [evaluator.evaluate(h[:2], h[2:]) for h in hands]
+        assert vectorized.evaluate_array(np.array(hands)).tolist() == expected
+
+
+def test_lookup_evaluator_matches_treys():
+    evaluator = Evaluator()
+    lookup = LookupEvaluator()
+    rng = random.Random(0)
+    full_deck = Deck.GetFullDeck()
+    spades = [c for c in full_deck if c & 0x1000]
+    for n_cards in (5, 6, 7):
+        hands = [rng.sample(full_deck, n_cards) for _ in range(2000)]
+        # Make sure flushes, straight flushes and wheels get covered
+        hands += [rng.sample(spades, 5) + rng.sample(full_deck, n_cards - 5)
+                  for _ in range(500)]
+        hands = [h for h in hands if len(set(h)) == n_cards]
+        expected = [evaluator.evaluate(h[:2], h[2:]) for h in hands]
+        assert [lookup.evaluate(h[:2], h[2:]) for h in hands] == expected
+        assert lookup.evaluate_array(np.array(hands)).tolist() == expected
+
+
+def test_lookup_tables_match_build():
+    for shipped, built in zip(load_tables(), build_tables()):
+        assert np.array_equal(shipped, built)
+
+
+def test_numpy_backend_matches_python_backend():
+    hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c'])
+    python = Equity(2000, backend='python')
+    numpy = Equity(20000, backend='numpy', seed=0)
+    assert abs(python.get_my_equity([hand], 3, community, deck)
+               - numpy.get_my_equity([hand], 3, community, deck)) < 0.05
+    villain = _cards(['Ts', '9s'])
+    deck = [c for c in deck if c not in villain]
+    assert np.allclose(
+        python._simulate_equities([hand, villain], community, deck,
+                                  2000).mean,
+        numpy._simulate_equities([hand, villain], community, deck,
+                                 20000).mean,
+        atol=0.05)
+
+
+def test_numpy_backend_on_river():
+    # Nut straight on the river can only chop
+    hand, community, deck = _spot(['Ah', 'Kd'],
+                                  ['Qs', 'Jh', 'Tc', '2d', '3s'])
+    assert Equity(1000, seed=0).get_my_equity([hand], 4, community,
+                                              deck) > 0.9
+    equities = Equity(1000, backend='numpy', seed=0)._simulate_equities(
+        [hand, _cards(['As', 'Kc'])], community, deck, 1000).mean
+    assert equities.tolist() == [0.5, 0.5]
+
+
+def test_exact_equities_on_turn():
+    hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c', '3s'])
+    villain = _cards(['Ts', '9s'])
+    deck = [c for c in deck if c not in villain]
+    evaluator = Evaluator()
+    expected = np.zeros(2)
+    for river in deck:
+        ranks = [evaluator.evaluate(h, community + [river])
+                 for h in (hand, villain)]
+        expected += (np.array(ranks) == min(ranks)) / ranks.count(min(ranks))
+    equity = Equity(100)
+    equities = equity.get_equities([hand, villain], community, deck, [])
+    assert np.allclose(equities, expected / len(deck))
+    assert np.array_equal(
+        equities, equity.get_equities([hand, villain], community, deck, []))
+
+
+def test_exact_my_equity_on_river():
+    hand, community, deck = _spot(['Ah', 'Kd'],
+                                  ['Qs', 'Jh', '2c', '3s', '9d'])
+    evaluator = Evaluator()
+    my_rank = evaluator.evaluate(hand, community)
+    shares = []
+    for i, card1 in enumerate(deck):
+        for card2 in deck[i + 1:]:
+            rank = evaluator.evaluate([card1, card2], community)
+            shares.append(1. if my_rank < rank else
+                          0.5 if my_rank == rank else 0.)
+    equity = Equity(1000)
+    assert equity._count_completions(2, community, deck) == len(shares)
+    assert equity.get_my_equity([hand], 2, community,
+                                deck) == pytest.approx(np.mean(shares))
+
+
+def test_pot_equities_share_runouts():
+    hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c'])
+    villains = [_cards(['Ts', '9s']), _cards(['2d', '2h'])]
+    deck = [c for c in deck if c not in villains[0] + villains[1]]
+    hands = [hand] + villains
+    pots = [[0, 1, 2], [0, 1]]
+    exact = Equity(100, exact_threshold=10**4)
+    main, side = exact.get_pot_equities(hands, pots, community, deck)
+    assert np.allclose(main, exact.get_equities(hands, community, deck, []))
+    assert np.allclose(side, exact.get_equities(hands[:2], community, deck,
+                                                []))
+    equity = Equity(2000, seed=0, exact_threshold=0)
+    ranks = equity.get_showdown_ranks(hands, community, deck)
+    assert ranks.shape == (2000, 3) and equity.n_simulated == 2000
+    main, side = equity.get_pot_equities(hands, pots, community, deck)
+    assert main.sum() == pytest.approx(1.) and side.sum() == pytest.approx(1.)
+    assert np.allclose(main, exact.get_equities(hands, community, deck, []),
+                       atol=0.03)
+
+
+def test_preflop_hand_classes():
+    assert [hand_class(class_hand(i)) for i in range(N_CLASSES)] == list(
+        range(N_CLASSES))
+    assert hand_class(_cards(['Ah', 'As'])) == 0
+    assert hand_class(_cards(['Kh', 'Ah'])) == hand_class(_cards(['As', 'Ks']))
+    assert hand_class(_cards(['Ah', 'Kd'])) != hand_class(_cards(['Ad', 'Kd']))
+
+
+def test_preflop_table_lookup():
+    hand, _, deck = _spot(['Ah', 'Ad'], [])
+    equity = Equity(100, preflop_table=PREFLOP_TABLE)
+    assert equity.get_my_equity([hand], 2, [], deck) == pytest.approx(
+        0.85, abs=0.01)
+    assert equity.get_my_equity([_cards(['7c', '2h'])], 2, [],
+                                deck) == pytest.approx(0.35, abs=0.01)
+    # more players than the table covers fall back to simulation
+    assert not PREFLOP_TABLE.covers(10)
+    assert not PreflopEquityTable('missing.npy').covers(1)
+
+
+def test_equity_cache_hits_isomorphic_spots():
+    cache = EquityCache()
+    hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c'])
+    first = Equity(1000, cache=cache).get_my_equity([hand], 3, community,
+                                                     deck)
+    # same spot with hearts and spades swapped, from another Equity
+    swap = {1: 2, 2: 1, 4: 4, 8: 8}
+    hand, community, deck = (permute_suits(hand, swap),
+                             permute_suits(community, swap),
+                             permute_suits(deck, swap))
+    assert Equity(1000, cache=cache).get_my_equity(
+        [hand], 3, community, deck) == first
+    # a different opponent count is a different entry
+    Equity(1000, cache=cache).get_my_equity([hand], 2, community, deck)
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+    villain = _cards(['Ts', '9s'])
+    deck = [c for c in deck if c not in villain]
+    equity = Equity(1000, cache=cache)
+    assert np.array_equal(equity.get_equities([hand, villain], community,
+                                              deck, []),
+                          equity.get_equities([hand, villain], community,
+                                              deck, []))
+    assert cache.stats()['hits'] == 2
+
+
+def test_equity_cache_eviction():
+    cache = EquityCache(max_bytes=3 * EquityCache.ENTRY_BYTES)
+    for key in range(5):
+        cache.put(key, key / 10)
+    assert cache.get(0) is None
+    assert cache.get(4) == 0.4
+    cache.get(2)
+    cache.put(5, 0.5)
+    assert cache.get(3) is None
+    assert len(cache) == 3
+    assert cache.evictions == 3
+
+
+def test_shared_equity_cache_across_processes():
+    cache = SharedEquityCache(max_bytes=2**20)
+    try:
+        with multiprocessing.get_context('spawn').Pool(2) as pool:
+            # workers get the cache by name and fill it
+            pool.map(_fill_shared_cache, [(cache, i) for i in range(4)])
+        assert len(cache) == 5
+        assert cache.get(('my', (1, 2, 3, 4), 2)) == pytest.approx((0.5, 0.))
+        assert cache.get(('all', (3,))) == pytest.approx((0.25, 0.75))
+        attached = SharedEquityCache.attach(cache.name)
+        assert attached.get(('all', (0,))) == pytest.approx((0., 1.))
+        assert attached.stats()['hits'] == 1 and cache.stats()['hits'] == 2
+        # a slot torn by concurrent writers reads as a miss
+        index = next(i for i in range(cache.n_slots)
+                     if cache._keys[i] == fingerprint(('all', (1,))))
+        cache._values[index, 0] = 0.3
+        assert attached.get(('all', (1,))) is None
+        attached.close()
+        hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c'])
+        first = Equity(1000, cache=cache).get_my_equity([hand], 3, community,
+                                                         deck)
+        assert Equity(1000, cache=cache).get_my_equity(
+            [hand], 3, community, deck) == first
+    finally:
+        cache.close()
+        cache.unlink()
+
+
+def test_adaptive_equity_stops_at_target_precision():
+    hand, community, deck = _spot(['Ah', 'Kd'],
+                                  ['Qs', 'Jh', 'Tc', '2d', '3s'])
+    equity = Equity(100000, seed=0, exact_threshold=0, target_stderr=0.005)
+    nuts, nuts_error = equity.get_my_equity_with_error([hand], 3, community,
+                                                       deck)
+    assert nuts_error <= 0.005
+    clear_cut_samples = equity.n_simulated
+    assert clear_cut_samples < 5000
+
+    hand, community, deck = _spot(['7h', '8h'], ['9h', 'Tc', '2h'])
+    equity.n_simulated = 0
+    draw, draw_error = equity.get_my_equity_with_error([hand], 3, community,
+                                                       deck)
+    assert draw_error <= 0.005
+    assert clear_cut_samples < equity.n_simulated < 100000
+
+
+def test_pool_backend():
+    hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c'])
+    equity_pool.shutdown()
+    # small budgets never start the pool
+    small = Equity(1000, backend='pool', seed=0, pool_workers=2)
+    small.get_my_equity([hand], 3, community, deck)
+    assert equity_pool._executor is None
+    try:
+        pool = Equity(Equity.POOL_MIN_SAMPLES, backend='pool', seed=0,
+                      pool_workers=2)
+        pooled = pool.get_my_equity([hand], 3, community, deck)
+        assert equity_pool._executor is not None
+        assert pool.n_simulated == Equity.POOL_MIN_SAMPLES
+        assert abs(pooled - Equity(Equity.POOL_MIN_SAMPLES, seed=1)
+                   .get_my_equity([hand], 3, community, deck)) < 0.02
+        # shards of the next query use fresh seeds
+        assert pool.get_my_equity([hand], 3, community, deck) != pooled
+    finally:
+        equity_pool.shutdown()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Equity(backend='fortran')
+    with pytest.raises(ValueError):
+        Equity(sampling='sobol')
+
+
+def test_stratified_sampling():
+    deck = Deck.GetFullDeck()[:20]
+    drawn = stratified_cards(np.random.default_rng(0), deck, 2000, 5)
+    assert all(len(set(row)) == 5 and set(row) <= set(deck)
+               for row in drawn.tolist())
+    # every card is dealt first in exactly 1 / 20 of the samples
+    assert set(np.unique(drawn[:, 0], return_counts=True)[1]) == {100}
+    hand, community, deck = _spot(['7h', '8h'], ['9h', 'Tc', '2h'])
+    villain = _cards(['As', 'Ad'])
+    deck = [c for c in deck if c not in villain]
+    exact = Equity(100, exact_threshold=10**4).get_equities(
+        [hand, villain], community, deck, [])
+    for backend in ('python', 'lut'):
+        equity = Equity(1000, backend=backend, seed=0, exact_threshold=0,
+                        sampling='stratified')
+        assert np.allclose(equity.get_equities([hand, villain], community,
+                                               deck, []), exact, atol=0.02)
+
+
+def test_backends_honour_dead_cards():
+    hand, community, deck = _spot(['Ah', 'Kd'], ['2s', '3s', '4d', '9c'])
+    villain = _cards(['Qc', 'Qd'])
+    deck = [c for c in deck if c not in villain]
+    # every out left (aces, kings and fives) is dead
+    dead = _cards(['As', 'Ac', 'Ad', 'Ks', 'Kh', 'Kc', '5s', '5h', '5d', '5c'])
+    for backend in available_backends():
+        equity = Equity(1000, backend=backend, seed=0, exact_threshold=0)
+        assert equity.get_equities([hand, villain], community, deck,
+                                   dead).tolist() == [0., 1.]
+    assert Equity(1000).get_equities([hand, villain], community, deck,
+                                     dead).tolist() == [0., 1.]
+
+
+def test_auto_backend():
+    assert fastest_backend() in available_backends()
+    assert {'python', 'numpy', 'lut'} <= set(available_backends())
+    hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c'])
+    # same samples and same ranks
+    assert (Equity(1000, backend='lut', seed=0).get_my_equity(
+                [hand], 3, community, deck)
+            == Equity(1000, backend='numpy', seed=0).get_my_equity(
+                [hand], 3, community, deck))
+    if 'pbots' not in available_backends():
+        with pytest.raises(ValueError):
+            Equity(backend='pbots')
+
+
+def test_chip_payouts():
+    assert chip_payouts([100 / 3] * 3).tolist() == [34, 33, 33]
+    assert chip_payouts([100 / 3] * 3, priority=[2, 1, 0]).tolist() == [
+        33, 33, 34]
+    assert chip_payouts([0.6, 0.6, 0.8]).tolist() == [1, 0, 1]
+    assert chip_payouts([12.5, 20, 7.5]).tolist() == [13, 20, 7]
+    # two runouts: hand 0 wins the main pot once and ties it once, hand 2
+    # only contests the main pot
+    ranks = [[1, 2, 3], [5, 5, 9]]
+    payouts = expected_payouts(ranks, [[0, 1, 2], [0, 1]], [90, 40])
+    assert np.allclose(payouts, [(130 + 65) / 2, 65 / 2, 0])
+
+
+def test_batch_queries():
+    hands = [_cards(['Ah', 'Kd']), _cards(['7h', '8h']), _cards(['2c', '2d'])]
+    communities = [_cards(['Qs', 'Jh', '2c']),
+                   _cards(['9h', 'Tc', '2h', 'Kd']),
+                   _cards(['Ks', 'Kc', '3d', '4h', '5s'])]
+    dead = [_cards(['Ac']), [], _cards(['As', 'Ad'])]
+    n_players = [3, 2, 2]
+    exact = Equity(exact_threshold=10**6)
+    for sampling in ('random', 'stratified'):
+        equity = Equity(4000, seed=0, sampling=sampling, exact_threshold=0)
+        equities = equity.get_my_equity_batch(hands, n_players, communities,
+                                              dead)
+        assert equities.shape == (3,)
+        assert equity.n_simulated == 3 * 4000
+        for i in range(3):
+            deck = [c for c in Deck.GetFullDeck()
+                    if c not in hands[i] + communities[i] + dead[i]]
+            expected = (Equity(20000, seed=1) if n_players[i] > 2
+                        else exact).get_my_equity(
+                [hands[i]], n_players[i], communities[i], deck)
+            assert abs(equities[i] - expected) < 0.02
+    # preflop queries are looked up
+    equity = Equity(10, preflop_table=PREFLOP_TABLE)
+    assert (equity.get_my_equity_batch([hands[0]], 4, [[]])[0]
+            == PREFLOP_TABLE.get_equity(hands[0], 3))
+    assert equity.n_simulated == 0
+
+    # the heads-up river query is enumerated like in get_my_equity and the
+    # answers are cached
+    equity = Equity(4000, seed=0, cache=EquityCache())
+    equities, errors = equity.get_my_equity_batch(
+        hands, n_players, communities, dead, with_error=True)
+    assert equity.n_simulated == 2 * 4000
+    assert errors[2] == 0 and np.all(errors[:2] > 0)
+    assert np.all(errors[:2] < 0.01)
+    assert equities[2] == exact.get_my_equity(
+        [hands[2]], 2, communities[2],
+        [c for c in Deck.GetFullDeck()
+         if c not in hands[2] + communities[2] + dead[2]])
+    again = equity.get_my_equity_batch(hands, n_players, communities, dead,
+                                       with_error=True)
+    assert equity.n_simulated == 2 * 4000
+    assert np.array_equal(again[0], equities)
+
+    # queries without opponents win like in get_my_equity
+    equity = Equity(4000, seed=0)
+    assert equity.get_my_equity_batch(hands, 1, communities,
+                                      dead).tolist() == [1.] * 3
+    assert equity.get_my_equity_batch(
+        hands, [1, 2, 1], communities, dead)[[0, 2]].tolist() == [1., 1.]
+    assert equity.n_simulated == 4000
+
+    villains = [_cards(['Qc', 'Qd']), _cards(['As', 'Ad'])]
+    communities = communities[:2]
+    equities = Equity(4000, seed=0).get_equities_batch(
+        [[hands[i], villains[i]] for i in range(2)], communities)
+    for i in range(2):
+        deck = [c for c in Deck.GetFullDeck()
+                if c not in hands[i] + villains[i] + communities[i]]
+        assert np.allclose(equities[i], exact.get_equities(
+            [hands[i], villains[i]], communities[i], deck, []), atol=0.02)
+
+
+def test_equity_server():
+    address = os.path.join(tempfile.mkdtemp(), 'equity.sock')
+    server, authkey = start_server(address, backend='lut', seed=0)
+    try:
+        hand, community, deck = _spot(['Ah', 'Kd'], ['Qs', 'Jh', '2c'])
+        equity = Equity(1000, backend='server', server_address=address,
+                        server_authkey=authkey)
+        # suit isomorphic queries sent together are evaluated once
+        same_hand, same_community, same_deck = _spot(['As', 'Kh'],
+                                                     ['Qd', 'Js', '2c'])
+        futures = [equity.submit_my_equity([hand], 3, community, deck)
+                   for _ in range(10)]
+        futures.append(equity.submit_my_equity(
+            [same_hand], 3, same_community, same_deck))
+        results = [future.result() for future in futures]
+        assert len(set(results)) == 1
+        local = Equity(1000, backend='lut', seed=0).get_my_equity(
+            [hand], 3, community, deck)
+        assert abs(results[0][0] - local) < 0.05
+        villain = _cards(['Qc', 'Qh'])
+        deck = [c for c in deck if c not in villain]
+        assert np.allclose(
+            equity.get_equities([hand, villain], community, deck, []),
+            Equity(exact_threshold=10**4).get_equities(
+                [hand, villain], community, deck, []))
+        stats = equity._client.stats()
+        assert stats['requests'] == 12
+        assert stats['evaluated'] < stats['requests']
+
+        # distinct queries sent together go through one batch call
+        futures = [equity.submit_my_equity([_cards([first, 'Kd'])], 2,
+                                           community, deck)
+                   for first in ('As', 'Ac', 'Th', '9s')]
+        assert all(0 < future.result()[0] < 1 for future in futures)
+        assert equity._client.stats()['batched'] >= 2
+
+        # malformed requests get an error and leave the server running
+        connection = Client(address, FAMILY, authkey=authkey)
+        connection.send('garbage')
+        assert connection.recv()[:2] == (None, False)
+        connection.send((7, 'get_my_equity_with_error', (1000,), ()))
+        assert connection.recv()[:2] == (7, False)
+        connection.send((8, 'get_my_equity_with_error',
+                         (1000, 1000, None, 'random'), (1, 2, 3, 4)))
+        assert connection.recv()[:2] == (8, False)
+        connection.close()
+        assert equity.submit_my_equity([hand], 4, community,
+                                       deck).result()[0] > 0
+        # clients without the key are turned away, the socket is private
+        with pytest.raises(AuthenticationError):
+            Client(address, FAMILY, authkey=b'wrong')
+        assert stat.S_IMODE(os.stat(address).st_mode) == 0o600
+        assert equity.submit_my_equity([hand], 4, community,
+                                       deck).result()[0] > 0
+        equity.close()
+    finally:
+        server.terminate()
+    with pytest.raises(ValueError):
+        Equity(backend='server')
+    # only a stale socket is replaced
+    os.unlink(address)
+    with open(address, 'w') as f:
+        f.write('data')
+    with pytest.raises(FileExistsError):
+        EquityServer(address)
+
+
+# Private methods
+
+def _cards(strs):
+    return [Card.new(s) for s in strs]
+
+
+def _fill_shared_cache(args):
+    cache, i = args
+    cache.put(('all', (i,)), (i / 12, 1 - i / 12))
+    cache.put(('my', (1, 2, 3, 4), 2), (0.5, 0.))
+
+
+def _spot(hand, community):
+    hand = _cards(hand)
+    community = _cards(community)
+    deck = [c for c in Deck.GetFullDeck() if c not in hand + community]
+    return hand, community, deck
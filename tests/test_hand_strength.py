@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import numpy as np
+
+from treys import Card, Deck
+
+from holdem.equity_evaluation import Equity
+from holdem.hand_strength import (HAND_STRENGTH_TABLES, HISTOGRAM_BINS,
+                                  N_FEATURES, HandStrengthTable, build_table,
+                                  hand_strength)
+from holdem.lut_evaluator import LookupEvaluator
+from holdem.preflop import PREFLOP_TABLE
+
+
+def test_river_strength_is_equity():
+    hand, community = _cards(['7h', '8h']), _cards(['9h', 'Tc', '2h', 'Kd',
+                                                    '3s'])
+    deck = [c for c in Deck.GetFullDeck() if c not in hand + community]
+    features = hand_strength(LookupEvaluator(), np.random.default_rng(0),
+                             hand, community, 100)
+    equity = Equity(exact_threshold=10**4).get_my_equity([hand], 2,
+                                                         community, deck)
+    assert np.isclose(features[0], equity)
+    assert np.isclose(features[1], equity ** 2)
+    assert features[2 + int(equity * HISTOGRAM_BINS)] == 1.
+
+
+def test_turn_features():
+    hand, community = _cards(['7h', '8h']), _cards(['9h', 'Tc', '2h', 'Kd'])
+    features = Equity(1000).get_hand_strength(hand, community)
+    made = Equity(1000).get_hand_strength(_cards(['Jd', 'Jc']), community)
+    assert features.shape == made.shape == (N_FEATURES,)
+    assert np.isclose(features[2:].sum(), 1.)
+    # a draw is strong or weak on the river, rarely in between
+    assert features[2:4].sum() + features[-1] > 0.75
+    assert features[1] - features[0] ** 2 > made[1] - made[0] ** 2 + 0.05
+
+
+def test_tables(tmp_path):
+    table = HandStrengthTable('preflop', str(tmp_path))
+    assert not table.available
+    keys, features = build_table('preflop', n_runouts=100, processes=1)
+    table.save(keys=keys, features=features)
+    assert table.available
+    features = table.lookup(_cards(['As', 'Ad']), [])
+    assert np.array_equal(features, table.lookup(_cards(['Ah', 'Ac']), []))
+    assert table.lookup(_cards(['As', 'Ad']), _cards(['2c', '3c', '4c'])
+                        ) is None
+    # the shipped preflop table agrees with the preflop equity table
+    shipped = HAND_STRENGTH_TABLES[0]
+    assert shipped.available
+    for hand in (['As', 'Ad'], ['7h', '2c'], ['Ks', 'Qs']):
+        assert abs(shipped.lookup(_cards(hand), [])[0]
+                   - PREFLOP_TABLE.get_equity(_cards(hand), 1)) < 0.015
+
+
+# Private methods
+
+def _cards(strs):
+    return [Card.new(s) for s in strs]
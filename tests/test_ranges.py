@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import random
+
+import numpy as np
+import pytest
+
+from treys import Card, Deck, Evaluator
+
+from holdem.equity_evaluation import Equity
+from holdem.ranges import (COMBOS, N_COMBOS, card_mask, combo_index,
+                           hand_range, remove_cards, top_range, uniform_range)
+
+
+def test_combos():
+    assert len(COMBOS) == N_COMBOS == len(set(map(frozenset,
+                                                  COMBOS.tolist())))
+    hand = _cards(['Ah', 'Kd'])
+    assert combo_index(hand) == combo_index(hand[::-1])
+    assert remove_cards(uniform_range(), hand).sum() == N_COMBOS - 101
+    assert card_mask(hand) == card_mask(COMBOS[combo_index(hand)].tolist())
+    assert top_range(0.5).sum() == N_COMBOS // 2
+    assert top_range(0.01)[combo_index(_cards(['As', 'Ad']))] == 1.
+
+
+def test_range_equity_matches_brute_force():
+    rng = random.Random(0)
+    full_deck = Deck.GetFullDeck()
+    cards = rng.sample(full_deck, 6)
+    hand, community = cards[:2], cards[2:]
+    deck = [c for c in full_deck if c not in cards]
+    weights = np.random.default_rng(0).random(N_COMBOS) * (
+        np.random.default_rng(1).random(N_COMBOS) < 0.3)
+    evaluator = Evaluator()
+    shares = total = 0.
+    for river in deck:
+        board = community + [river]
+        my_rank = evaluator.evaluate(hand, board)
+        for weight, combo in zip(weights, COMBOS.tolist()):
+            if weight and not set(combo) & set(hand + board):
+                rank = evaluator.evaluate(combo, board)
+                total += weight
+                shares += weight * (1. if my_rank < rank else
+                                    0.5 if my_rank == rank else 0.)
+    equity = Equity(100)
+    assert equity.get_range_equity(hand, weights, community,
+                                   deck) == pytest.approx(shares / total)
+    # the batch API shares runouts between hands and skips blocked ones
+    other = [c for c in deck if c not in hand][:2]
+    batch = equity.get_range_equities([hand, other, community[:2]], weights,
+                                      community, deck)
+    assert batch[0] == pytest.approx(shares / total)
+    assert batch[1] == pytest.approx(equity.get_range_equity(
+        other, weights, community, deck))
+    assert np.isnan(batch[2])
+
+
+def test_range_equity_budget():
+    hand = _cards(['Ah', 'Kd'])
+    community = _cards(['Qs', 'Jh', '2c'])
+    deck = [c for c in Deck.GetFullDeck() if c not in hand + community]
+    # the 1081 runouts of the flop are enumerated within the budget
+    equity = Equity(2000)
+    exact = equity.get_range_equity(hand, uniform_range(), community, deck)
+    assert equity.n_simulated == 0
+    # sampled runouts follow n_evaluations and target_stderr
+    equity = Equity(1000, exact_threshold=0, seed=0)
+    assert equity.get_range_equity(hand, uniform_range(), community,
+                                   deck) == pytest.approx(exact, abs=0.015)
+    assert equity.n_simulated == 1000
+    equity = Equity(20000, exact_threshold=0, target_stderr=0.01, seed=0)
+    assert equity.get_range_equity(hand, uniform_range(), community,
+                                   deck) == pytest.approx(exact, abs=0.03)
+    assert equity.n_simulated < 20000
+
+
+def test_range_vs_range_on_river():
+    community = _cards(['Qs', 'Jh', '2c', '3s', '9d'])
+    deck = [c for c in Deck.GetFullDeck() if c not in community]
+    strong, weak = top_range(0.1), uniform_range()
+    equity = Equity(100)
+    assert (equity.get_range_equity(strong, weak, community, deck)
+            + equity.get_range_equity(weak, strong, community, deck)
+            == pytest.approx(1.))
+    hand = _cards(['Ah', 'Kd'])
+    assert equity.get_range_equity(
+        hand, hand_range([_cards(['Tc', '9c'])]), community,
+        deck) == 0.
+    with pytest.raises(ValueError):
+        equity.get_range_equity(strong, [weak, weak], community, deck)
+
+
+def test_multiway_range_equity():
+    hand = _cards(['Ah', 'Kd'])
+    community = _cards(['Qs', 'Jh', '2c'])
+    deck = [c for c in Deck.GetFullDeck() if c not in hand + community]
+    equity = Equity(20000, seed=0)
+    assert equity.get_range_equity(
+        hand, [uniform_range()] * 2, community, deck) == pytest.approx(
+            equity.get_my_equity([hand], 3, community, deck), abs=0.02)
+    # opponents always holding aces
+    aces = hand_range([_cards(['As', 'Ac']), _cards(['Ac', 'Ad']),
+                       _cards(['As', 'Ad'])])
+    assert equity.get_range_equity(hand, [aces, uniform_range()], community,
+                                   deck) < 0.2
+
+
+# Private methods
+
+def _cards(strs):
+    return [Card.new(s) for s in strs]
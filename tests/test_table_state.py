@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import pickle
+
+import pytest
+from treys import Card
+
+from holdem.env import TexasHoldemEnv
+from holdem.player import Player
+from holdem.table_state import TableState
+
+
+def test_player_view():
+    state = TableState(3)
+    player = Player(7, stack=100, state=state, slot=1)
+    assert state.player_id[1] == 7 and state.stack[1] == 100
+    assert player.hand == [] and player.isallin is False
+
+    hand = [Card.new('Ah'), Card.new('Kd')]
+    player.hand = hand
+    player.declare_action(100)
+    assert player.hand == hand
+    assert player.isallin and state.isallin[1] == 1
+    assert (state.stack[1], state.currentbet[1]) == (0, 100)
+    # the other slots are untouched
+    assert list(state.stack) == [0, 0, 0]
+    assert Player(1).stack == 2500
+
+
+def test_fractional_chips():
+    # chips are whole numbers, fractions raise instead of being lost
+    player = Player(0, stack=2500.)
+    assert player.stack == 2500 and isinstance(player.stack, int)
+    player.refund(10.)
+    assert player.stack == 2510
+    with pytest.raises(ValueError):
+        player.refund(0.5)
+    assert player.stack == 2510
+    with pytest.raises(ValueError):
+        Player(0, stack=2500.5)
+    env = TexasHoldemEnv(2)
+    with pytest.raises(ValueError):
+        env.add_player(0, stack=99.9)
+
+
+def test_copy_and_numpy_views():
+    state = TableState(2)
+    players = [Player(i, stack=50, state=state, slot=i) for i in range(2)]
+    snapshot = state.copy()
+    players[0].stack = 10
+    players[1].equity = 0.25
+    assert snapshot.stack[0] == 50 and snapshot.equity[1] == 0.
+
+    arrays = state.as_numpy()
+    assert arrays['stack'].tolist() == [10, 50]
+    arrays['stack'][1] = 20
+    assert players[1].stack == 20
+
+    state.copy_from(snapshot)
+    assert [p.stack for p in players] == [50, 50]
+    assert players[1].equity == 0.
+
+
+def test_freeze_and_thaw():
+    state = TableState(2)
+    players = [Player(i, stack=50, state=state, slot=i) for i in range(2)]
+    frozen = state.freeze()
+    players[0].stack = 10
+    players[1].isallin = True
+    assert frozen.n_seats == 2
+    assert frozen.as_numpy()['stack'].tolist() == [50, 50]
+    with pytest.raises(TypeError):
+        frozen.stack[0] = 0
+
+    state.thaw(frozen)
+    assert [p.stack for p in players] == [50, 50]
+    assert not players[1].isallin
+    assert pickle.loads(pickle.dumps(state)).freeze() == frozen
+    with pytest.raises(ValueError):
+        TableState(3).thaw(frozen)
+
+
+def test_env_seats_share_state():
+    env = TexasHoldemEnv(3)
+    env.add_player(0, stack=500)
+    env.add_player(2, stack=700)
+    assert list(env._state.stack) == [500, 0, 700]
+    assert list(env._state.emptyplayer) == [0, 1, 0]
+    env.remove_player(2)
+    assert list(env._state.emptyplayer) == [0, 1, 1]
+
+
+def test_journal_undo():
+    state = TableState(2)
+    player = Player(0, stack=100, state=state, slot=1)
+    state.journal = journal = []
+    player.declare_action(40)
+    player.hand = [Card.new('Ah'), Card.new('Kd')]
+    state.journal = None
+    assert (player.stack, player.currentbet) == (60, 40)
+    state.undo(journal)
+    assert (player.stack, player.currentbet, player.hand) == (100, 0, [])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 Aleksander Beloi (beloi.alex@gmail.com)
+# Copyright (c) 2018 Sam Wenke (samwenke@gmail.com)
+# Copyright (c) 2019 Ingvar Lond (ingvar.lond@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import tempfile
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from holdem.env import Street
+from holdem.equity_cache import EquityCache
+from holdem.equity_server import start_server
+from holdem.utils import action_table, safe_action
+from holdem.vec_env import SubprocVecTexasHoldemEnv, VecTexasHoldemEnv
+
+
+def test_vec_env():
+    vec_env = VecTexasHoldemEnv(4, 3, equity_steps=100)
+    observations = vec_env.reset()
+    assert observations.shape == (4, 3)
+    assert np.all((observations[:, 0] >= 0) & (observations[:, 0] <= 1))
+
+    batches = []
+    get_my_equity_batch = vec_env.equity.get_my_equity_batch
+
+    def counted(*args):
+        batches.append(len(args[0]))
+        return get_my_equity_batch(*args)
+    vec_env.equity.get_my_equity_batch = counted
+
+    finished = 0
+    for _ in range(40):
+        del batches[:]
+        observations, rewards, dones, infos = vec_env.step(
+            [safe_action(None, tocall, 3)
+             for tocall in vec_env.tocalls.tolist()])
+        assert observations.shape == (4, 3) and rewards.shape == (4,)
+        # every table's equities come from at most three batched calls
+        assert len(batches) <= 3
+        for done, reward, info in zip(dones, rewards, infos):
+            if done:
+                finished += 1
+                assert info['terminal_observation'].shape == (3,)
+            else:
+                assert reward == 0
+    assert finished == vec_env.n_hands > 0
+    # finished tables were reset
+    assert all(env._street != Street.SHOWDOWN for env in vec_env.envs)
+    assert all(env.equity_memo_hits > 0 for env in vec_env.envs)
+    with pytest.raises(ValueError):
+        VecTexasHoldemEnv(2, 2, equity_prefetch=True)
+
+    # the batched read of each table's reset is a miss, not a hit
+    vec_env = VecTexasHoldemEnv(4, 3, equity_steps=100)
+    vec_env.reset()
+    for env in vec_env.envs:
+        assert (env.equity_memo_misses, env.equity_memo_hits) == (1, 0)
+        assert env.equity_runs_avoided == 0
+
+
+def test_vec_env_equity_options():
+    cache = EquityCache()
+    vec_env = VecTexasHoldemEnv(2, 2, equity_steps=100, equity_cache=cache,
+                                preflop_equity_table=False)
+    vec_env.reset()
+    assert cache.stats()['entries'] == 2
+
+    address = os.path.join(tempfile.mkdtemp(), 'equity.sock')
+    server, authkey = start_server(address, backend='lut', seed=0)
+    try:
+        vec_env = VecTexasHoldemEnv(2, 2, equity_steps=100,
+                                    equity_backend='server',
+                                    equity_server=address,
+                                    equity_server_authkey=authkey,
+                                    preflop_equity_table=False)
+        observations = vec_env.reset()
+        assert np.all((observations[:, 0] > 0) & (observations[:, 0] < 1))
+        assert vec_env.equity._client.stats()['requests'] == 2
+        vec_env.close()
+    finally:
+        server.terminate()
+
+
+def test_subproc_vec_env():
+    vec_env = SubprocVecTexasHoldemEnv(4, 3, n_workers=2, equity_steps=100)
+    try:
+        observations = vec_env.reset()
+        assert observations.shape == (4, 3)
+        assert np.all(observations[:, 1] > 0)
+        finished = 0
+        for _ in range(40):
+            observations, rewards, dones, infos = vec_env.step(
+                [safe_action(None, tocall, 3)
+                 for tocall in vec_env.tocalls.tolist()])
+            assert observations.shape == (4, 3) and dones.shape == (4,)
+            for done, reward, info in zip(dones, rewards, infos):
+                assert ('terminal_observation' in info) == done
+                if not done:
+                    assert reward == 0
+            finished += dones.sum()
+        assert finished == vec_env.n_hands > 0
+        name = vec_env._shared.name
+    finally:
+        vec_env.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name)
+
+    # the error of a worker is raised with its traceback
+    vec_env = SubprocVecTexasHoldemEnv(2, 2, n_workers=2, equity_steps=100)
+    try:
+        vec_env.reset()
+        with pytest.raises(RuntimeError, match='minraise'):
+            vec_env.step([[action_table.RAISE, 1]] * 2)
+    finally:
+        vec_env.close()
+    with pytest.raises(ValueError):
+        SubprocVecTexasHoldemEnv(2, 2, equity_cache=EquityCache())
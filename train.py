@@ -59,11 +59,14 @@ def play_out_hand(env, n_seats, verbose=True):
             env.render(mode='human')
 
 
-env = gym.make('TexasHoldem-v1', n_seats=2, equity_steps=100)
+# Equities of each new street are computed while the agent picks actions
+env = gym.make('TexasHoldem-v1', n_seats=2, equity_steps=100,
+               equity_prefetch=True)
 env.add_player(agent_id, stack=2000, is_agent=True)
 env.add_player(agent_id+1, stack=2000)
 tic = time()
 for i in range(100):
     play_out_hand(env, env.n_seats, verbose=False)
     print(f'Training for {time()-tic}')
+env.close()
 agent.model.save('dqn_100_it.h5')